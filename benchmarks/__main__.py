@@ -0,0 +1,93 @@
+"""
+Run the micro-benchmarks and write the results as JSON, to compare performance between commits.
+
+    python -m benchmarks --output results.json
+    python -m benchmarks --filter grpc --compare results.json
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+
+from benchmarks.hot_paths import BENCHMARKS
+
+
+def run_benchmark(setup, repeat, min_time):
+    """
+    Time a benchmark, the number of loops per repeat is calibrated so each repeat takes at least `min_time` seconds.
+    Returns the time per call, in nanoseconds, of each repeat.
+    """
+    timer = timeit.Timer(setup())
+    loops = 1
+    while True:
+        if timer.timeit(loops) >= min_time:
+            break
+        loops *= 2
+    return loops, [duration / loops * 10 ** 9 for duration in timer.repeat(repeat=repeat, number=loops)]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _compare(results, baseline_path):
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)['benchmarks']
+    print(f"\n{'benchmark':<60} {'baseline ns':>12} {'ns':>12} {'change':>8}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]['median_ns'], result['median_ns']
+        print(f'{name:<60} {before:>12.0f} {after:>12.0f} {(after - before) / before:>+8.1%}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='file to write the JSON results to, defaults to stdout')
+    parser.add_argument('--filter', default='', help='only run benchmarks with names containing this')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timed repeats of each benchmark')
+    parser.add_argument('--min-time', type=float, default=0.2, help='minimum seconds per repeat')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if args.filter not in name:
+            continue
+        loops, timings = run_benchmark(setup, args.repeat, args.min_time)
+        results[name] = {
+            'loops': loops,
+            'repeat': args.repeat,
+            'min_ns': min(timings),
+            'median_ns': statistics.median(timings),
+            'max_ns': max(timings)
+        }
+        print(f"{name:<60} {results[name]['median_ns']:>12.0f} ns", file=sys.stderr)
+
+    output = json.dumps({
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'benchmarks': results
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        _compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Local stand-in for the Stackdriver Trace API, so spans can be exported without GCP."""
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import grpc
+from google.cloud.trace_v2.types import BatchWriteSpansRequest, Span
+from google.protobuf import empty_pb2
+
+TRACE_SERVICE_NAME = 'google.devtools.cloudtrace.v2.TraceService'
+
+
+class FakeTraceService:
+
+    def __init__(self, port=0, max_workers=10, latency=0, max_spans_per_second=None, record_spans=True):
+        """
+        gRPC server implementing the `CreateSpan` and `BatchWriteSpans` methods of the Trace API's `TraceService`
+        on a local port, counting the spans it receives. Calls can be slowed down, failed on demand with `fail_next`
+        and throttled, so exporting spans can be tested against a misbehaving API deterministically.
+
+        Arguments:
+            port (int): port to listen on, a free port is chosen if 0
+            max_workers (int): number of threads handling calls
+            latency (float): seconds to wait before answering each call
+            max_spans_per_second (int): spans accepted per wall clock second, calls that would exceed it fail with
+                `RESOURCE_EXHAUSTED`, unlimited if `None`
+            record_spans (bool): keep the spans received in `spans`, for assertions
+        """
+        self.latency = latency
+        self.max_spans_per_second = max_spans_per_second
+        self.record_spans = record_spans
+        self.span_count = 0
+        self.call_count = 0
+        self.rejected_count = 0
+        self.spans = []
+        self._failures = deque()
+        self._throttle_second = None
+        self._throttle_span_count = 0
+        self._lock = Lock()
+        self._server = grpc.server(ThreadPoolExecutor(max_workers=max_workers))
+        self._server.add_generic_rpc_handlers((grpc.method_handlers_generic_handler(TRACE_SERVICE_NAME, {
+            'CreateSpan': grpc.unary_unary_rpc_method_handler(
+                self._create_span, request_deserializer=Span.deserialize, response_serializer=Span.serialize
+            ),
+            'BatchWriteSpans': grpc.unary_unary_rpc_method_handler(
+                self._batch_write_spans, request_deserializer=BatchWriteSpansRequest.deserialize,
+                response_serializer=empty_pb2.Empty.SerializeToString
+            )
+        }),))
+        self.port = self._server.add_insecure_port(f'localhost:{port}')
+
+    @property
+    def endpoint(self):
+        return f'localhost:{self.port}'
+
+    def start(self):
+        self._server.start()
+        return self
+
+    def stop(self, grace=None):
+        self._server.stop(grace)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def fail_next(self, count=1, code=grpc.StatusCode.UNAVAILABLE):
+        """Fail the next `count` calls with a status code, after any failures already queued."""
+        with self._lock:
+            self._failures.extend([code] * count)
+
+    def reset(self):
+        """Forget the spans and calls received and any queued failures."""
+        with self._lock:
+            self.span_count = self.call_count = self.rejected_count = 0
+            self.spans = []
+            self._failures.clear()
+            self._throttle_second = None
+            self._throttle_span_count = 0
+
+    def _create_span(self, span, context):
+        self._receive([span], context)
+        return span
+
+    def _batch_write_spans(self, request, context):
+        self._receive(request.spans, context)
+        return empty_pb2.Empty()
+
+    def _receive(self, spans, context):
+        """Accept the spans of a call, or abort it if a failure is queued or the span rate would be exceeded."""
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.call_count += 1
+            code, details = self._rejection(len(spans))
+            if code is None:
+                self.span_count += len(spans)
+                if self.record_spans:
+                    self.spans.extend(spans)
+            else:
+                self.rejected_count += 1
+        if code is not None:
+            context.abort(code, details)
+
+    def _rejection(self, span_count):
+        """Status code and details to reject a call with, `(None, None)` if it is accepted. Call holding the lock."""
+        if self._failures:
+            return self._failures.popleft(), 'Injected failure'
+        if self.max_spans_per_second is not None:
+            second = int(time.monotonic())
+            if second != self._throttle_second:
+                self._throttle_second = second
+                self._throttle_span_count = 0
+            if self._throttle_span_count + span_count > self.max_spans_per_second:
+                return grpc.StatusCode.RESOURCE_EXHAUSTED, 'Span rate limit exceeded'
+            self._throttle_span_count += span_count
+        return None, None
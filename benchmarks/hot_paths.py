@@ -0,0 +1,254 @@
+"""
+Micro-benchmarks of the logtracer hot paths, each is run for every request or log entry. Nothing is posted to the
+Trace API and log output is discarded.
+"""
+import copy
+import json
+import logging
+import os
+from collections import namedtuple
+
+import grpc
+from google.protobuf import descriptor_pb2
+
+from logtracer.helpers.grpc.redact import redact_request
+from logtracer.helpers.grpc.tracing import GRPCTracer, B3_VALUES_KEY
+from logtracer.jsonlog import JSONLoggerFactory, Formatters, JsonFormatter
+from logtracer.tracing._utils import generate_identifier
+
+BENCHMARKS = {}
+
+B3_HEADERS = {
+    'X-B3-TraceId': '463ac35c9f6413ad48485a3953bb6124',
+    'X-B3-SpanId': 'a2fb4a1d1a96d312',
+    'X-B3-ParentSpanId': '0020000000000001',
+    'X-B3-Sampled': '1'
+}
+GOOGLE_HEADERS = {'X-Cloud-Trace-Context': '463ac35c9f6413ad48485a3953bb6124/a2fb4a1d1a96d312;o=1'}
+REDACTED_FIELDS = ['package', 'options.java_package', 'message_type.field.name']
+
+
+def benchmark(name):
+    """Register a benchmark, the decorated function sets it up and returns the function to time."""
+
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def _tracer(tracer_class=GRPCTracer, logging_format=Formatters.local, **kwargs):
+    """Create a tracer which writes its logs to `os.devnull`."""
+    logger_factory = JSONLoggerFactory('benchmark-project', 'benchmark-service', logging_format)
+    tracer = tracer_class(logger_factory, **kwargs)
+    tracer._log_handler.setStream(open(os.devnull, 'w'))
+    return tracer
+
+
+@benchmark('tracer.start_and_end_span')
+def _start_and_end_span():
+    tracer = _tracer()
+
+    def run():
+        tracer.start_traced_span(B3_HEADERS, '/benchmark')
+        tracer.end_traced_span()
+
+    return run
+
+
+@benchmark('tracer.start_and_end_span.new_trace')
+def _start_and_end_span_new_trace():
+    tracer = _tracer()
+
+    def run():
+        tracer.start_traced_span({}, '/benchmark')
+        tracer.end_traced_span()
+
+    return run
+
+
+@benchmark('tracer.generate_new_traced_subspan_values')
+def _generate_new_traced_subspan_values():
+    tracer = _tracer()
+    tracer.start_traced_span(B3_HEADERS, '/benchmark')
+    return tracer.generate_new_traced_subspan_values
+
+
+@benchmark('tracer.extract_google_trace_headers.b3')
+def _extract_google_trace_headers_b3():
+    tracer = _tracer()
+    return lambda: tracer._extract_google_trace_headers_if_present(B3_HEADERS)
+
+
+@benchmark('tracer.extract_google_trace_headers.google')
+def _extract_google_trace_headers_google():
+    tracer = _tracer()
+    return lambda: tracer._extract_google_trace_headers_if_present(GOOGLE_HEADERS)
+
+
+@benchmark('utils.generate_identifier.span')
+def _generate_identifier_span():
+    return lambda: generate_identifier(16)
+
+
+@benchmark('utils.generate_identifier.trace')
+def _generate_identifier_trace():
+    return lambda: generate_identifier(32)
+
+
+def _formatter_benchmark(stackdriver, in_span):
+    tracer = _tracer()
+    formatter = JsonFormatter(stackdriver, 'benchmark-project')
+    formatter.tracer = tracer
+    if in_span:
+        tracer.start_traced_span(B3_HEADERS, '/benchmark')
+    record = logging.LogRecord('benchmark-service', logging.INFO, __file__, 1, 'Benchmark %s', ('message',), None)
+    return lambda: formatter.format(record)
+
+
+for _stackdriver in (False, True):
+    for _in_span in (False, True):
+        benchmark(f"jsonlog.format.{'stackdriver' if _stackdriver else 'local'}.{'span' if _in_span else 'no_span'}")(
+            lambda stackdriver=_stackdriver, in_span=_in_span: _formatter_benchmark(stackdriver, in_span)
+        )
+
+
+def _small_request():
+    request = descriptor_pb2.FileDescriptorProto(name='benchmark.proto', package='benchmark')
+    request.options.java_package = 'benchmark'
+    request.message_type.add(name='Benchmark').field.add(name='benchmark', number=1)
+    return request
+
+
+def _large_request():
+    request = descriptor_pb2.FileDescriptorProto()
+    descriptor_pb2.DESCRIPTOR.CopyToProto(request)
+    return request
+
+
+@benchmark('redact.redact_request.small')
+def _redact_request_small():
+    request = _small_request()
+    return lambda: str(redact_request(request, REDACTED_FIELDS))
+
+
+@benchmark('redact.redact_request.large')
+def _redact_request_large():
+    request = _large_request()
+    return lambda: str(redact_request(request, REDACTED_FIELDS))
+
+
+@benchmark('redact.redact_request.large.max_size')
+def _redact_request_large_max_size():
+    request = _large_request()
+    return lambda: str(redact_request(request, REDACTED_FIELDS, max_size=1024))
+
+
+@benchmark('redact.redact_request.large.max_fields')
+def _redact_request_large_max_fields():
+    request = _large_request()
+    return lambda: str(redact_request(request, REDACTED_FIELDS, max_fields=1000))
+
+
+def _deepcopy_redact_request(request, fields):
+    """
+    Redaction as it was before redaction plans, deep copying the request and setting the fields on the copy, to
+    compare `redact_request` against. Paths through repeated fields are not redacted.
+    """
+    redacted = copy.deepcopy(request)
+    for field in fields:
+        parent_path, _, name = field.rpartition('.')
+        try:
+            parent = redacted
+            for parent_name in parent_path.split('.') if parent_path else ():
+                parent = getattr(parent, parent_name)
+            setattr(parent, name, 'REDACTED')
+        except AttributeError:
+            pass
+    return redacted
+
+
+@benchmark('redact.deepcopy_baseline.small')
+def _deepcopy_redact_request_small():
+    request = _small_request()
+    return lambda: str(_deepcopy_redact_request(request, REDACTED_FIELDS))
+
+
+@benchmark('redact.deepcopy_baseline.large')
+def _deepcopy_redact_request_large():
+    request = _large_request()
+    return lambda: str(_deepcopy_redact_request(request, REDACTED_FIELDS))
+
+
+_HandlerCallDetails = namedtuple('_HandlerCallDetails', ('method', 'invocation_metadata'))
+_ClientCallDetails = namedtuple('_ClientCallDetails', ('method', 'timeout', 'metadata', 'credentials',
+                                                       'wait_for_ready', 'compression'))
+
+
+class _State:
+    code = None
+    details = None
+
+
+class _ServicerContext:
+    """Stand-in for the servicer context of a call, holding the metadata sent by a traced client."""
+    _state = _State()
+
+    def __init__(self, metadata):
+        self._metadata = metadata
+
+    def invocation_metadata(self):
+        return self._metadata
+
+    def time_remaining(self):
+        return None
+
+
+class _Future:
+    """Stand-in for the future returned by a call, which is never done."""
+
+    def add_done_callback(self, callback):
+        pass
+
+
+@benchmark('grpc.server_interceptor.unary_unary')
+def _server_interceptor_unary_unary():
+    tracer = _tracer(redacted_fields=REDACTED_FIELDS)
+    interceptor = tracer.server_interceptor()
+    request = _small_request()
+    metadata = ((B3_VALUES_KEY, json.dumps(B3_HEADERS)),)
+    servicer_context = _ServicerContext(metadata)
+    handler = grpc.unary_unary_rpc_method_handler(lambda request, context: request)
+    wrapped_handler = interceptor.intercept_service(lambda details: handler,
+                                                    _HandlerCallDetails('/benchmark.Service/Method', metadata))
+    return lambda: wrapped_handler.unary_unary(request, servicer_context)
+
+
+@benchmark('grpc.server_interceptor.intercept_service')
+def _server_interceptor_intercept_service():
+    tracer = _tracer()
+    interceptor = tracer.server_interceptor()
+    handler = grpc.unary_unary_rpc_method_handler(lambda request, context: request)
+    handler_call_details = _HandlerCallDetails('/benchmark.Service/Method', ())
+    return lambda: interceptor.intercept_service(lambda details: handler, handler_call_details)
+
+
+@benchmark('grpc.client_interceptor.unary_unary')
+def _client_interceptor_unary_unary():
+    tracer = _tracer()
+    tracer.start_traced_span(B3_HEADERS, '/benchmark')
+    interceptor = tracer.client_interceptor()
+    client_call_details = _ClientCallDetails('/benchmark.Service/Method', 1.0, (('key', 'value'),), None, None, None)
+    future = _Future()
+    return lambda: interceptor.intercept_unary_unary(lambda details, request: future, client_call_details, None)
+
+
+@benchmark('grpc.client_interceptor.unary_unary.binary_propagation')
+def _client_interceptor_unary_unary_binary_propagation():
+    tracer = _tracer(binary_propagation=True)
+    tracer.start_traced_span(B3_HEADERS, '/benchmark')
+    interceptor = tracer.client_interceptor()
+    client_call_details = _ClientCallDetails('/benchmark.Service/Method', 1.0, (('key', 'value'),), None, None, None)
+    future = _Future()
+    return lambda: interceptor.intercept_unary_unary(lambda details, request: future, client_call_details, None)
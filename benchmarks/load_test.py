@@ -0,0 +1,296 @@
+"""
+Load test the example servers at a fixed request rate, to measure what tracing costs per request. Each example is run
+in a subprocess in each mode:
+
+    off     the example without tracing
+    on      tracing and logging, spans are not posted
+    export  as `on`, with spans posted to a local fake Trace API (see `benchmarks/fake_trace_service.py`)
+
+Throughput, p50/p99 latency and the CPU time and RSS of the server are reported for each mode. Latency is measured
+from the time each request was scheduled, so it includes any time spent queued when the server can't keep up.
+
+    python -m benchmarks.load_test --example flask --rate 200 --duration 10 --output results.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+MODES = ('off', 'on', 'export')
+EXAMPLES = {
+    # example: (protocol, path or method called)
+    'flask': ('http', '/'),
+    'grpc': ('grpc', 'DemoRPC'),
+    'mixed': ('http', '/grpc')
+}
+
+
+def drive(send, rate, duration, concurrency):
+    """
+    Call `send` at a fixed rate from a pool of threads, regardless of how long calls take to return.
+
+    Returns:
+        ([float,], int, float): latency in seconds of each successful call, the number of failed calls, and the time
+            taken to make all the calls
+    """
+    interval = 1 / rate
+    start = time.perf_counter()
+
+    def timed_send(scheduled):
+        try:
+            send()
+        except Exception:
+            return None
+        return time.perf_counter() - scheduled
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = []
+        for i in range(int(rate * duration)):
+            scheduled = start + i * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(executor.submit(timed_send, scheduled))
+        results = [future.result() for future in futures]
+
+    latencies = [latency for latency in results if latency is not None]
+    return latencies, len(results) - len(latencies), time.perf_counter() - start
+
+
+def percentile(sorted_values, fraction):
+    """Nearest rank percentile of sorted values, `None` if there are none."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(math.ceil(fraction * len(sorted_values)) - 1, 0)]
+
+
+def process_usage(pid):
+    """
+    CPU seconds used by a process, and its current and peak RSS in MB, read from `/proc`. Returns `None` values on
+    platforms without `/proc`.
+    """
+    try:
+        with open(f'/proc/{pid}/stat') as stat_file:
+            # the process name may contain spaces, the fields after it are space separated
+            fields = stat_file.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/status') as status_file:
+            status = dict(line.split(':', 1) for line in status_file if ':' in line)
+    except OSError:
+        return None, None, None
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    return cpu_seconds, int(status['VmRSS'].split()[0]) / 1024, int(status['VmHWM'].split()[0]) / 1024
+
+
+def _wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'Server exited with code {process.returncode}')
+        try:
+            socket.create_connection(('localhost', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'Server did not start listening on port {port}')
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+def _http_sender(port, path):
+    import requests
+
+    local = threading.local()
+    url = f'http://localhost:{port}{path}'
+
+    def send():
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        session.get(url, timeout=10).raise_for_status()
+
+    return send
+
+
+def _grpc_sender(port, method):
+    import grpc
+    from logtracer.examples.grpc.resources.grpc_demo_pb2 import EmptyMessage
+    from logtracer.examples.grpc.resources.grpc_demo_pb2_grpc import DemoServiceStub
+
+    stub_method = getattr(DemoServiceStub(grpc.insecure_channel(f'localhost:{port}')), method)
+    return lambda: stub_method(EmptyMessage(), timeout=10)
+
+
+def run_mode(example, mode, rate, duration, warmup, concurrency):
+    """Start the example server in a subprocess in the given mode, then load test it."""
+    from benchmarks.fake_trace_service import FakeTraceService
+
+    protocol, target = EXAMPLES[example]
+    port = _free_port()
+    fake_trace_service = FakeTraceService().start() if mode == 'export' else None
+    command = [sys.executable, '-m', 'benchmarks.load_test', '--serve', example, '--mode', mode, '--port', str(port)]
+    if fake_trace_service is not None:
+        command += ['--trace-endpoint', fake_trace_service.endpoint]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    try:
+        _wait_for_port(port, process)
+        send = _http_sender(port, target) if protocol == 'http' else _grpc_sender(port, target)
+        if warmup:
+            drive(send, rate, warmup, concurrency)
+        cpu_start, _, _ = process_usage(process.pid)
+        latencies, errors, elapsed = drive(send, rate, duration, concurrency)
+        cpu_end, rss_mb, peak_rss_mb = process_usage(process.pid)
+    finally:
+        process.terminate()
+        process.wait()
+        if fake_trace_service is not None:
+            fake_trace_service.stop()
+
+    latencies.sort()
+    cpu_seconds = cpu_end - cpu_start if cpu_start is not None else None
+    requests_made = len(latencies) + errors
+    return {
+        'requests': requests_made,
+        'errors': errors,
+        'throughput_rps': len(latencies) / elapsed,
+        'latency_p50_ms': _to_ms(percentile(latencies, 0.5)),
+        'latency_p99_ms': _to_ms(percentile(latencies, 0.99)),
+        'server_cpu_seconds': cpu_seconds,
+        'server_cpu_ms_per_request': cpu_seconds / requests_made * 1000 if cpu_seconds is not None else None,
+        'server_rss_mb': rss_mb,
+        'server_peak_rss_mb': peak_rss_mb,
+        'spans_exported': fake_trace_service.span_count if fake_trace_service is not None else None
+    }
+
+
+def _to_ms(seconds):
+    return seconds * 1000 if seconds is not None else None
+
+
+def serve(example, mode, port, trace_endpoint=None):
+    """Run an example server in the given mode, until terminated."""
+    # spans are only posted to the fake Trace API, never to GCP
+    os.environ['ENABLE_TRACE_POSTING'] = 'true' if mode == 'export' else 'false'
+    if mode == 'export':
+        os.environ['TRACE_API_ENDPOINT'] = trace_endpoint
+
+    if example == 'flask':
+        from logtracer.examples.flask import server
+        app, tracers = server.app, [server.flask_tracer]
+    elif example == 'grpc':
+        from logtracer.examples.grpc.trace import grpc_tracer
+        app, tracers = None, [grpc_tracer]
+    else:
+        from logtracer.examples.grpc.trace import grpc_tracer
+        from logtracer.examples.mixed import flask_server
+        app, tracers = flask_server.app, [flask_server.mixed_tracer, grpc_tracer]
+
+    if mode == 'off':
+        tracers = []
+        if app is not None:
+            _remove_request_hooks(app)
+        if example == 'mixed':
+            from logtracer.examples.grpc.resources.grpc_demo_pb2_grpc import DemoServiceStub
+            flask_server.stub = DemoServiceStub(flask_server.channel)
+
+    if example == 'grpc':
+        grpc_server = _create_grpc_server(port, tracers)
+        grpc_server.wait_for_termination()
+        return
+    if example == 'mixed':
+        from logtracer.examples.grpc.server import grpc_port
+        # keep a reference to the server, it is stopped when garbage collected
+        grpc_server = _create_grpc_server(grpc_port, tracers[1:])  # noqa: F841
+
+    from werkzeug.serving import make_server
+    make_server('localhost', port, app, threaded=True).serve_forever()
+
+
+def _remove_request_hooks(app):
+    app.before_request_funcs.clear()
+    app.after_request_funcs.clear()
+    app.teardown_request_funcs.clear()
+
+
+def _create_grpc_server(port, tracers):
+    """
+    Serve the example gRPC service, answering straight away rather than after the example's sleep so the cost of
+    tracing is not hidden.
+    """
+    import grpc
+    from logtracer.examples.grpc.resources import grpc_demo_pb2, grpc_demo_pb2_grpc
+
+    class LoadTestRPC(grpc_demo_pb2_grpc.DemoServiceServicer):
+        def DemoRPC(self, request, context):
+            return grpc_demo_pb2.EmptyMessage()
+
+    server = grpc.server(ThreadPoolExecutor(), interceptors=[tracer.server_interceptor() for tracer in tracers])
+    grpc_demo_pb2_grpc.add_DemoServiceServicer_to_server(LoadTestRPC(), server)
+    server.add_insecure_port(f'[::]:{port}')
+    server.start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.load_test', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--example', choices=EXAMPLES, action='append',
+                        help='example to load test, may be repeated, defaults to all')
+    parser.add_argument('--modes', default=','.join(MODES), help='comma separated modes to run')
+    parser.add_argument('--rate', type=float, default=100, help='requests per second')
+    parser.add_argument('--duration', type=float, default=10, help='seconds to measure for in each mode')
+    parser.add_argument('--warmup', type=float, default=2, help='seconds to send requests for before measuring')
+    parser.add_argument('--concurrency', type=int, default=32, help='maximum number of requests in flight')
+    parser.add_argument('--output', help='file to write the JSON results to, defaults to stdout')
+    parser.add_argument('--serve', choices=EXAMPLES, help=argparse.SUPPRESS)
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--trace-endpoint', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.serve, args.mode, args.port, args.trace_endpoint)
+        return
+
+    results = {}
+    for example in args.example or EXAMPLES:
+        results[example] = {}
+        for mode in args.modes.split(','):
+            result = results[example][mode] = run_mode(example, mode, args.rate, args.duration, args.warmup,
+                                                       args.concurrency)
+            print(f"{example:<6} {mode:<7} {result['throughput_rps']:>8.1f} rps  "
+                  f"p50 {_format(result['latency_p50_ms'])} ms  p99 {_format(result['latency_p99_ms'])} ms  "
+                  f"cpu {_format(result['server_cpu_ms_per_request'], '.2f')} ms/request  "
+                  f"rss {_format(result['server_rss_mb'])} MB  errors {result['errors']}", file=sys.stderr)
+
+    output = json.dumps({
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'rate': args.rate,
+        'duration': args.duration,
+        'results': results
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+
+def _format(value, format_spec='.1f'):
+    return format(value, format_spec) if value is not None else 'n/a'
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,9 @@
+import os
+
 from logtracer.examples.flask.log import logger_factory
 from logtracer.helpers.flask.tracing import FlaskTracer
 
-flask_tracer = FlaskTracer(logger_factory, post_spans_to_stackdriver_api=True)
+enable_trace_posting = os.getenv('ENABLE_TRACE_POSTING', 'true') == 'true'
+flask_tracer = FlaskTracer(logger_factory, post_spans_to_stackdriver_api=enable_trace_posting,
+                           trace_api_endpoint=os.getenv('TRACE_API_ENDPOINT'))
 flask_tracer.set_logging_level('INFO')
@@ -1,9 +1,13 @@
+import os
+
 from logtracer.examples.grpc.log import logger_factory
 from logtracer.helpers.grpc.tracing import GRPCTracer
 
+enable_trace_posting = os.getenv('ENABLE_TRACE_POSTING', 'true') == 'true'
 grpc_tracer = GRPCTracer(
     logger_factory,
-    post_spans_to_stackdriver_api=True,
-    redacted_fields=['value1', 'nested.nestedvalue1', 'nested.doublenested.doublenestedvalue1']
+    post_spans_to_stackdriver_api=enable_trace_posting,
+    redacted_fields=['value1', 'nested.nestedvalue1', 'nested.doublenested.doublenestedvalue1'],
+    trace_api_endpoint=os.getenv('TRACE_API_ENDPOINT')
 )
 grpc_tracer.set_logging_level('INFO')
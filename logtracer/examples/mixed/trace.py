@@ -1,5 +1,9 @@
+import os
+
 from logtracer.examples.flask.log import logger_factory
 from logtracer.helpers.mixed.tracing import MixedTracer
 
-mixed_tracer = MixedTracer(logger_factory, post_spans_to_stackdriver_api=True)
+enable_trace_posting = os.getenv('ENABLE_TRACE_POSTING', 'true') == 'true'
+mixed_tracer = MixedTracer(logger_factory, post_spans_to_stackdriver_api=enable_trace_posting,
+                           trace_api_endpoint=os.getenv('TRACE_API_ENDPOINT'))
 mixed_tracer.set_logging_level('INFO')
@@ -1,24 +1,55 @@
-from flask import request
-
-
-def _is_path_excluded(excluded_routes, excluded_routes_partial):
-    """
-    Decide if, for a particular Flask route, the trace should be posted to the stackdriver API or not.
-
-    Args:
-        excluded_routes ([str,]):           _full_ routes to exclude
-        excluded_routes_partial ([str,]):   partial routes to explore, useful if the route has path variales,
-            eg use ['/app-config/config/'] to match '/app-config/<platform>/<version>/config.json'
-    """
-    if (excluded_routes and not isinstance(excluded_routes, list)) or \
-            (excluded_routes_partial and not isinstance(excluded_routes_partial, list)):
-        raise ValueError('Excluded routes must be in a list.')
-    exclude = False
-    if excluded_routes and request.path in excluded_routes:
-        exclude = True
-    elif excluded_routes_partial:
-        for excluded_route_partial in excluded_routes_partial:
-            if excluded_route_partial in request.path:
-                exclude = True
-                break
-    return exclude
\ No newline at end of file
+import re
+
+
+class _RouteExclusionMatcher:
+
+    def __init__(self, excluded_routes=None, excluded_partial_routes=None, excluded_url_rules=None):
+        """
+        Decide if, for a particular Flask route, the trace should be posted to the stackdriver API or not. The
+        configuration is compiled once so matching a request does not depend on the number of routes excluded.
+
+        Args:
+            excluded_routes ([str,]):           _full_ routes to exclude
+            excluded_partial_routes ([str,]):   partial routes to explore, useful if the route has path variales,
+                eg use ['/app-config/config/'] to match '/app-config/<platform>/<version>/config.json'
+            excluded_url_rules ([str,]):        Flask URL rule templates to exclude, eg '/users/<user_id>', if
+                given the partial routes are also matched against the template, the result is cached per rule
+        """
+        for routes in (excluded_routes, excluded_partial_routes, excluded_url_rules):
+            if routes and not isinstance(routes, list):
+                raise ValueError('Excluded routes must be a list.')
+
+        self._routes = frozenset(excluded_routes or ())
+        self._partial_routes_re = re.compile('|'.join(
+            re.escape(route) for route in sorted(set(excluded_partial_routes), key=len, reverse=True)
+        )) if excluded_partial_routes else None
+        self._url_rules = frozenset(excluded_url_rules or ())
+        self._excluded_rules = {}
+
+    @property
+    def matches_url_rules(self):
+        """States if the URL rule of the request is needed for matching."""
+        return bool(self._url_rules)
+
+    def is_excluded(self, path, url_rule=None):
+        """
+        Arguments:
+            path (str): path of the request
+            url_rule (werkzeug.routing.Rule): rule the request was routed by, `None` if not routed
+        """
+        if path in self._routes:
+            return True
+        if self._partial_routes_re is not None and self._partial_routes_re.search(path):
+            return True
+        if url_rule is not None and self._url_rules:
+            return self._is_url_rule_excluded(url_rule)
+        return False
+
+    def _is_url_rule_excluded(self, url_rule):
+        # a view may be routed by several rules, so the result is cached by rule rather than by endpoint
+        excluded = self._excluded_rules.get(url_rule.rule)
+        if excluded is None:
+            excluded = url_rule.rule in self._url_rules or \
+                (self._partial_routes_re is not None and self._partial_routes_re.search(url_rule.rule) is not None)
+            self._excluded_rules[url_rule.rule] = excluded
+        return excluded
@@ -1,62 +1,182 @@
 import functools
+import logging
+import time
 
 from flask import request
 
-from logtracer.helpers.flask.path_exclusion import _is_path_excluded
+from logtracer.helpers.flask.path_exclusion import _RouteExclusionMatcher
 from logtracer.tracing import Tracer
+from logtracer.tracing._utils import truncate_str
+from logtracer.tracing.tracer import SPAN_DISPLAY_NAME_BYTE_LIMIT
+
+UNMATCHED_URL_RULE = '<unmatched>'
+SPAN_NAME_METHODS = frozenset(('GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'HEAD', 'OPTIONS'))
+OTHER_METHOD = 'OTHER'
 
 
 class FlaskTracer(Tracer):
-    def start_span_and_log_request_before(self):
+    def start_span_and_log_request_before(self, span_name_from_url_rule=False):
         """
         Start a span and log the incoming request.
 
+        Arguments:
+            span_name_from_url_rule (bool): name spans by the request method and the URL rule the request was routed
+                by, eg 'GET /items/<item_id>', rather than the path, so the number of span names is bounded. Methods
+                other than those in `SPAN_NAME_METHODS` are named 'OTHER'. The display names are cached per URL rule
+                and method, requests not matching a URL rule are named eg 'GET <unmatched>' without caching.
+
         For use with flask `before_request()` callback, see readme for example usage.
         """
 
-        def execute_before_request():
-            self.start_traced_span(request.headers, request.path)
-            self.logger.info(f'{request.method} - {request.url}')
+        if span_name_from_url_rule:
+            span_names = {}
+
+            def execute_before_request():
+                url_rule = request.url_rule
+                method = request.method if request.method in SPAN_NAME_METHODS else OTHER_METHOD
+                if url_rule is None:
+                    self.start_traced_span(request.headers, f'{method} {UNMATCHED_URL_RULE}')
+                else:
+                    key = (url_rule.rule, method)
+                    names = span_names.get(key)
+                    if names is None:
+                        span_name = f'{method} {url_rule.rule}'
+                        names = span_names[key] = span_name, truncate_str(
+                            f'{self.service_name}:{span_name}', limit=SPAN_DISPLAY_NAME_BYTE_LIMIT
+                        )['value']
+                    self.start_traced_span(request.headers, names[0], truncated_display_name=names[1])
+                if self.logger.isEnabledFor(logging.INFO):
+                    self.logger.info('%s - %s', request.method, request.url)
+        else:
+            def execute_before_request():
+                self.start_traced_span(request.headers, request.path)
+                if self.logger.isEnabledFor(logging.INFO):
+                    self.logger.info('%s - %s', request.method, request.url)
 
         return execute_before_request
 
     def log_response_after(self):
         """
-        Log the response status.
+        Log the response status, with the resource usage of the span if `enable_span_resource_usage` has been called.
+        Streamed response bodies are wrapped, so that the span ends once the body has been
+        sent rather than on teardown, and the bytes streamed and time to first byte are recorded. Bodies passed
+        directly through to the server, such as files, are not wrapped.
 
         For use with flask `after_request()` callback, see readme for example usage.
         """
 
         def execute_after_request(response):
+            # bodies passed through to the server, eg files sent with `send_file`, are left for the server to send
+            # efficiently and the span ends on teardown
+            wrap_body = response.is_streamed and not response.direct_passthrough
+            # the usage of streamed responses is recorded once the body has been sent
+            resource_usage = self.record_span_resource_usage() if not wrap_body else ''
             status = str(response.status_code)
             if status[0] in ['4', '5']:
-                self.logger.error(f'{response.status} - {request.url}')
-            else:
-                self.logger.info(f'{response.status} - {request.url}')
+                self.logger.error('%s - %s%s', response.status, request.url, resource_usage)
+            elif self.logger.isEnabledFor(logging.INFO):
+                self.logger.info('%s - %s%s', response.status, request.url, resource_usage)
+            if wrap_body:
+                span = self.find_current_span()
+                if span is not None:
+                    span['response_stream'] = response.response = _StreamedResponse(
+                        response.response, self, self.memory.current_span_id, span['start_timestamp'], request.url
+                    )
             return response
 
         return execute_after_request
 
-    def end_span_and_post_on_teardown(self, excluded_routes=None, excluded_partial_routes=None):
+    def end_span_and_post_on_teardown(self, excluded_routes=None, excluded_partial_routes=None,
+                                      excluded_url_rules=None):
         """
         End the span when the request is torn down (finished).
 
         Arguments:
             excluded_routes [str,]:
             excluded_partial_routes [str,]:
+            excluded_url_rules [str,]: Flask URL rule templates, eg '/users/<user_id>'
+
+        The exclusions are compiled once here, so checking each request does not depend on how many are given.
 
         For use with flask `teardown_request()` callback, see readme for example usage.
         """
 
-        if (excluded_routes and not isinstance(excluded_routes, list)) or \
-                (excluded_partial_routes and not isinstance(excluded_partial_routes, list)):
-            raise ValueError('Excluded routes must be a list.')
+        matcher = _RouteExclusionMatcher(excluded_routes, excluded_partial_routes, excluded_url_rules)
+        matches_url_rules = matcher.matches_url_rules
 
         def execute_on_teardown(_):
-            self.end_traced_span(_is_path_excluded(excluded_routes, excluded_partial_routes))
+            url_rule = request.url_rule if matches_url_rules else None
+            exclude_from_posting = matcher.is_excluded(request.path, url_rule)
+            span = self.find_current_span()
+            response_stream = span.get('response_stream') if span is not None else None
+            if response_stream is not None and not response_stream.closed:
+                # the body is still to be sent, the span is ended when the response is closed
+                response_stream.end_span_on_close(exclude_from_posting)
+            else:
+                self.end_traced_span(exclude_from_posting)
 
         return execute_on_teardown
 
+    def enable_request_instrumentation(self, app, server_timing_header=False):
+        """
+        Record the request and response content lengths, and the time spent in `before_request` hooks, the view and
+        `after_request` hooks, as attributes of the span of each request. The app's request processing methods are
+        wrapped to time these, so this covers hooks registered by blueprints and extensions.
+
+        Arguments:
+            app (flask.Flask): app to instrument
+            server_timing_header (bool): also add the times to a `Server-Timing` header on the response
+        """
+        preprocess_request, dispatch_request, process_response = \
+            app.preprocess_request, app.dispatch_request, app.process_response
+
+        def record_timing(name, start):
+            span = self.find_current_span()
+            if span is not None:
+                span.setdefault('server_timing', []).append((name, (time.perf_counter() - start) * 1000))
+
+        def timed_preprocess_request():
+            start = time.perf_counter()
+            try:
+                return preprocess_request()
+            finally:
+                record_timing('before_request', start)
+
+        def timed_dispatch_request():
+            start = time.perf_counter()
+            try:
+                return dispatch_request()
+            finally:
+                record_timing('view', start)
+
+        def timed_process_response(response):
+            start = time.perf_counter()
+            try:
+                response = process_response(response)
+            finally:
+                record_timing('after_request', start)
+
+            span = self.find_current_span()
+            if span is None:
+                return response
+            attributes = span.setdefault('attributes', {})
+            if request.content_length is not None:
+                attributes['http.request_content_length'] = request.content_length
+            if response.content_length is not None:
+                attributes['http.response_content_length'] = response.content_length
+            server_timing = span.get('server_timing', ())
+            for name, duration_ms in server_timing:
+                attributes[f'http.{name}_ms'] = round(duration_ms, 3)
+            if server_timing_header and server_timing:
+                response.headers.add('Server-Timing', ', '.join(
+                    f'{name};dur={duration_ms:.3f}' for name, duration_ms in server_timing
+                ))
+            return response
+
+        app.preprocess_request = timed_preprocess_request
+        app.dispatch_request = timed_dispatch_request
+        app.process_response = timed_process_response
+
     def log_exception(self, f):
         """
         Decorator to be used with Flask error handlers to log exception stack traces.
@@ -69,3 +189,53 @@ class FlaskTracer(Tracer):
             return response
 
         return wrapper
+
+
+class _StreamedResponse:
+
+    def __init__(self, response, tracer, span_id, start_timestamp, url):
+        """
+        Wrap the iterable body of a streamed response, counting the bytes sent and the time to the first byte. The span
+        is made current again to end it when the response is closed, if the request has been torn down by then.
+        """
+        self.response = response
+        self.closed = False
+        self._tracer = tracer
+        self._span_id = span_id
+        self._start_ns = start_timestamp.ToNanoseconds()
+        self._url = url
+        self._byte_count = 0
+        self._first_byte_ms = None
+        self._end_span = False
+        self._exclude_from_posting = False
+
+    def __iter__(self):
+        for chunk in self.response:
+            if self._first_byte_ms is None:
+                self._first_byte_ms = (time.time_ns() - self._start_ns) / 10 ** 6
+            self._byte_count += len(chunk) if isinstance(chunk, bytes) else len(chunk.encode('utf-8'))
+            yield chunk
+
+    def end_span_on_close(self, exclude_from_posting):
+        self._end_span = True
+        self._exclude_from_posting = exclude_from_posting
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if hasattr(self.response, 'close'):
+                self.response.close()
+        finally:
+            self._tracer.set_current_span(self._span_id)
+            self._tracer.set_span_attribute('http.response_bytes', self._byte_count)
+            if self._first_byte_ms is not None:
+                self._tracer.set_span_attribute('http.time_to_first_byte_ms', int(self._first_byte_ms))
+            resource_usage = self._tracer.record_span_resource_usage()
+            if self._tracer.logger.isEnabledFor(logging.INFO):
+                self._tracer.logger.info('Streamed %s bytes - %s (first byte after %s ms)%s', self._byte_count,
+                                         self._url, 'n/a' if self._first_byte_ms is None
+                                         else f'{self._first_byte_ms:.1f}', resource_usage)
+            if self._end_span:
+                self._tracer.end_traced_span(self._exclude_from_posting)
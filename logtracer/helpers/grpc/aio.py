@@ -0,0 +1,232 @@
+import asyncio
+import inspect
+import logging
+import time
+
+import grpc
+from grpc import aio
+
+from logtracer.helpers.grpc.concurrency import TIMEOUT_KEY
+from logtracer.helpers.grpc.tracing import _IncomingCallLogging, _StreamStats, _CurrentSpan, _generate_b3_metadatum
+
+
+class _AsyncIncomingInterceptor(_IncomingCallLogging, aio.ServerInterceptor):
+
+    async def intercept_service(self, continuation, handler_call_details):
+        """
+        Intercept request and modify behaviour to log and trace inbound calls to the server.
+
+        Streamed messages are counted when they are read from the request iterator or yielded by a response
+        generator, messages sent with `context.read()` or `context.write()` are not counted.
+        """
+        handler = await continuation(handler_call_details)
+        return self._get_wrapped_handler(handler_call_details.method, handler)
+
+    def _wrap_handler(self, traced_method, handler):
+        method = traced_method.method
+        request_streaming, response_streaming = handler.request_streaming, handler.response_streaming
+
+        if request_streaming and response_streaming:
+            behavior, handler_factory = handler.stream_stream, grpc.stream_stream_rpc_method_handler
+        elif request_streaming:
+            behavior, handler_factory = handler.stream_unary, grpc.stream_unary_rpc_method_handler
+        elif response_streaming:
+            behavior, handler_factory = handler.unary_stream, grpc.unary_stream_rpc_method_handler
+        else:
+            behavior, handler_factory = handler.unary_unary, grpc.unary_unary_rpc_method_handler
+
+        def start_span(request_or_iterator, servicer_context):
+            invocation_metadata = servicer_context.invocation_metadata()
+            b3_values = self._retrieve_span_values_from_metadata(invocation_metadata)
+            # each call is handled in its own task, so start it without the parent spans of the context it was
+            # copied from
+            self._tracer.memory.parent_spans = []
+            self._tracer.start_traced_span(b3_values, method)
+            self._record_call_start(method, invocation_metadata or (), servicer_context)
+            stream_stats = _StreamStats(self._tracer.count_stream_bytes) \
+                if request_streaming or response_streaming else None
+
+            if request_streaming:
+                self._tracer.logger.info(traced_method.received_stream_message)
+                return _count_async_requests(stream_stats, request_or_iterator), stream_stats
+
+            if stream_stats is not None:
+                stream_stats.count_request(request_or_iterator)
+            if self._tracer.logger.isEnabledFor(logging.INFO):
+                self._log_request(traced_method, request_or_iterator)
+            return request_or_iterator, stream_stats
+
+        if response_streaming:
+            async def new_behaviour(request_or_iterator, servicer_context):
+                request_or_iterator, stream_stats = start_span(request_or_iterator, servicer_context)
+                with _EndSpanOnExit(self, traced_method, servicer_context, stream_stats):
+                    response_or_iterator = behavior(request_or_iterator, servicer_context)
+                    if inspect.isasyncgen(response_or_iterator):
+                        async for response in response_or_iterator:
+                            stream_stats.count_response(response)
+                            yield response
+                    else:
+                        await response_or_iterator
+        else:
+            async def new_behaviour(request_or_iterator, servicer_context):
+                request_or_iterator, stream_stats = start_span(request_or_iterator, servicer_context)
+                with _EndSpanOnExit(self, traced_method, servicer_context, stream_stats):
+                    response = await behavior(request_or_iterator, servicer_context)
+                    if stream_stats is not None:
+                        stream_stats.count_response(response)
+                    return response
+
+        return handler_factory(
+            new_behaviour,
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer
+        )
+
+    def _status_from_context(self, servicer_context):
+        return _aio_grpc_status_from_context(servicer_context)
+
+
+class _EndSpanOnExit:
+
+    def __init__(self, interceptor, traced_method, servicer_context, stream_stats):
+        """
+        Context manager to log the result of a call and end its span. Calls cancelled by the client, or response
+        streams closed early, are logged as returning with the status set on the servicer context.
+        """
+        self.interceptor = interceptor
+        self.traced_method = traced_method
+        self.servicer_context = servicer_context
+        self.stream_stats = stream_stats
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None and issubclass(exc_type, Exception):
+            self.interceptor._log_exception_and_end_span(self.traced_method, exc_val, self.servicer_context,
+                                                         self.stream_stats)
+        else:
+            self.interceptor._log_return_and_end_span(self.traced_method, self.servicer_context, self.stream_stats)
+
+
+async def _count_async_requests(stream_stats, request_iterator):
+    """Wrap the async request iterator, counting requests as they are consumed by the handler."""
+    async for request in request_iterator:
+        stream_stats.count_request(request)
+        yield request
+
+
+def _aio_grpc_status_from_context(servicer_context):
+    """Get the status of a gRPC response as a string from the servicer context, using the public status API."""
+    code = servicer_context.code()
+    if code is not None:
+        return f" - {code} - {str(servicer_context.details())}"
+    else:
+        return ''
+
+
+def create_client_interceptors(tracer):
+    """Create the client interceptors for each kind of `grpc.aio` call, sharing one `_AsyncOutgoingCallLogging`."""
+    outgoing_call_logging = _AsyncOutgoingCallLogging(tracer)
+    return [
+        _AsyncUnaryUnaryOutgoingInterceptor(outgoing_call_logging),
+        _AsyncUnaryStreamOutgoingInterceptor(outgoing_call_logging),
+        _AsyncStreamUnaryOutgoingInterceptor(outgoing_call_logging),
+        _AsyncStreamStreamOutgoingInterceptor(outgoing_call_logging)
+    ]
+
+
+class _AsyncOutgoingCallLogging:
+
+    def __init__(self, tracer):
+        """
+        Attaches span values to outbound `grpc.aio` calls and logs them. Responses are logged by tasks started when
+        calls are done, references to these are held until they finish.
+        """
+        self._tracer = tracer
+        self._log_response_tasks = set()
+
+    async def intercept_call(self, continuation, client_call_details, request_or_iterator):
+        """Make the call with span values attached, logging the response from a callback when the call is done."""
+        method = client_call_details.method
+        method = method.decode('utf-8') if isinstance(method, bytes) else method
+        self._tracer.logger.info('%s - outbound gRPC call', method)
+
+        metadata = aio.Metadata(*client_call_details.metadata) if client_call_details.metadata is not None \
+            else aio.Metadata()
+        metadata.add(*_generate_b3_metadatum(self._tracer))
+        if client_call_details.timeout is not None:
+            metadata.add(TIMEOUT_KEY, str(client_call_details.timeout))
+
+        client_call_details = aio.ClientCallDetails(
+            client_call_details.method,
+            client_call_details.timeout,
+            metadata,
+            client_call_details.credentials,
+            client_call_details.wait_for_ready
+        )
+
+        call = await continuation(client_call_details, request_or_iterator)
+        call.add_done_callback(
+            self._log_response_callback(method, self._tracer.memory.current_span_id, time.monotonic())
+        )
+        return call
+
+    def _log_response_callback(self, method, span_id, start_time):
+        def log_response(call):
+            duration_ms = (time.monotonic() - start_time) * 1000
+            task = asyncio.ensure_future(self._log_response(call, method, span_id, duration_ms))
+            self._log_response_tasks.add(task)
+            task.add_done_callback(self._log_response_tasks.discard)
+
+        return log_response
+
+    async def _log_response(self, call, method, span_id, duration_ms):
+        """Log the response to an outbound call once it is done, in the span the call was made in."""
+        code = await call.code()
+        with _CurrentSpan(self._tracer, span_id):
+            if code == grpc.StatusCode.OK:
+                self._tracer.logger.info('Response received from %s (%.1f ms)', method, duration_ms)
+            else:
+                self._tracer.logger.error('Response received from %s - %s - %s (%.1f ms)', method, code,
+                                          await call.details(), duration_ms)
+
+
+class _AsyncUnaryUnaryOutgoingInterceptor(aio.UnaryUnaryClientInterceptor):
+
+    def __init__(self, outgoing_call_logging):
+        self._outgoing_call_logging = outgoing_call_logging
+
+    async def intercept_unary_unary(self, continuation, client_call_details, request):
+        """Attach span values to an outbound gRPC call and log the call and response."""
+        return await self._outgoing_call_logging.intercept_call(continuation, client_call_details, request)
+
+
+class _AsyncUnaryStreamOutgoingInterceptor(aio.UnaryStreamClientInterceptor):
+
+    def __init__(self, outgoing_call_logging):
+        self._outgoing_call_logging = outgoing_call_logging
+
+    async def intercept_unary_stream(self, continuation, client_call_details, request):
+        """Attach span values to an outbound gRPC call and log the call and the end of the response stream."""
+        return await self._outgoing_call_logging.intercept_call(continuation, client_call_details, request)
+
+
+class _AsyncStreamUnaryOutgoingInterceptor(aio.StreamUnaryClientInterceptor):
+
+    def __init__(self, outgoing_call_logging):
+        self._outgoing_call_logging = outgoing_call_logging
+
+    async def intercept_stream_unary(self, continuation, client_call_details, request_iterator):
+        """Attach span values to an outbound streaming gRPC call and log the call and response."""
+        return await self._outgoing_call_logging.intercept_call(continuation, client_call_details, request_iterator)
+
+
+class _AsyncStreamStreamOutgoingInterceptor(aio.StreamStreamClientInterceptor):
+
+    def __init__(self, outgoing_call_logging):
+        self._outgoing_call_logging = outgoing_call_logging
+
+    async def intercept_stream_stream(self, continuation, client_call_details, request_iterator):
+        """Attach span values to an outbound streaming gRPC call, log the call and the end of its response stream."""
+        return await self._outgoing_call_logging.intercept_call(continuation, client_call_details, request_iterator)
@@ -0,0 +1,114 @@
+from collections import namedtuple
+from threading import Lock
+
+TIMEOUT_KEY = 'logtracer-timeout'
+
+CallConcurrency = namedtuple('CallConcurrency', ('method_in_flight', 'in_flight'))
+
+
+class _MethodCallStats:
+
+    def __init__(self):
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.call_count = 0
+        self.queue_wait_count = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+
+
+class ServerCallStats:
+
+    def __init__(self):
+        """
+        Thread safe counts of the calls being handled by a gRPC server, per method and in total, and of the time calls
+        spend waiting for a thread in the server's executor. Use `snapshot` to read these as gauges, eg. to size
+        executor pools.
+        """
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._methods = {}
+        self._lock = Lock()
+
+    def call_started(self, method):
+        """Count a call as in flight, returning the number of calls in flight for the method and in total."""
+        with self._lock:
+            method_stats = self._methods.get(method)
+            if method_stats is None:
+                method_stats = self._methods[method] = _MethodCallStats()
+            method_stats.in_flight += 1
+            method_stats.call_count += 1
+            if method_stats.in_flight > method_stats.peak_in_flight:
+                method_stats.peak_in_flight = method_stats.in_flight
+            self.in_flight += 1
+            if self.in_flight > self.peak_in_flight:
+                self.peak_in_flight = self.in_flight
+            return CallConcurrency(method_stats.in_flight, self.in_flight)
+
+    def call_finished(self, method):
+        with self._lock:
+            self._methods[method].in_flight -= 1
+            self.in_flight -= 1
+
+    def record_queue_wait(self, method, seconds):
+        with self._lock:
+            method_stats = self._methods[method]
+            method_stats.queue_wait_count += 1
+            method_stats.queue_wait_total += seconds
+            if seconds > method_stats.queue_wait_max:
+                method_stats.queue_wait_max = seconds
+
+    def snapshot(self, reset=False):
+        """
+        Return the current gauges. If `reset` is True then the peaks are reset to the current number of calls in
+        flight, and the call counts and queue wait times are reset, so each snapshot covers the interval since the
+        last.
+        """
+        with self._lock:
+            snapshot = {
+                'in_flight': self.in_flight,
+                'peak_in_flight': self.peak_in_flight,
+                'methods': {
+                    method: {
+                        'in_flight': method_stats.in_flight,
+                        'peak_in_flight': method_stats.peak_in_flight,
+                        'call_count': method_stats.call_count,
+                        'queue_wait_count': method_stats.queue_wait_count,
+                        'queue_wait_mean_ms': method_stats.queue_wait_total / method_stats.queue_wait_count * 1000
+                        if method_stats.queue_wait_count else None,
+                        'queue_wait_max_ms': method_stats.queue_wait_max * 1000
+                        if method_stats.queue_wait_count else None
+                    }
+                    for method, method_stats in self._methods.items()
+                }
+            }
+            if reset:
+                self.peak_in_flight = self.in_flight
+                for method_stats in self._methods.values():
+                    in_flight = method_stats.in_flight
+                    method_stats.__init__()
+                    method_stats.in_flight = method_stats.peak_in_flight = in_flight
+            return snapshot
+
+
+def queue_wait_seconds(invocation_metadata, servicer_context):
+    """
+    Measure how long a call waited between arriving at the server and its handler starting, from the timeout sent by
+    the client in the `logtracer-timeout` metadatum and the time remaining before the call's deadline. The server sets
+    the deadline when the call arrives, so this excludes network time. Returns `None` if the call has no deadline or
+    the client did not send its timeout.
+    """
+    for key, value in invocation_metadata:
+        if key == TIMEOUT_KEY:
+            break
+    else:
+        return None
+
+    time_remaining = servicer_context.time_remaining()
+    if time_remaining is None:
+        return None
+    try:
+        timeout = float(value)
+    except ValueError:
+        return None
+    return max(timeout - time_remaining, 0.0)
@@ -0,0 +1,70 @@
+import struct
+from binascii import hexlify, unhexlify, Error as BinasciiError
+
+from logtracer.tracing.tracer import B3_TRACE_ID, B3_PARENT_SPAN_ID, B3_SPAN_ID, B3_SAMPLED, B3_FLAGS, TRACE_LEN, \
+    SPAN_LEN
+
+B3_BIN_KEY = 'b3-bin'
+B3_BIN_VERSION = 0
+
+# version, flags, trace id, span id, parent span id
+_B3_BIN_FORMAT = struct.Struct(f'>BB{TRACE_LEN // 2}s{SPAN_LEN // 2}s{SPAN_LEN // 2}s')
+_NO_PARENT_SPAN_ID = bytes(SPAN_LEN // 2)
+
+_FLAG_SAMPLED = 0x01
+_FLAG_NOT_SAMPLED = 0x02
+_FLAG_DEBUG = 0x04
+_FLAG_HAS_PARENT = 0x08
+
+
+def encode_b3_bin(span_values):
+    """
+    Encode span values into the fixed layout binary format sent in the `b3-bin` gRPC metadatum:
+    1 byte version, 1 byte flags, 16 byte trace id, 8 byte span id, 8 byte parent span id.
+
+    Returns `None` if the ids are not hex strings of the standard length, these must be sent as JSON instead.
+    """
+    try:
+        trace_id = unhexlify(span_values[B3_TRACE_ID])
+        span_id = unhexlify(span_values[B3_SPAN_ID])
+        parent_span_id = unhexlify(span_values[B3_PARENT_SPAN_ID]) if span_values.get(B3_PARENT_SPAN_ID) \
+            else _NO_PARENT_SPAN_ID
+    except (KeyError, TypeError, BinasciiError):
+        return None
+    if len(trace_id) != TRACE_LEN // 2 or len(span_id) != SPAN_LEN // 2 or len(parent_span_id) != SPAN_LEN // 2:
+        return None
+
+    flags = 0
+    sampled = span_values.get(B3_SAMPLED)
+    if sampled is not None:
+        flags |= _FLAG_SAMPLED if str(sampled).lower() in ('1', 'true') else _FLAG_NOT_SAMPLED
+    if span_values.get(B3_FLAGS) == '1':
+        flags |= _FLAG_DEBUG
+    if span_values.get(B3_PARENT_SPAN_ID):
+        flags |= _FLAG_HAS_PARENT
+
+    return _B3_BIN_FORMAT.pack(B3_BIN_VERSION, flags, trace_id, span_id, parent_span_id)
+
+
+def decode_b3_bin(value):
+    """Decode span values from the `b3-bin` gRPC metadatum, returns `None` if the value is not valid."""
+    try:
+        version, flags, trace_id, span_id, parent_span_id = _B3_BIN_FORMAT.unpack(value)
+    except (struct.error, TypeError):
+        return None
+    if version != B3_BIN_VERSION:
+        return None
+
+    span_values = {
+        B3_TRACE_ID: hexlify(trace_id).decode('ascii'),
+        B3_SPAN_ID: hexlify(span_id).decode('ascii')
+    }
+    if flags & _FLAG_HAS_PARENT:
+        span_values[B3_PARENT_SPAN_ID] = hexlify(parent_span_id).decode('ascii')
+    if flags & _FLAG_SAMPLED:
+        span_values[B3_SAMPLED] = '1'
+    elif flags & _FLAG_NOT_SAMPLED:
+        span_values[B3_SAMPLED] = '0'
+    if flags & _FLAG_DEBUG:
+        span_values[B3_FLAGS] = '1'
+    return span_values
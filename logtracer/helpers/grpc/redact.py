@@ -1,31 +1,244 @@
-import copy
 import functools
 
+from google.protobuf import text_format
+from google.protobuf.descriptor import FieldDescriptor
 
-def _rsetattr(obj, attr, val):
-    """Set nested attributes."""
-    pre, _, post = attr.rpartition('.')
-    return setattr(_rgetattr(obj, pre) if pre else obj, post, val)
+REDACTED = 'REDACTED'
+TRUNCATED_MARKER = '... (truncated)'
+_REDACTED_BYTES = REDACTED.encode('ascii')
 
+_ANY_FULL_NAME = 'google.protobuf.Any'
+_STRING_FIELD_TYPES = (FieldDescriptor.TYPE_STRING, FieldDescriptor.TYPE_BYTES)
+# plans are keyed by message type and redacted field paths, both fixed by an app's protos and tracer configuration, so
+# a few hundred plans covers even large services. The bound only matters if field lists are built per call, then the
+# least recently used plans are recompiled rather than the cache growing without limit.
+REDACTION_PLAN_CACHE_SIZE = 1024
 
-def _rgetattr(obj, attr, *args):
-    """Get nested attributes."""
-    def _getattr(obj, attr):
-        return getattr(obj, attr, *args)
 
-    return functools.reduce(_getattr, [obj] + attr.split('.'))
+class _RedactionPlan:
 
+    def __init__(self, redacted, nested, native=True):
+        """
+        Redaction actions for one message type, compiled from the dotted field paths to redact.
 
-def redact_request(request, fields):
+        Arguments:
+            redacted (frozenset): names of fields in this message whose values are replaced with `REDACTED`
+            nested ({str: _RedactionPlan}): plans for the submessage fields containing redacted fields
+            native (bool): every redacted field, here and in the nested plans, is a string or bytes field, so a copy
+                of the message can hold `REDACTED` in their place and be rendered by protobuf itself
+        """
+        self.redacted = redacted
+        self.nested = nested
+        self.native = native
+
+    def __bool__(self):
+        return bool(self.redacted or self.nested)
+
+
+_NO_REDACTION = _RedactionPlan(frozenset(), {})
+
+
+@functools.lru_cache(maxsize=REDACTION_PLAN_CACHE_SIZE)
+def compile_redaction_plan(descriptor, fields):
+    """
+    Compile the redaction plan for a message type once, paths which do not exist in the message type are ignored.
+    Plans are cached in a module level LRU cache of `REDACTION_PLAN_CACHE_SIZE` entries.
+
+    Arguments:
+        descriptor (google.protobuf.descriptor.Descriptor): descriptor of the message type
+        fields ((str,)): dotted paths of the fields to redact
+    """
+    redacted = set()
+    nested_paths = {}
+    native = True
+    for field in fields:
+        name, _, rest = field.partition('.')
+        field_descriptor = descriptor.fields_by_name.get(name)
+        if field_descriptor is None:
+            continue
+        if not rest:
+            redacted.add(name)
+            native = native and field_descriptor.type in _STRING_FIELD_TYPES
+        elif field_descriptor.type == FieldDescriptor.TYPE_MESSAGE and not _is_map_field(field_descriptor):
+            nested_paths.setdefault(name, []).append(rest)
+
+    nested = {}
+    for name, paths in nested_paths.items():
+        if name in redacted:
+            continue
+        plan = compile_redaction_plan(descriptor.fields_by_name[name].message_type, tuple(paths))
+        if plan:
+            nested[name] = plan
+            native = native and plan.native
+    return _RedactionPlan(frozenset(redacted), nested, native)
+
+
+class RedactedRequest:
+
+    def __init__(self, request, plan, max_size=None, max_fields=None, summary=False):
+        """
+        Loggable form of a request with sensitive fields redacted, rendered only when this is formatted into a log
+        entry. The request is not mutated. Without limits, a copy of the request with the planned fields replaced is
+        rendered by protobuf, otherwise the text form is written field by field from the request, following the plan.
+
+        Arguments:
+            request (google.protobuf.message.Message)
+            plan (_RedactionPlan): fields to redact, `None` to redact nothing
+            max_size (int): maximum size of the text form in bytes, rendering stops once reached and a marker is
+                appended
+            max_fields (int): maximum number of field values rendered per message, each element of a repeated field
+                counts as one, the rest are replaced with a count
+            summary (bool): render only the message type and serialised size, no field values
+        """
+        self.request = request
+        self.plan = plan if plan is not None else _NO_REDACTION
+        self.max_size = max_size
+        self.max_fields = max_fields
+        self.summary = summary
+
+    def __str__(self):
+        if self.summary:
+            return f'<{self.request.DESCRIPTOR.full_name}: {self.request.ByteSize()} bytes>'
+        if self.max_size is None and self.max_fields is None:
+            if not self.plan:
+                return str(self.request)
+            if self.plan.native:
+                redacted = type(self.request)()
+                redacted.CopyFrom(self.request)
+                _redact_message(redacted, self.plan)
+                return str(redacted)
+        out = _SizeLimitedWriter(self.max_size)
+        try:
+            _render_message(self.request, self.plan, out, 0, self.max_fields)
+        except _SizeLimitReached:
+            return out.getvalue() + TRUNCATED_MARKER
+        return out.getvalue()
+
+
+def redact_request(request, fields, max_size=None, max_fields=None, summary=False):
+    """
+    Returns the loggable form of the request with sensitive fields redacted, the request is not mutated. See
+    `RedactedRequest` for the size limiting arguments.
+    """
+    plan = compile_redaction_plan(request.DESCRIPTOR, tuple(fields)) if fields and not summary else None
+    return RedactedRequest(request, plan, max_size, max_fields, summary)
+
+
+def _redact_message(message, plan):
     """
-    Returns a copy of the request with sensitive items redacted.
-    Does not mutate the original but returns a deep clone.
+    Replace the values of the planned string and bytes fields of a message with `REDACTED`, in place. Only the fields
+    on the plan's paths are visited, not every field of the message.
     """
-    r = copy.deepcopy(request)
-    if fields:
-        for field in fields:
-            try:
-                _rsetattr(r, field, "REDACTED")
-            except AttributeError:
-                pass
-    return r
+    fields_by_name = message.DESCRIPTOR.fields_by_name
+    for name in plan.redacted:
+        field_descriptor = fields_by_name[name]
+        redacted = REDACTED if field_descriptor.type == FieldDescriptor.TYPE_STRING else _REDACTED_BYTES
+        if _is_repeated_field(field_descriptor):
+            value = getattr(message, name)
+            if value:
+                # rendered as a single value, as by `_render_message`
+                del value[:]
+                value.append(redacted)
+        elif _has_field(message, name):
+            setattr(message, name, redacted)
+    for name, nested_plan in plan.nested.items():
+        if _is_repeated_field(fields_by_name[name]):
+            for element in getattr(message, name):
+                _redact_message(element, nested_plan)
+        elif message.HasField(name):
+            _redact_message(getattr(message, name), nested_plan)
+
+
+def _render_message(message, plan, out, indent, max_fields=None):
+    """Write the protobuf text form of a message, applying the redaction plan and field limit."""
+    prefix = ' ' * indent
+    rendered_count = 0
+    for field_descriptor, value in message.ListFields():
+        name = field_descriptor.name
+        redacted = name in plan.redacted
+        if redacted:
+            elements = [value]
+        elif _is_map_field(field_descriptor):
+            entry_class = value.GetEntryClass()
+            elements = (entry_class(key=key, value=value[key]) for key in sorted(value))
+        elif _is_repeated_field(field_descriptor):
+            elements = value
+        else:
+            elements = [value]
+
+        for element in elements:
+            if max_fields is not None and rendered_count >= max_fields:
+                out.write(f'{prefix}... {_count_field_values(message, plan) - rendered_count} more field values\n')
+                return
+            rendered_count += 1
+
+            if redacted:
+                out.write(f'{prefix}{name}: "{REDACTED}"\n')
+            elif field_descriptor.type == FieldDescriptor.TYPE_MESSAGE and \
+                    field_descriptor.message_type.full_name != _ANY_FULL_NAME:
+                out.write(f'{prefix}{name} {{\n')
+                _render_message(element, plan.nested.get(name, _NO_REDACTION), out, indent + 2, max_fields)
+                out.write(f'{prefix}}}\n')
+            else:
+                if field_descriptor.type in _STRING_FIELD_TYPES and out.remaining is not None and \
+                        len(element) > out.remaining:
+                    # escaping only lengthens the value, so the cut value still reaches the limit, without the whole
+                    # value being escaped first
+                    element = element[:out.remaining]
+                text_format.PrintField(field_descriptor, element, out, indent)
+
+
+def _count_field_values(message, plan):
+    """Count the field values rendered for a message without a field limit."""
+    return sum(
+        len(value) if _is_repeated_field(field_descriptor) and field_descriptor.name not in plan.redacted else 1
+        for field_descriptor, value in message.ListFields()
+    )
+
+
+class _SizeLimitReached(Exception):
+    pass
+
+
+class _SizeLimitedWriter:
+
+    def __init__(self, max_size=None):
+        """
+        Text buffer which raises `_SizeLimitReached` once more than `max_size` bytes, encoded as UTF-8, are written to
+        it. The text is cut at the limit without splitting a character.
+        """
+        self.remaining = max_size
+        self.parts = []
+
+    def write(self, text):
+        if self.remaining is not None:
+            encoded = text.encode('utf-8')
+            if len(encoded) > self.remaining:
+                self.parts.append(encoded[:self.remaining].decode('utf-8', errors='ignore'))
+                self.remaining = 0
+                raise _SizeLimitReached()
+            self.remaining -= len(encoded)
+        self.parts.append(text)
+
+    def getvalue(self):
+        return ''.join(self.parts)
+
+
+def _is_map_field(field_descriptor):
+    return field_descriptor.type == FieldDescriptor.TYPE_MESSAGE and \
+        field_descriptor.message_type.GetOptions().map_entry
+
+
+def _has_field(message, name):
+    """States if a singular field is set, fields without presence are set if they are not the default value."""
+    try:
+        return message.HasField(name)
+    except ValueError:
+        return bool(getattr(message, name))
+
+
+def _is_repeated_field(field_descriptor):
+    # `label` is replaced by `is_repeated` in newer protobuf releases
+    if hasattr(field_descriptor, 'is_repeated'):
+        return field_descriptor.is_repeated
+    return field_descriptor.label == FieldDescriptor.LABEL_REPEATED
@@ -1,9 +1,15 @@
+import abc
 import json
+import logging
+import time
+from collections import namedtuple
+from threading import Lock
 
 import grpc
 from grpc._cython.cygrpc import _Metadatum
-from grpc._interceptor import _ClientCallDetails
 
+from logtracer.helpers.grpc.concurrency import ServerCallStats, TIMEOUT_KEY, queue_wait_seconds
+from logtracer.helpers.grpc.propagation import B3_BIN_KEY, encode_b3_bin, decode_b3_bin
 from logtracer.helpers.grpc.redact import redact_request
 from logtracer.tracing import Tracer
 
@@ -12,7 +18,10 @@ B3_VALUES_KEY = 'b3-values'
 
 class GRPCTracer(Tracer):
 
-    def __init__(self, json_logger_factory, post_spans_to_stackdriver_api=False, redacted_fields=None):
+    def __init__(self, json_logger_factory, post_spans_to_stackdriver_api=False, redacted_fields=None,
+                 count_stream_bytes=False, binary_propagation=False, request_log_max_size=None,
+                 request_log_max_fields=None, request_log_summary=False, track_server_concurrency=False,
+                 trace_api_endpoint=None):
         """
         Class to manage gRPC client and server interceptors.
 
@@ -20,9 +29,27 @@ class GRPCTracer(Tracer):
             json_logger_factory (logtracer.jsonlog.JSONLoggerFactory)
             post_spans_to_stackdriver_api (bool)
             redacted_fields ([str,]): list of fields (may be nested) to redact from incoming request log entry
+            count_stream_bytes (bool): record the serialised size of messages on streaming RPCs, as well as the
+                number of messages
+            binary_propagation (bool): send span values to gRPC services in the compact binary `b3-bin` metadatum
+                instead of JSON, only enable this once all called services can read it
+            request_log_max_size (int): maximum size in bytes of the request in the incoming request log entry, the
+                rest is truncated
+            request_log_max_fields (int): maximum number of field values per message in the incoming request log
+                entry, repeated field elements count individually
+            request_log_summary (bool): log only the type and serialised size of incoming requests
+            track_server_concurrency (bool): count the calls in flight per method and in total, and measure the time
+                calls wait for an executor thread, as span attributes and as gauges in `server_call_stats`
+            trace_api_endpoint (str): endpoint to post spans to over an insecure channel, see `Tracer`
         """
-        super().__init__(json_logger_factory, post_spans_to_stackdriver_api)
+        super().__init__(json_logger_factory, post_spans_to_stackdriver_api, trace_api_endpoint)
         self.redacted_fields = redacted_fields if redacted_fields is not None else []
+        self.count_stream_bytes = count_stream_bytes
+        self.binary_propagation = binary_propagation
+        self.request_log_max_size = request_log_max_size
+        self.request_log_max_fields = request_log_max_fields
+        self.request_log_summary = request_log_summary
+        self.server_call_stats = ServerCallStats() if track_server_concurrency else None
 
     def server_interceptor(self):
         return _IncomingInterceptor(self)
@@ -30,93 +57,332 @@ class GRPCTracer(Tracer):
     def client_interceptor(self):
         return _OutgoingInterceptor(self)
 
+    def aio_server_interceptor(self):
+        """
+        Create a `grpc.aio` server interceptor, with the same span, logging and redaction behaviour as
+        `server_interceptor`. Spans are switched to context local memory as asyncio servers handle all calls in one
+        thread. Requires grpcio>=1.32.
+        """
+        from logtracer.helpers.grpc.aio import _AsyncIncomingInterceptor
+        self.enable_context_local_spans()
+        return _AsyncIncomingInterceptor(self)
+
+    def aio_client_interceptors(self):
+        """
+        Create the `grpc.aio` client interceptors, one for each kind of call, to pass into
+        `grpc.aio.insecure_channel(..., interceptors=...)`. Spans are switched to context local memory. Requires
+        grpcio>=1.32.
+        """
+        from logtracer.helpers.grpc.aio import create_client_interceptors
+        self.enable_context_local_spans()
+        return create_client_interceptors(self)
+
 
-class _IncomingInterceptor(grpc.ServerInterceptor):
+class _IncomingCallLogging(abc.ABC):
 
     def __init__(self, tracer):
         """Initialise interceptor with tracer instance."""
         self._tracer = tracer
+        self._wrapped_handlers = {}
 
-    def intercept_service(self, continuation, handler_call_details):
-        """Intercept request and modify behaviour to log and trace inbound and outbound connections to the server."""
+    def _get_wrapped_handler(self, method, handler):
+        """
+        Return the traced handler for a method. Handlers are wrapped the first time they are seen and cached by method,
+        so only the tracing wrapper runs for each call.
+        """
+        if handler is None:
+            return None
+        cached = self._wrapped_handlers.get(method)
+        if cached is not None and cached[0] is handler:
+            return cached[1]
+        wrapped_handler = self._wrap_handler(_TracedMethod(method), handler)
+        self._wrapped_handlers[method] = (handler, wrapped_handler)
+        return wrapped_handler
+
+    @abc.abstractmethod
+    def _wrap_handler(self, traced_method, handler):
+        """Wrap the behaviour of a handler to trace its calls, sync and asyncio handlers are wrapped differently."""
+
+    def _log_request(self, traced_method, request):
+        """Log the received call, with the redacted request if it is not empty."""
+        if request.ListFields():
+            loggable_request = redact_request(request, self._tracer.redacted_fields, self._tracer.request_log_max_size,
+                                              self._tracer.request_log_max_fields, self._tracer.request_log_summary)
+            self._tracer.logger.info(traced_method.received_request_message, loggable_request)
+        else:
+            self._tracer.logger.info(traced_method.received_message)
+
+    def _record_call_start(self, method, invocation_metadata, servicer_context):
+        """If tracking server concurrency, count the call as in flight and measure how long it waited to start."""
+        server_call_stats = self._tracer.server_call_stats
+        if server_call_stats is None:
+            return
+        concurrency = server_call_stats.call_started(method)
+        self._tracer.set_span_attribute('grpc.method_in_flight', concurrency.method_in_flight)
+        self._tracer.set_span_attribute('grpc.server_in_flight', concurrency.in_flight)
+        queue_wait = queue_wait_seconds(invocation_metadata, servicer_context)
+        if queue_wait is not None:
+            server_call_stats.record_queue_wait(method, queue_wait)
+            self._tracer.set_span_attribute('grpc.queue_wait_ms', round(queue_wait * 1000, 3))
+
+    def _record_call_end(self, method):
+        if self._tracer.server_call_stats is not None:
+            self._tracer.server_call_stats.call_finished(method)
+
+    def _log_return_and_end_span(self, traced_method, servicer_context, stream_stats):
+        """Log the returning call and end the span."""
+        self._record_call_end(traced_method.method)
+        if stream_stats is not None:
+            stream_stats.set_span_attributes(self._tracer)
+        resource_usage = self._tracer.record_span_resource_usage()
+        if self._tracer.logger.isEnabledFor(logging.INFO):
+            status_str = self._status_from_context(servicer_context)
+            if stream_stats is not None:
+                self._tracer.logger.info(traced_method.returning_stream_message, status_str, stream_stats,
+                                         resource_usage)
+            else:
+                self._tracer.logger.info(traced_method.returning_message, status_str, resource_usage)
+        self._tracer.end_traced_span(exclude_from_posting=False)
+
+    def _log_exception_and_end_span(self, traced_method, exception, servicer_context, stream_stats):
+        """Log the exception raised by the call and end the span."""
+        self._record_call_end(traced_method.method)
+        if stream_stats is not None:
+            stream_stats.set_span_attributes(self._tracer)
+        resource_usage = self._tracer.record_span_resource_usage()
+        status_str = self._status_from_context(servicer_context)
+        self._tracer.logger.error(traced_method.error_message, type(exception).__name__, status_str, resource_usage)
+        self._tracer.logger.exception(exception)
+        self._tracer.end_traced_span(exclude_from_posting=False)
+
+    def _status_from_context(self, servicer_context):
+        """
+        Get the status of a gRPC response as a string from the servicer context of a synchronous server, asyncio
+        servers override this to use the public status API of their context.
+        """
+        return _grpc_status_from_context(servicer_context)
+
+    @staticmethod
+    def _retrieve_span_values_from_metadata(invocation_metadata):
+        """
+        Get the span values from the metadata of an inbound call, from either the binary `b3-bin` metadatum or the
+        JSON `b3-values` metadatum. If both are present then the binary values are used.
+        """
+        b3_values = {}
+        for key, value in invocation_metadata or ():
+            if key == B3_BIN_KEY:
+                binary_b3_values = decode_b3_bin(value)
+                if binary_b3_values is not None:
+                    return binary_b3_values
+            elif key == B3_VALUES_KEY:
+                b3_values = json.loads(value)
+        return b3_values
+
+
+class _TracedMethod:
+
+    def __init__(self, method):
+        """
+        The name of a traced RPC method and its log messages, built once per method rather than for every call. The
+        messages with arguments have `%` in the method name escaped.
+        """
+        self.method = method
+        escaped_method = method.replace('%', '%%')
+        self.received_message = f'{method} - received gRPC call '
+        self.received_request_message = f'{escaped_method} - received gRPC call \nrequest: %s'
+        self.received_stream_message = f'{method} - received streaming gRPC call'
+        self.returning_message = f'{escaped_method}%s - returning gRPC call%s'
+        self.returning_stream_message = f'{escaped_method}%s - returning gRPC call%s%s'
+        self.error_message = f'{escaped_method} - %s%s%s'
 
-        def tracing_wrapper(behavior, *_):
-            def new_behaviour(request, servicer_context):
 
-                b3_values = self._retrieve_span_values_from_incoming_call(handler_call_details)
+class _IncomingInterceptor(_IncomingCallLogging, grpc.ServerInterceptor):
 
-                self._tracer.start_traced_span(b3_values, handler_call_details.method)
-                redacted_request_str = f"\nrequest: {redact_request(request, self._tracer.redacted_fields)}" \
-                    if request.ListFields() else ''
+    def intercept_service(self, continuation, handler_call_details):
+        """
+        Intercept request and modify behaviour to log and trace inbound and outbound connections to the server.
 
-                self._tracer.logger.info(f'{handler_call_details.method} - received gRPC call {redacted_request_str}')
+        For streaming RPCs the span stays open until the response stream is finished, the number of messages (and
+        optionally bytes) streamed in each direction are logged and set as span attributes.
+        """
+        return self._get_wrapped_handler(handler_call_details.method, continuation(handler_call_details))
+
+    def _wrap_handler(self, traced_method, handler):
+        method = traced_method.method
+
+        def tracing_wrapper(behavior, request_streaming=False, response_streaming=False):
+            def new_behaviour(request_or_iterator, servicer_context):
+                invocation_metadata = servicer_context.invocation_metadata()
+                b3_values = self._retrieve_span_values_from_metadata(invocation_metadata)
+
+                self._tracer.start_traced_span(b3_values, method)
+                self._record_call_start(method, invocation_metadata, servicer_context)
+                stream_stats = _StreamStats(self._tracer.count_stream_bytes) \
+                    if request_streaming or response_streaming else None
+
+                if request_streaming:
+                    self._tracer.logger.info(traced_method.received_stream_message)
+                    request_or_iterator = stream_stats.count_requests(request_or_iterator)
+                else:
+                    if stream_stats is not None:
+                        stream_stats.count_request(request_or_iterator)
+                    if self._tracer.logger.isEnabledFor(logging.INFO):
+                        self._log_request(traced_method, request_or_iterator)
 
-                exception_raised = False
                 try:
-                    return behavior(request, servicer_context)
+                    response_or_iterator = behavior(request_or_iterator, servicer_context)
                 except Exception as e:
-                    status_str = _grpc_status_from_context(servicer_context)
-                    self._tracer.logger.error(f"{handler_call_details.method} - {type(e).__name__}{status_str}")
-                    self._tracer.logger.exception(e)
-                    self._tracer.end_traced_span(exclude_from_posting=False)
-                    exception_raised = True
+                    self._log_exception_and_end_span(traced_method, e, servicer_context, stream_stats)
                     raise e
-                finally:
-                    if not exception_raised:
-                        status_str = _grpc_status_from_context(servicer_context)
-                        self._tracer.logger.info(f'{handler_call_details.method}{status_str} - returning gRPC call')
-                        self._tracer.end_traced_span(exclude_from_posting=False)
 
-            return new_behaviour
+                if response_streaming:
+                    return self._trace_response_stream(traced_method, response_or_iterator, servicer_context,
+                                                       stream_stats)
 
-        return _wrap_rpc_behavior(continuation(handler_call_details), tracing_wrapper)
+                if stream_stats is not None:
+                    stream_stats.count_response(response_or_iterator)
+                self._log_return_and_end_span(traced_method, servicer_context, stream_stats)
+                return response_or_iterator
 
-    @staticmethod
-    def _retrieve_span_values_from_incoming_call(handler_call_details):
-        """Get the span values from an inbound call."""
-        """Get the span values from an inbound call."""
-        b3_values = {}
-        for metadatum in handler_call_details.invocation_metadata:
-            if metadatum.key == B3_VALUES_KEY:
-                b3_values = json.loads(metadatum.value)
-        return b3_values
+            return new_behaviour
 
+        return _wrap_rpc_behavior(handler, tracing_wrapper)
 
-class _OutgoingInterceptor(grpc.UnaryUnaryClientInterceptor):
+    def _trace_response_stream(self, traced_method, response_iterator, servicer_context, stream_stats):
+        """
+        Trace the response stream, ending the span once it is exhausted, fails or is closed. If the stream is never
+        iterated, eg the client cancelled the call before the first response, the span is ended when the RPC
+        terminates instead. Responses are never buffered.
+        """
+        span_id = self._tracer.memory.current_span_id
+        span_ended = []
+        span_ended_lock = Lock()
+
+        def end_span(log_and_end_span):
+            with span_ended_lock:
+                if span_ended:
+                    return
+                span_ended.append(True)
+            with _CurrentSpan(self._tracer, span_id):
+                log_and_end_span()
+
+        def end_span_on_termination():
+            end_span(lambda: self._log_return_and_end_span(traced_method, servicer_context, stream_stats))
+
+        def traced_response_stream():
+            exception_raised = False
+            try:
+                for response in response_iterator:
+                    stream_stats.count_response(response)
+                    yield response
+            except Exception as e:
+                exception_raised = True
+                end_span(lambda: self._log_exception_and_end_span(traced_method, e, servicer_context, stream_stats))
+                raise e
+            finally:
+                if not exception_raised:
+                    end_span_on_termination()
+
+        if not servicer_context.add_callback(end_span_on_termination):
+            # the RPC has already terminated, the stream will not be iterated
+            end_span_on_termination()
+        return traced_response_stream()
+
+
+class _OutgoingInterceptor(grpc.UnaryUnaryClientInterceptor, grpc.UnaryStreamClientInterceptor,
+                           grpc.StreamUnaryClientInterceptor, grpc.StreamStreamClientInterceptor):
 
     def __init__(self, tracer):
         self._tracer = tracer
 
     def intercept_unary_unary(self, continuation, client_call_details, request):
         """Attach span values to an outbound gRPC call and log the call and response."""
-        self._tracer.logger.info(f'{client_call_details.method} - outbound gRPC call')
+        return self._intercept_call(continuation, client_call_details, request)
+
+    def intercept_unary_stream(self, continuation, client_call_details, request):
+        """Attach span values to an outbound gRPC call and log the call and the end of the response stream."""
+        return self._intercept_call(continuation, client_call_details, request)
+
+    def intercept_stream_unary(self, continuation, client_call_details, request_iterator):
+        """Attach span values to an outbound streaming gRPC call and log the call and response."""
+        return self._intercept_call(continuation, client_call_details, request_iterator)
+
+    def intercept_stream_stream(self, continuation, client_call_details, request_iterator):
+        """Attach span values to an outbound streaming gRPC call, log the call and the end of its response stream."""
+        return self._intercept_call(continuation, client_call_details, request_iterator)
+
+    def _intercept_call(self, continuation, client_call_details, request_or_iterator):
+        """
+        Make the call with span values attached. The response is logged from a callback when the call is done, so
+        the call is not blocked on and futures and response streams are returned straight away.
+        """
+        self._tracer.logger.info('%s - outbound gRPC call', client_call_details.method)
 
         metadata = self._generate_metadata_with_b3_values(client_call_details)
 
-        client_call_details = _ClientCallDetails(
+        client_call_details = _OutgoingCallDetails(
             client_call_details.method,
             client_call_details.timeout,
             metadata,
-            client_call_details.credentials
+            client_call_details.credentials,
+            getattr(client_call_details, 'wait_for_ready', None),
+            getattr(client_call_details, 'compression', None)
         )
 
-        response_future = continuation(client_call_details, request)
-        response_future.result()  # waits for response
-        self._tracer.logger.info(f'Response received from {client_call_details.method}')
-        return response_future
+        response = continuation(client_call_details, request_or_iterator)
+        response.add_done_callback(
+            _log_response_callback(self._tracer, client_call_details.method, self._tracer.memory.current_span_id,
+                                   time.monotonic())
+        )
+        return response
 
     def _generate_metadata_with_b3_values(self, client_call_details):
         """
         Given the immutable metadata from the client call, get the existing metadata and create a new list of
         metadata with the span values metadatum appended.
         """
-        subspan_values = self._tracer.generate_new_traced_subspan_values()
         metadata = list(client_call_details.metadata) if client_call_details.metadata is not None else []
-        b3_metadatum = _Metadatum(key=B3_VALUES_KEY, value=json.dumps(subspan_values))
-        metadata.append(b3_metadatum)
+        metadata.append(_Metadatum(*_generate_b3_metadatum(self._tracer)))
+        if client_call_details.timeout is not None:
+            metadata.append(_Metadatum(key=TIMEOUT_KEY, value=str(client_call_details.timeout)))
         return metadata
 
 
+def _generate_b3_metadatum(tracer):
+    """Generate the span values for an outbound call, returning the key and value of the metadatum to send them in."""
+    subspan_values = tracer.generate_new_traced_subspan_values()
+    b3_bin_value = encode_b3_bin(subspan_values) if tracer.binary_propagation else None
+    if b3_bin_value is not None:
+        return B3_BIN_KEY, b3_bin_value
+    return B3_VALUES_KEY, json.dumps(subspan_values)
+
+
+class _OutgoingCallDetails(
+        namedtuple('_OutgoingCallDetails', ('method', 'timeout', 'metadata', 'credentials', 'wait_for_ready',
+                                            'compression')),
+        grpc.ClientCallDetails):
+    """Details of an outbound call, with the span values added to the metadata."""
+
+
+def _log_response_callback(tracer, method, span_id, start_time):
+    """
+    Create a callback to log the response to an outbound call. The callback may run in a gRPC thread, so the span the
+    call was made in is made current while logging.
+    """
+
+    def log_response(response):
+        duration_ms = (time.monotonic() - start_time) * 1000
+        with _CurrentSpan(tracer, span_id):
+            code = response.code()
+            if code == grpc.StatusCode.OK:
+                tracer.logger.info('Response received from %s (%.1f ms)', method, duration_ms)
+            else:
+                tracer.logger.error('Response received from %s - %s - %s (%.1f ms)', method, code,
+                                    response.details(), duration_ms)
+
+    return log_response
+
+
 def _grpc_status_from_context(servicer_context):
     """Get the status of a gRPC response as a string from the servicer context."""
     if servicer_context._state.code is not None:
@@ -125,10 +391,86 @@ def _grpc_status_from_context(servicer_context):
         return ''
 
 
+class _StreamStats:
+
+    def __init__(self, count_bytes):
+        """Counts of the messages streamed in each direction of an RPC."""
+        self.count_bytes = count_bytes
+        self.request_count = 0
+        self.request_bytes = 0
+        self.response_count = 0
+        self.response_bytes = 0
+
+    def count_requests(self, request_iterator):
+        """Wrap the request iterator, counting requests as they are consumed by the handler."""
+        for request in request_iterator:
+            self.count_request(request)
+            yield request
+
+    def count_request(self, request):
+        self.request_count += 1
+        if self.count_bytes:
+            self.request_bytes += request.ByteSize()
+
+    def count_response(self, response):
+        self.response_count += 1
+        if self.count_bytes:
+            self.response_bytes += response.ByteSize()
+
+    def set_span_attributes(self, tracer):
+        tracer.set_span_attribute('grpc.request_count', self.request_count)
+        tracer.set_span_attribute('grpc.response_count', self.response_count)
+        if self.count_bytes:
+            tracer.set_span_attribute('grpc.request_bytes', self.request_bytes)
+            tracer.set_span_attribute('grpc.response_bytes', self.response_bytes)
+
+    def __str__(self):
+        if self.count_bytes:
+            return f' - {self.request_count} requests ({self.request_bytes} bytes), ' \
+                f'{self.response_count} responses ({self.response_bytes} bytes)'
+        return f' - {self.request_count} requests, {self.response_count} responses'
+
+
+class _CurrentSpan:
+
+    def __init__(self, tracer, span_id):
+        """
+        Context manager to make a span current in this thread, restoring the previous span afterwards. Response
+        streams may be finished, or closed by garbage collection, in a different thread to the one they started in.
+        """
+        self.tracer = tracer
+        self.span_id = span_id
+        self.previous_span_id = None
+
+    def __enter__(self):
+        self.previous_span_id = self.tracer.memory.current_span_id
+        self.tracer.memory.current_span_id = self.span_id
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.previous_span_id != self.span_id:
+            self.tracer.memory.current_span_id = self.previous_span_id
+
+
 def _wrap_rpc_behavior(handler, fn):
-    """Helper function to wrap the RPC handler, allowing the request and context to be accessed."""
-    behavior_fn = handler.unary_unary
-    handler_factory = grpc.unary_unary_rpc_method_handler
+    """
+    Helper function to wrap the RPC handler, allowing the request and context to be accessed. Supports all four
+    combinations of unary and streaming requests and responses.
+    """
+    if handler is None:
+        return None
+
+    if handler.request_streaming and handler.response_streaming:
+        behavior_fn = handler.stream_stream
+        handler_factory = grpc.stream_stream_rpc_method_handler
+    elif handler.request_streaming:
+        behavior_fn = handler.stream_unary
+        handler_factory = grpc.stream_unary_rpc_method_handler
+    elif handler.response_streaming:
+        behavior_fn = handler.unary_stream
+        handler_factory = grpc.unary_stream_rpc_method_handler
+    else:
+        behavior_fn = handler.unary_unary
+        handler_factory = grpc.unary_unary_rpc_method_handler
 
     new_rpc_handler = handler_factory(
         fn(
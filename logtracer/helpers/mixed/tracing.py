@@ -3,7 +3,8 @@ from logtracer.helpers.grpc.tracing import GRPCTracer
 
 
 class MixedTracer(GRPCTracer, FlaskTracer):
-    def __init__(self, logger_factory, post_spans_to_stackdriver_api=False):
+    def __init__(self, logger_factory, post_spans_to_stackdriver_api=False, binary_propagation=False,
+                 trace_api_endpoint=None):
         """
         Tracer for a Flask App that calls a gRPC app.
 
@@ -11,5 +12,6 @@ class MixedTracer(GRPCTracer, FlaskTracer):
         not a gRPC client.
         """
 
-        super().__init__(logger_factory, post_spans_to_stackdriver_api)
+        super().__init__(logger_factory, post_spans_to_stackdriver_api, binary_propagation=binary_propagation,
+                         trace_api_endpoint=trace_api_endpoint)
 
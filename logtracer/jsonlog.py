@@ -1,13 +1,15 @@
+import hashlib
 import logging
 import sys
+import time
 import traceback
+from collections import OrderedDict
 from datetime import datetime
 from enum import Enum
+from threading import Lock
 
 from pythonjsonlogger import jsonlogger
 
-from logtracer.exceptions import SpanNotStartedError
-from logtracer.tracing.tracer import B3_SPAN_ID, B3_TRACE_ID
 
 LOG_SEVERITIES = {
     'DEBUG': 'DEBUG',
@@ -22,16 +24,28 @@ LOG_SEVERITIES = {
 class Formatters(Enum):
     local = 'local'
     stackdriver = 'stackdriver'
+    msgpack = 'msgpack'
+
+
+TRACEBACK_CACHE_SIZE = 128
 
 
 class JsonFormatter(jsonlogger.JsonFormatter):
     tracer = None
 
-    def __init__(self, stackdriver, project_name, *args, **kwargs):
+    def __init__(self, stackdriver, project_name, *args, traceback_cache=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.tracer = None
         self.stackdriver = stackdriver
         self.project_name = project_name
+        self.traceback_cache = traceback_cache
+
+    def formatException(self, ei):
+        """
+        The traceback is rendered into the message by `_format_message_for_exception` and the `exc_info` field is
+        dropped from the output, so skip the default rendering.
+        """
+        return ''
 
     def add_fields(self, log_record, record, message_dict):
         """
@@ -40,12 +54,12 @@ class JsonFormatter(jsonlogger.JsonFormatter):
         """
 
         if record.exc_info:
-            _format_message_for_exception(record)
+            _format_message_for_exception(record, self.traceback_cache)
 
         gcp_log_record = _generate_log_record(record, stackdriver=self.stackdriver)
 
         if self.tracer:
-            _add_span_values(self.tracer, gcp_log_record, self.stackdriver, self.project_name)
+            _add_span_values(self.tracer, gcp_log_record, self.stackdriver, getattr(record, 'span_log_fields', None))
 
         log_record.update(gcp_log_record)
         log_record.pop('exc_info', None)
@@ -74,41 +88,101 @@ def _generate_log_record(record, stackdriver=False):
         }
     }
 
-    return json_log_record
-
+    if record.exc_info:
+        json_log_record['exceptionFingerprint'] = getattr(record, 'exc_fingerprint', None)
 
-def _add_span_values(tracer, json_log_record, stackdriver, project_name):
-    """Add span values to log entry if a tracer instance is present and the log entry is written within a span."""
-    try:
-        span_values = tracer.current_span['values']
-
-        trace_name = span_values[B3_TRACE_ID] if not stackdriver \
-            else f'projects/{project_name}/traces/{span_values[B3_TRACE_ID]}'
+    return json_log_record
 
-        prefix = 'logging.googleapis.com/' if stackdriver else ''
 
-        json_log_record.update({
-            f'{prefix}trace': trace_name,
-            f'{prefix}spanId': span_values[B3_SPAN_ID]
-        })
+def _add_span_values(tracer, json_log_record, stackdriver, span_log_fields=None):
+    """
+    Add span values to log entry if a tracer instance is present and the log entry is written within a span.
 
-    except SpanNotStartedError:
-        pass
+    `span_log_fields` is set for records held in a span log buffer, as the current span may have changed by the time
+    they are written.
+    """
+    if span_log_fields is None:
+        span = tracer.find_current_span()
+        if span is None:
+            return
+        span_log_fields = span['log_fields']
+    json_log_record.update(span_log_fields['stackdriver' if stackdriver else 'local'])
 
 
-def _format_message_for_exception(record):
+def _format_message_for_exception(record, traceback_cache=None):
     """
     Check if the log record contains exception information (from usage of logger.exception), if so then format the
     message with the stack trace.
+
+    The exception is fingerprinted by its class and the code locations in its traceback, the fingerprint is stored on
+    the record as `exc_fingerprint`. If a `_TracebackCache` is given then the rendered traceback is reused for
+    repeated fingerprints, and may be replaced with a reference to the fingerprint if it was logged recently.
     """
     exception_class, exception, tb = record.exc_info
-    tb_str = "\n".join(traceback.format_tb(tb))
+    fingerprint = _exception_fingerprint(exception_class, tb)
+    record.exc_fingerprint = fingerprint
+
+    if traceback_cache is None:
+        tb_str = "\n".join(traceback.format_tb(tb))
+    else:
+        tb_str = traceback_cache.get_rendered_traceback(fingerprint, tb)
+
     record.message = f"""Exception: {exception_class.__name__}({str(exception)})\nTraceback:\n{tb_str}"""
 
 
+def _exception_fingerprint(exception_class, tb):
+    """
+    Generate an identifier for an exception from its class and the chain of code locations (file, line, function) in
+    its traceback. Source lines are not read so this is much cheaper than rendering the traceback.
+    """
+    locations = [
+        f'{frame.f_code.co_filename}:{lineno}:{frame.f_code.co_name}' for frame, lineno in traceback.walk_tb(tb)
+    ]
+    key = '|'.join([f'{exception_class.__module__}.{exception_class.__qualname__}'] + locations)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+class _TracebackCache:
+
+    def __init__(self, max_size=TRACEBACK_CACHE_SIZE, repeat_window=None):
+        """
+        Bounded LRU cache of rendered tracebacks, keyed by exception fingerprint.
+
+        Arguments:
+            max_size (int): maximum number of rendered tracebacks to keep
+            repeat_window (float): if set, a traceback already logged in full within this many seconds is replaced
+                with a short reference to its fingerprint
+        """
+        self.max_size = max_size
+        self.repeat_window = repeat_window
+        self._tracebacks = OrderedDict()
+        self._lock = Lock()
+
+    def get_rendered_traceback(self, fingerprint, tb):
+        """Return the rendered traceback for a fingerprint, rendering and caching it if not already present."""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._tracebacks.get(fingerprint)
+            if cached is not None:
+                self._tracebacks.move_to_end(fingerprint)
+                tb_str, last_logged = cached
+                if self.repeat_window is not None and now - last_logged < self.repeat_window:
+                    return f'Repeated, see earlier log entry with exception fingerprint {fingerprint}'
+                self._tracebacks[fingerprint] = (tb_str, now)
+                return tb_str
+
+        tb_str = "\n".join(traceback.format_tb(tb))
+        with self._lock:
+            self._tracebacks[fingerprint] = (tb_str, now)
+            if len(self._tracebacks) > self.max_size:
+                self._tracebacks.popitem(last=False)
+        return tb_str
+
+
 class JSONLoggerFactory:
 
-    def __init__(self, project_name, service_name, logging_format, logger_per_module=False):
+    def __init__(self, project_name, service_name, logging_format, logger_per_module=False,
+                 traceback_cache_size=TRACEBACK_CACHE_SIZE, traceback_repeat_window=None):
         """
         Class to handle creation of a logger instance with a JSON formatter. Only initialise this ONCE and reuse it
         across your app.
@@ -119,17 +193,28 @@ class JSONLoggerFactory:
             logging_format (Formatters): enum of platform for log formatting
             logger_per_module (bool): toggle namespacing loggers per module eg `snowdrop.services.bramble.client`
                 vs `snowdrop`
+            traceback_cache_size (int): number of rendered exception tracebacks to cache by fingerprint
+            traceback_repeat_window (float): seconds within which a repeated exception is logged with a reference to
+                its fingerprint instead of the full traceback, disabled if `None`
         """
         self.project_name = project_name
         self.service_name = service_name
         self.logger_per_module = logger_per_module
+        self.tracer = None
 
         if not isinstance(logging_format, Formatters):
             raise ValueError('Logging format must be from Formatters enum')
 
-        handler = logging.StreamHandler(sys.stdout)
-        stackdriver = True if logging_format == Formatters.stackdriver else False
-        handler.setFormatter(JsonFormatter(stackdriver, project_name))
+        traceback_cache = _TracebackCache(traceback_cache_size, traceback_repeat_window)
+        if logging_format == Formatters.msgpack:
+            # msgpack is an optional dependency, only required for this format
+            from logtracer.msgpacklog import MsgpackFormatter, MsgpackStreamHandler
+            handler = MsgpackStreamHandler()
+            handler.setFormatter(MsgpackFormatter(project_name, traceback_cache=traceback_cache))
+        else:
+            handler = logging.StreamHandler(sys.stdout)
+            stackdriver = True if logging_format == Formatters.stackdriver else False
+            handler.setFormatter(JsonFormatter(stackdriver, project_name, traceback_cache=traceback_cache))
 
         root_logger = logging.getLogger()
         root_logger.handlers = []
@@ -139,6 +224,38 @@ class JSONLoggerFactory:
         """Use this function to get the logger throughout your app."""
         module_name = '' if not self.logger_per_module else module_name
         module_name = f".{module_name}" if module_name else module_name
-        logger = logging.getLogger(f'{self.service_name}{module_name}')
+        logger = _get_traced_logger(f'{self.service_name}{module_name}')
+        logger.logger_factory = self
         logger.setLevel(level)
         return logger
+
+
+def _get_traced_logger(name):
+    """
+    Get a logger, creating it as a `TracedLogger` to allow per-trace debug logging. The logger class is only set while
+    this logger is created, under the `logging` module lock, so loggers created elsewhere are not affected. A logger
+    which already exists keeps its class, and is only enabled for DEBUG records by its level.
+    """
+    manager = logging.Logger.manager
+    with logging._lock:
+        logger_class = manager.loggerClass
+        manager.loggerClass = TracedLogger
+        try:
+            return logging.getLogger(name)
+        finally:
+            manager.loggerClass = logger_class
+
+
+class TracedLogger(logging.Logger):
+    """
+    Logger which, in addition to its level, is enabled for DEBUG records written within a span flagged for debug
+    logging (see `Tracer.enable_trace_debug_logging`).
+    """
+    logger_factory = None
+
+    def isEnabledFor(self, level):
+        if super().isEnabledFor(level):
+            return True
+        tracer = self.logger_factory.tracer if self.logger_factory is not None else None
+        return tracer is not None and level >= logging.DEBUG and self.manager.disable < level \
+            and tracer.is_debug_logging_span()
@@ -0,0 +1,92 @@
+import argparse
+import json
+import logging
+import struct
+import sys
+from datetime import datetime
+
+import msgpack
+
+from logtracer.jsonlog import JsonFormatter, Formatters
+
+LENGTH_PREFIX = struct.Struct('>I')
+STACKDRIVER_PREFIX = 'logging.googleapis.com/'
+
+
+class MsgpackFormatter(JsonFormatter):
+    """
+    Formats log records as length-prefixed msgpack, with the same fields as the `local` JSON formatter except `time`,
+    which is written as a float timestamp. Use `convert_msgpack_stream` to turn the output back into JSON.
+    """
+
+    def __init__(self, project_name, *args, **kwargs):
+        super().__init__(False, project_name, *args, **kwargs)
+
+    def format(self, record):
+        record.message = record.getMessage()
+        log_record = {}
+        self.add_fields(log_record, record, {})
+        log_record['time'] = record.created
+        payload = msgpack.packb(log_record, use_bin_type=True, default=str)
+        return LENGTH_PREFIX.pack(len(payload)) + payload
+
+
+class MsgpackStreamHandler(logging.StreamHandler):
+
+    def __init__(self, stream=None):
+        """Stream handler which writes the bytes produced by `MsgpackFormatter`, defaults to the stdout buffer."""
+        super().__init__(stream if stream is not None else sys.stdout.buffer)
+
+    def emit(self, record):
+        try:
+            self.stream.write(self.format(record))
+            self.flush()
+        except Exception:
+            self.handleError(record)
+
+
+def iter_msgpack_records(stream):
+    """Read log records from a stream of length-prefixed msgpack, stopping at the end of the stream."""
+    while True:
+        prefix = stream.read(LENGTH_PREFIX.size)
+        if len(prefix) < LENGTH_PREFIX.size:
+            return
+        length, = LENGTH_PREFIX.unpack(prefix)
+        yield msgpack.unpackb(stream.read(length), raw=False)
+
+
+def to_json_log_record(log_record, logging_format=Formatters.local, project_name=None):
+    """
+    Convert a decoded msgpack log record into the shape written by the `local` or `stackdriver` JSON formatter.
+
+    Arguments:
+        log_record (dict): record read by `iter_msgpack_records`
+        logging_format (Formatters): `Formatters.local` or `Formatters.stackdriver`
+        project_name (str): GCP project name, used to build the trace resource name for the `stackdriver` format
+    """
+    json_log_record = dict(log_record)
+    json_log_record['time'] = datetime.fromtimestamp(log_record['time']).isoformat()
+
+    if logging_format == Formatters.stackdriver:
+        json_log_record[f'{STACKDRIVER_PREFIX}sourceLocation'] = json_log_record.pop('sourceLocation')
+        if 'trace' in json_log_record:
+            trace_id = json_log_record.pop('trace')
+            json_log_record[f'{STACKDRIVER_PREFIX}trace'] = f'projects/{project_name}/traces/{trace_id}'
+            json_log_record[f'{STACKDRIVER_PREFIX}spanId'] = json_log_record.pop('spanId')
+
+    return json_log_record
+
+
+def convert_msgpack_stream(in_stream, out_stream, logging_format=Formatters.local, project_name=None):
+    """Convert a stream of length-prefixed msgpack log records into JSON lines."""
+    for log_record in iter_msgpack_records(in_stream):
+        out_stream.write(json.dumps(to_json_log_record(log_record, logging_format, project_name)) + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert msgpack logs from stdin into JSON logs on stdout.')
+    parser.add_argument('--format', choices=[Formatters.local.value, Formatters.stackdriver.value],
+                        default=Formatters.local.value)
+    parser.add_argument('--project-name')
+    arguments = parser.parse_args()
+    convert_msgpack_stream(sys.stdin.buffer, sys.stdout, Formatters[arguments.format], arguments.project_name)
@@ -10,13 +10,15 @@ class RequestsWrapper:
         request_methods = [method for method in dir(requests.api) if not method.startswith('_')]
 
         def wrapped_request(method):
+            method_name = method.upper()
+
             def wrapper(*args, **kwargs):
                 headers = deepcopy(kwargs.get('headers', {}))
                 headers.update(self.tracer.generate_new_traced_subspan_values())
                 kwargs['headers'] = headers
-                self.tracer.logger.info(f'OUTBOUND {method.upper()} - {args[0]}')
+                self.tracer.logger.info('OUTBOUND %s - %s', method_name, args[0])
                 response = getattr(requests, method)(*args, **kwargs)
-                self.tracer.logger.info(f'{response.status_code} {response.reason} - {args[0]}')
+                self.tracer.logger.info('%s %s - %s', response.status_code, response.reason, args[0])
                 return response
 
             return wrapper
@@ -34,12 +36,14 @@ class UnsupportedRequestsWrapper:
         request_methods = [method for method in dir(requests.api) if not method.startswith('_')]
 
         def wrapped_request(method):
+            method_name = method.upper()
+
             def wrapper(*args, **kwargs):
                 url = args[0]
                 with SubSpanContext(tracer, url):
-                    self.tracer.logger.info(f'OUTBOUND {method.upper()} - {url}')
+                    self.tracer.logger.info('OUTBOUND %s - %s', method_name, url)
                     response = getattr(requests, method)(*args, **kwargs)
-                    self.tracer.logger.info(f'{response.status_code} {response.reason} - {url}')
+                    self.tracer.logger.info('%s %s - %s', response.status_code, response.reason, url)
                 return response
 
             return wrapper
@@ -1,2 +1,4 @@
 from logtracer.tracing.tracer import Tracer
 from logtracer.tracing.context_managers import SpanContext, SubSpanContext
+from logtracer.tracing.wsgi import WSGITracingMiddleware
+from logtracer.tracing.asgi import ASGITracingMiddleware
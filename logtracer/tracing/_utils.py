@@ -1,3 +1,4 @@
+import inspect
 import os
 import time
 from binascii import hexlify
@@ -6,8 +7,27 @@ from google.protobuf.timestamp_pb2 import Timestamp
 
 
 def post_span(stackdriver_trace_client, span_info):
-    """Post span to Stackdriver Trace API."""
-    stackdriver_trace_client.create_span(**span_info)
+    """
+    Post span to Stackdriver Trace API. Clients from google-cloud-trace 1.0 onwards take the span as a request, earlier
+    clients take its fields as keyword arguments.
+    """
+    if _create_span_takes_request(stackdriver_trace_client):
+        stackdriver_trace_client.create_span(request=span_info)
+    else:
+        stackdriver_trace_client.create_span(**span_info)
+
+
+_CREATE_SPAN_TAKES_REQUEST = {}
+
+
+def _create_span_takes_request(stackdriver_trace_client):
+    """States if the `create_span` method of a trace client takes a request, cached per client class."""
+    client_class = type(stackdriver_trace_client)
+    takes_request = _CREATE_SPAN_TAKES_REQUEST.get(client_class)
+    if takes_request is None:
+        takes_request = _CREATE_SPAN_TAKES_REQUEST[client_class] = \
+            'request' in inspect.signature(stackdriver_trace_client.create_span).parameters
+    return takes_request
 
 
 def get_timestamp():
@@ -35,6 +55,22 @@ def truncate_str(str_to_truncate, limit):
     return trunc
 
 
+def to_span_attributes(attributes, value_limit):
+    """
+    Convert a dict of span attributes into the format Stackdriver Trace accepts. Integers and booleans are kept as
+    they are, other values are converted to truncated strings.
+    """
+    attribute_map = {}
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            attribute_map[key] = {'bool_value': value}
+        elif isinstance(value, int):
+            attribute_map[key] = {'int_value': value}
+        else:
+            attribute_map[key] = {'string_value': truncate_str(str(value), limit=value_limit)}
+    return {'attribute_map': attribute_map}
+
+
 def generate_identifier(identifier_length):
     """
     Generates a new, random identifier in B3 format.
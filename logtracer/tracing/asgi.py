@@ -0,0 +1,114 @@
+import logging
+import time
+
+from logtracer.tracing.tracer import B3_HEADERS, GOOGLE_LOAD_BALANCER_TRACE_HEADERS
+
+
+class ASGITracingMiddleware:
+
+    def __init__(self, app, tracer, exclude_from_posting=False):
+        """
+        ASGI middleware to trace and log inbound HTTP requests, for use with asyncio frameworks, eg Starlette or
+        FastAPI. Spans are stored in context variables, so each request must be handled in its own task, as ASGI
+        servers do. The span is ended when the final response body message is sent, and an access line with the
+        response status and duration is logged.
+
+        Arguments:
+            app: ASGI app to wrap
+            tracer (logtracer.tracing.Tracer): tracer to start and end spans with
+            exclude_from_posting (bool): exclude the spans from being posted to the Trace API
+        """
+        self.app = app
+        self._tracer = tracer
+        self._exclude_from_posting = exclude_from_posting
+        self._raw_headers = {
+            header.lower().encode('latin-1'): header for header in B3_HEADERS + [GOOGLE_LOAD_BALANCER_TRACE_HEADERS]
+        }
+        self._debug_raw_headers = None
+        tracer.enable_context_local_spans()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        tracer = self._tracer
+        start_time = time.monotonic()
+        headers, host = self._extract_headers(scope)
+        url = _request_url(scope, host)
+        # start the span without the parent spans of the context the task was copied from
+        tracer.memory.parent_spans = []
+        tracer.start_traced_span(headers, scope['path'])
+        span_id = tracer.memory.current_span_id
+        if tracer.logger.isEnabledFor(logging.INFO):
+            tracer.logger.info('%s - %s', scope['method'], url)
+
+        status = None
+        span_ended = False
+
+        def end_span():
+            nonlocal span_ended
+            span_ended = True
+            duration_ms = (time.monotonic() - start_time) * 1000
+            # the app may send from another task, eg a background task group, so the span is made current before the
+            # access line is logged with its trace ids
+            tracer.set_current_span(span_id)
+            if status is None or status >= 400:
+                tracer.logger.error('%s - %s (%.1f ms)', status, url, duration_ms)
+            elif tracer.logger.isEnabledFor(logging.INFO):
+                tracer.logger.info('%s - %s (%.1f ms)', status, url, duration_ms)
+            tracer.end_traced_span(self._exclude_from_posting)
+
+        async def traced_send(message):
+            nonlocal status
+            message_type = message['type']
+            if message_type == 'http.response.start':
+                status = message['status']
+            await send(message)
+            if message_type == 'http.response.body' and not message.get('more_body', False) and not span_ended:
+                end_span()
+
+        try:
+            await self.app(scope, receive, traced_send)
+        except Exception as e:
+            tracer.logger.exception(e)
+            raise
+        finally:
+            if not span_ended:
+                end_span()
+
+    def _extract_headers(self, scope):
+        """
+        Extract the trace headers, and the host, from the raw headers of the scope in one pass, without building a
+        dict of every header.
+        """
+        raw_headers = self._raw_headers
+        debug_logging_header = self._tracer.debug_logging_header
+        if debug_logging_header is not None:
+            if self._debug_raw_headers is None or self._debug_raw_headers[0] != debug_logging_header:
+                self._debug_raw_headers = (debug_logging_header, {
+                    **raw_headers, debug_logging_header.lower().encode('latin-1'): debug_logging_header
+                })
+            raw_headers = self._debug_raw_headers[1]
+
+        headers = {}
+        host = None
+        for name, value in scope['headers']:
+            header = raw_headers.get(name)
+            if header is not None:
+                headers[header] = value.decode('latin-1')
+            elif name == b'host':
+                host = value.decode('latin-1')
+        return headers, host
+
+
+def _request_url(scope, host):
+    """Rebuild the URL of a request from the scope."""
+    if host is None:
+        server = scope.get('server')
+        host = f'{server[0]}:{server[1]}' if server else ''
+    url = f"{scope.get('scheme', 'http')}://{host}{scope.get('root_path', '')}{scope['path']}"
+    query_string = scope.get('query_string')
+    if query_string:
+        url = f"{url}?{query_string.decode('latin-1')}"
+    return url
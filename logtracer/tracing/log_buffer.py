@@ -0,0 +1,92 @@
+import logging
+import random
+import time
+from collections import Counter, deque
+
+DEFAULT_MAX_BUFFERED_RECORDS = 100
+
+
+class SpanLogBuffer:
+
+    def __init__(self, owner_span_id, max_records=DEFAULT_MAX_BUFFERED_RECORDS, sampled=False):
+        """
+        Bounded buffer of the log records written within a span (and its subspans) while buffering is enabled.
+
+        Arguments:
+            owner_span_id (str): id of the span which created the buffer, the buffer is resolved when this span ends
+            max_records (int): maximum number of records to hold, the oldest records are dropped first
+            sampled (bool): if True the buffer is inactive from the start and all records are written immediately
+
+        Attributes:
+            self.active (bool): records are only buffered while this is True
+        """
+        self.owner_span_id = owner_span_id
+        self.records = deque(maxlen=max_records)
+        self.dropped_count = 0
+        self.active = not sampled
+        self.start_time = time.monotonic()
+
+    def append(self, record, span_log_fields):
+        """
+        Hold a record. The message is rendered now so later changes to the arguments are not reflected, and the
+        tracing fields of the span it was written in are attached for when it is formatted.
+        """
+        if len(self.records) == self.records.maxlen:
+            self.dropped_count += 1
+        record.msg = record.getMessage()
+        record.args = None
+        record.span_log_fields = span_log_fields
+        self.records.append(record)
+
+    def flush(self, handler):
+        """Write all held records to the handler and stop buffering."""
+        self.active = False
+        while self.records:
+            handler.handle(self.records.popleft())
+
+    def discard(self):
+        """Drop all held records and stop buffering, returning a count of the dropped records by level name."""
+        self.active = False
+        summary = Counter(record.levelname for record in self.records)
+        self.records.clear()
+        return summary
+
+    def elapsed(self):
+        """Seconds since the buffer was created."""
+        return time.monotonic() - self.start_time
+
+
+class SpanLogBufferFilter(logging.Filter):
+
+    def __init__(self, tracer, handler, flush_level):
+        """
+        Handler filter which diverts records written within a span into the span's `SpanLogBuffer`.
+
+        Records at or above `flush_level` flush the buffer, so the context leading up to them is written first, and
+        then pass straight through. Any further records in the span are not buffered.
+        """
+        super().__init__()
+        self.tracer = tracer
+        self.handler = handler
+        self.flush_level = flush_level
+
+    def filter(self, record):
+        span = self.tracer.find_current_span()
+        if span is None:
+            return True
+
+        log_buffer = span.get('log_buffer')
+        if log_buffer is None or not log_buffer.active:
+            return True
+
+        if record.levelno >= self.flush_level:
+            log_buffer.flush(self.handler)
+            return True
+
+        log_buffer.append(record, span['log_fields'])
+        return False
+
+
+def is_sampled(sample_rate):
+    """Decide if a span's logs should be written regardless of outcome."""
+    return sample_rate > 0 and random.random() < sample_rate
@@ -0,0 +1,85 @@
+import gc
+import time
+import tracemalloc
+from threading import get_ident
+
+
+class _GCPauseMonitor:
+
+    def __init__(self):
+        """
+        Garbage collector callback totalling the time spent in collections, from which the pauses overlapping a span
+        are found by taking the difference between the totals at its start and end. All threads are paused while the
+        collector runs, so every span in progress is charged with each pause.
+
+        Attributes:
+            self.totals ((int, int)): nanoseconds spent in collections and the number of collections, replaced as a
+                whole so that it is read consistently from other threads
+        """
+        self.totals = (0, 0)
+        self._start_ns = None
+        self._installed = False
+
+    def install(self):
+        """Add the callback to `gc.callbacks`, once."""
+        if not self._installed:
+            gc.callbacks.append(self._callback)
+            self._installed = True
+
+    def _callback(self, phase, info):
+        if phase == 'start':
+            self._start_ns = time.perf_counter_ns()
+        elif self._start_ns is not None:
+            pause_ns, collections = self.totals
+            self.totals = (pause_ns + time.perf_counter_ns() - self._start_ns, collections + 1)
+            self._start_ns = None
+
+
+gc_pause_monitor = _GCPauseMonitor()
+
+
+class SpanResourceUsage:
+    __slots__ = ('thread_id', 'thread_time_ns', 'gc_totals', 'traced_memory')
+
+    def __init__(self, trace_allocations=False):
+        """
+        Resource usage counters taken when a span starts, to measure the usage of the span against when it ends.
+
+        Arguments:
+            trace_allocations (bool): also take the size of the memory blocks traced by `tracemalloc`, if it is tracing
+        """
+        self.thread_id = get_ident()
+        self.thread_time_ns = time.thread_time_ns()
+        self.gc_totals = gc_pause_monitor.totals
+        self.traced_memory = tracemalloc.get_traced_memory()[0] if trace_allocations and tracemalloc.is_tracing() \
+            else None
+
+    def measure(self):
+        """
+        Measure the usage since the span started as span attributes. CPU time is only measured if the span is ending
+        in the thread it started in, as it is the CPU time of that thread. Allocations are the change in the size of
+        the memory traced for the whole process, so include those of anything running alongside the span.
+        """
+        gc_pause_ns, gc_collections = gc_pause_monitor.totals
+        attributes = {
+            'resource.gc_pause_ms': round((gc_pause_ns - self.gc_totals[0]) / 10 ** 6, 3),
+            'resource.gc_collections': gc_collections - self.gc_totals[1]
+        }
+        if get_ident() == self.thread_id:
+            attributes['resource.cpu_ms'] = round((time.thread_time_ns() - self.thread_time_ns) / 10 ** 6, 3)
+        if self.traced_memory is not None and tracemalloc.is_tracing():
+            attributes['resource.allocated_bytes'] = tracemalloc.get_traced_memory()[0] - self.traced_memory
+        return attributes
+
+
+def format_resource_usage(attributes):
+    """Summarise resource usage attributes for the end of a log line, eg ' - cpu 1.2 ms, gc 0.0 ms (0 collections)'."""
+    parts = []
+    if 'resource.cpu_ms' in attributes:
+        parts.append(f"cpu {attributes['resource.cpu_ms']:.1f} ms")
+    parts.append(
+        f"gc {attributes['resource.gc_pause_ms']:.1f} ms ({attributes['resource.gc_collections']} collections)"
+    )
+    if 'resource.allocated_bytes' in attributes:
+        parts.append(f"allocated {attributes['resource.allocated_bytes']} bytes")
+    return ' - ' + ', '.join(parts)
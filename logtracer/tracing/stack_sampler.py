@@ -0,0 +1,108 @@
+import sys
+import time
+from collections import Counter
+from threading import Event, Lock, Thread
+
+DEFAULT_SAMPLE_INTERVAL_SECONDS = 0.01
+DEFAULT_MAX_STACK_DEPTH = 64
+DEFAULT_MAX_STACKS = 20
+
+
+class SlowSpanSampler:
+
+    def __init__(self, slow_span_seconds, interval_seconds=DEFAULT_SAMPLE_INTERVAL_SECONDS,
+                 max_stack_depth=DEFAULT_MAX_STACK_DEPTH, max_stacks=DEFAULT_MAX_STACKS):
+        """
+        Sampling profiler for slow spans. Spans are watched along with the thread which started them, and once a span
+        has been running for `slow_span_seconds` the stack of its thread is sampled every `interval_seconds` until it
+        ends. Nothing is sampled while no span is slow, and the sampling thread sleeps while no span is watched.
+
+        Arguments:
+            slow_span_seconds (float): duration after which a span's thread is sampled
+            interval_seconds (float): time between samples of a slow span
+            max_stack_depth (int): maximum number of frames kept per sample, counted from the innermost frame
+            max_stacks (int): maximum number of distinct stacks reported per span, the most sampled are kept
+        """
+        self.slow_span_seconds = slow_span_seconds
+        self.interval_seconds = interval_seconds
+        self.max_stack_depth = max_stack_depth
+        self.max_stacks = max_stacks
+        self._watched = {}
+        self._lock = Lock()
+        self._wakeup = Event()
+        self._thread = None
+
+    def watch(self, span_id, thread_id):
+        """Start watching a span run by a thread, starting the sampling thread if it is not running."""
+        with self._lock:
+            self._watched[span_id] = _WatchedSpan(thread_id, time.monotonic() + self.slow_span_seconds)
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='logtracer-slow-span-sampler', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def unwatch(self, span_id):
+        """Stop watching a span, returning a `Counter` of its collapsed stacks, `None` if it was never sampled."""
+        with self._lock:
+            watched_span = self._watched.pop(span_id, None)
+        if watched_span is None or not watched_span.stacks:
+            return None
+        return watched_span.stacks
+
+    def sample(self, now=None):
+        """
+        Sample the threads of the slow spans, returning the seconds until the next sample is due, or `None` if no
+        span is watched.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if not self._watched:
+                return None
+            next_due = min(watched_span.due for watched_span in self._watched.values())
+            if next_due > now:
+                return next_due - now
+            frames = sys._current_frames()
+            for watched_span in self._watched.values():
+                if watched_span.due <= now:
+                    frame = frames.get(watched_span.thread_id)
+                    if frame is not None:
+                        watched_span.stacks[collapse_stack(frame, self.max_stack_depth)] += 1
+                    watched_span.due = now + self.interval_seconds
+            del frames
+        return self.interval_seconds
+
+    def _run(self):
+        while True:
+            wait_seconds = self.sample()
+            if wait_seconds is None:
+                self._wakeup.wait()
+                self._wakeup.clear()
+            else:
+                time.sleep(wait_seconds)
+
+
+class _WatchedSpan:
+    __slots__ = ('thread_id', 'due', 'stacks')
+
+    def __init__(self, thread_id, due):
+        self.thread_id = thread_id
+        self.due = due
+        self.stacks = Counter()
+
+
+def collapse_stack(frame, max_depth=DEFAULT_MAX_STACK_DEPTH):
+    """
+    Collapse a stack into a single line of `module:function` entries separated by semicolons, outermost first, the
+    format read by flame graph tools.
+    """
+    entries = []
+    while frame is not None and len(entries) < max_depth:
+        entries.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    entries.reverse()
+    return ';'.join(entries)
+
+
+def format_collapsed_stacks(stacks, max_stacks=DEFAULT_MAX_STACKS):
+    """Format collapsed stacks one per line followed by their sample count, most sampled first."""
+    return '\n'.join(f'{stack} {count}' for stack, count in stacks.most_common(max_stacks))
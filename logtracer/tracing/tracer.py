@@ -1,15 +1,24 @@
+import logging
 import re
-from threading import Thread, local
+import tracemalloc
+from contextvars import ContextVar
+from threading import Thread, get_ident, local
 
+import grpc
 from google.auth.exceptions import DefaultCredentialsError
 from google.cloud.trace_v2 import TraceServiceClient
 from google.protobuf.wrappers_pb2 import BoolValue, Int32Value
 
 from logtracer.exceptions import StackDriverAuthError, SpanNotStartedError
 from logtracer.requests_wrapper import RequestsWrapper, UnsupportedRequestsWrapper
-from logtracer.tracing._utils import post_span, get_timestamp, truncate_str, generate_identifier
+from logtracer.tracing._utils import post_span, get_timestamp, truncate_str, generate_identifier, to_span_attributes
+from logtracer.tracing.resource_usage import SpanResourceUsage, format_resource_usage, gc_pause_monitor
+from logtracer.tracing.log_buffer import SpanLogBuffer, SpanLogBufferFilter, is_sampled, DEFAULT_MAX_BUFFERED_RECORDS
+from logtracer.tracing.stack_sampler import SlowSpanSampler, format_collapsed_stacks, \
+    DEFAULT_SAMPLE_INTERVAL_SECONDS, DEFAULT_MAX_STACK_DEPTH, DEFAULT_MAX_STACKS
 
 SPAN_DISPLAY_NAME_BYTE_LIMIT = 128
+SPAN_ATTRIBUTE_VALUE_BYTE_LIMIT = 256
 TRACE_LEN = 32
 SPAN_LEN = 16
 B3_TRACE_ID = 'X-B3-TraceId'
@@ -24,7 +33,7 @@ B3_HEADERS = [B3_TRACE_ID, B3_PARENT_SPAN_ID, B3_SPAN_ID, B3_SAMPLED, B3_FLAGS]
 
 
 class Tracer:
-    def __init__(self, json_logger_factory, post_spans_to_stackdriver_api=False):
+    def __init__(self, json_logger_factory, post_spans_to_stackdriver_api=False, trace_api_endpoint=None):
         """
         Class to manage creation and deletion of spans. This should be initialised once within an app then reused
         across it.
@@ -34,6 +43,9 @@ class Tracer:
                 logger factory instance to attach for logging tracing events.
             post_spans_to_stackdriver_api (bool):
                 toggle for posting spans to the Stackdriver API (requires google credentials)
+            trace_api_endpoint (str):
+                host and port of a Trace API to post spans to over an insecure channel, without credentials, instead of
+                the Stackdriver API, eg a local stand-in for testing
 
         Attributes:
             self.project_name (str): Name of your project, the GCP project name if posting to Stackdriver Trace
@@ -43,9 +55,16 @@ class Tracer:
                 a wrapper for the `requests` library to conveniently trace outgoing requests
 
             self._spans (dict): dict to store span information indexed by span id
-            self._memory (threading.local()): thread local memory to store the current span ID
+            self._memory (threading.local()): thread local memory to store the current span ID, or context local memory
+                if `enable_context_local_spans` has been called
             self._post_spans_to_stackdriver_api (bool): toggle for posting spans to Stackdriver API
-
+            self._trace_api_endpoint (str): endpoint to post spans to instead of the Stackdriver API, `None` if unset
+            self._log_handler (logging.Handler): handler which writes the JSON logs
+            self._span_log_buffering (dict): span log buffering settings, `None` if buffering is disabled
+            self._debug_logging_header (str): header which flags a trace for debug logging, `None` if disabled
+            self._slow_span_sampler (logtracer.tracing.stack_sampler.SlowSpanSampler): sampler of the stacks of slow
+                spans, `None` if disabled
+            self._span_resource_usage (dict): span resource usage settings, `None` if resource usage is not recorded
 
         """
         self.project_name = json_logger_factory.project_name
@@ -58,6 +77,12 @@ class Tracer:
         self._spans = {}
         self._memory = None
         self._post_spans_to_stackdriver_api = post_spans_to_stackdriver_api
+        self._trace_api_endpoint = trace_api_endpoint
+        self._log_handler = None
+        self._span_log_buffering = None
+        self._debug_logging_header = None
+        self._slow_span_sampler = None
+        self._span_resource_usage = None
 
         self._add_tracer_to_logger_formatter(json_logger_factory)
         self._verify_gcp_credentials()
@@ -65,6 +90,9 @@ class Tracer:
     def _verify_gcp_credentials(self):
         """If the flag is enabled then attempt to load the trace client used for posting spans to the Trace API."""
         if self._post_spans_to_stackdriver_api:
+            if self._trace_api_endpoint is not None:
+                self.stackdriver_trace_client = _create_insecure_trace_client(self._trace_api_endpoint)
+                return
             try:
                 self.stackdriver_trace_client = TraceServiceClient()
             except DefaultCredentialsError:
@@ -72,11 +100,15 @@ class Tracer:
 
     def _add_tracer_to_logger_formatter(self, json_logger_factory):
         """Add this instance to the logging formatter to allow the logger to format logs with trace information."""
-        json_logger_factory.get_logger().root.handlers[0].formatter.tracer = self
+        json_logger_factory.tracer = self
+        self._log_handler = json_logger_factory.get_logger().root.handlers[0]
+        self._log_handler.formatter.tracer = self
 
     def set_logging_level(self, level):
         """
-        Set the logging level of the tracer
+        Set the logging level of the tracer. Tracing log messages are formatted lazily and expensive arguments are
+        only built if `logger.isEnabledFor` the level, the result of which is cached by the `logging` module and reset
+        by this call.
 
         level (str):
             'DEBUG': Span creation, closure, and deletion information (not useful in production)
@@ -86,7 +118,120 @@ class Tracer:
         """
         self.logger.setLevel(level)
 
-    def start_traced_span(self, incoming_headers, span_name):
+    def enable_trace_debug_logging(self, header=B3_FLAGS):
+        """
+        Write DEBUG logs, from loggers created by the `JSONLoggerFactory`, for traces whose incoming headers have
+        `header` set to '1' or 'true', regardless of logging level. The B3 debug flag is set on these traces so that
+        downstream services with this enabled also write DEBUG logs for them.
+
+        Arguments:
+            header (str): header to trigger debug logging, defaults to `X-B3-Flags`
+        """
+        self._debug_logging_header = header
+
+    @property
+    def debug_logging_header(self):
+        """Header which flags a trace for debug logging, `None` if `enable_trace_debug_logging` has not been called."""
+        return self._debug_logging_header
+
+    def is_debug_logging_span(self):
+        """States if the current span is flagged for debug logging."""
+        if self._debug_logging_header is None:
+            return False
+        span = self.find_current_span()
+        return span is not None and span.get('debug_logging', False)
+
+    def enable_context_local_spans(self):
+        """
+        Store the current span in context variables instead of thread local memory. Required by asyncio apps, which
+        handle many requests concurrently in one thread, each request must run in its own task. Calling this again
+        keeps the context variables already in use, so the current span of tasks in progress is not lost.
+        """
+        if not isinstance(self._memory, _ContextSpanMemory):
+            self._memory = _ContextSpanMemory(id(self))
+
+    def enable_span_log_buffering(self, max_records=DEFAULT_MAX_BUFFERED_RECORDS, flush_level='ERROR',
+                                  slow_span_seconds=None, sample_rate=0.0):
+        """
+        Hold log records written within a span in a bounded buffer. When the span ends, the records are written if the
+        span errored, was slow or was sampled, otherwise they are discarded and a one line summary is logged instead.
+        Subspans share the buffer of the span they were started in.
+
+        Arguments:
+            max_records (int): maximum number of records to hold per span, the oldest are dropped first
+            flush_level (int or str): records at or above this level, a level number or name as accepted by
+                `Logger.setLevel`, are written immediately, along with any records held for the span, and buffering
+                stops for the rest of the span
+            slow_span_seconds (float): write the held records if the span took at least this long
+            sample_rate (float): fraction of spans to write all records for, spans with the B3 debug flag are always
+                written
+        """
+        # normalised as by `Logger.setLevel`, `getLevelName` would map a level number back to its name
+        flush_level = logging._checkLevel(flush_level)
+        if self._span_log_buffering is None:
+            self._log_handler.addFilter(SpanLogBufferFilter(self, self._log_handler, flush_level))
+        else:
+            for log_filter in self._log_handler.filters:
+                if isinstance(log_filter, SpanLogBufferFilter):
+                    log_filter.flush_level = flush_level
+        self._span_log_buffering = {
+            'max_records': max_records,
+            'slow_span_seconds': slow_span_seconds,
+            'sample_rate': sample_rate
+        }
+
+    def enable_slow_span_sampling(self, slow_span_seconds, interval_seconds=DEFAULT_SAMPLE_INTERVAL_SECONDS,
+                                  max_stack_depth=DEFAULT_MAX_STACK_DEPTH, max_stacks=DEFAULT_MAX_STACKS):
+        """
+        Sample the stack of the thread running a span once the span has taken `slow_span_seconds`, until it ends. When
+        a sampled span ends its collapsed stacks are logged at WARNING level with the span's trace id, and the sample
+        count and the most sampled stack are set as span attributes. Subspans are covered by the samples of the span
+        they were started in. Spans are sampled from a single background thread, which sleeps while no span is slow.
+
+        With context local spans the thread sampled is the event loop's, so the samples show whatever the loop was
+        running at the time rather than only the slow request.
+
+        Arguments:
+            slow_span_seconds (float): duration after which a span's thread is sampled
+            interval_seconds (float): time between samples of a slow span
+            max_stack_depth (int): maximum number of frames kept per sample, counted from the innermost frame
+            max_stacks (int): maximum number of distinct stacks logged per span, the most sampled are kept
+        """
+        self._slow_span_sampler = SlowSpanSampler(slow_span_seconds, interval_seconds, max_stack_depth, max_stacks)
+
+    def enable_span_resource_usage(self, trace_allocations=False):
+        """
+        Record the resource usage of each span as span attributes when it ends: the CPU time of the thread running it,
+        and the time spent in garbage collections while it ran. The Flask and gRPC tracers also summarise the usage in
+        the log line written at the end of each request.
+
+        Arguments:
+            trace_allocations (bool): also record the change in the size of the memory traced by `tracemalloc`,
+                starting `tracemalloc` if it is not tracing. This slows down every allocation, and counts those of
+                everything running alongside the span, so is best used while investigating a problem.
+        """
+        gc_pause_monitor.install()
+        if trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._span_resource_usage = {'trace_allocations': trace_allocations}
+
+    def record_span_resource_usage(self):
+        """
+        Measure the resource usage of the current span since it started and set it as span attributes, once per span.
+
+        Returns:
+            (str): summary of the usage for the end of a log line, empty if resource usage is not recorded, or has
+                already been recorded for the span
+        """
+        span = self.find_current_span()
+        resource_usage = span.pop('resource_usage', None) if span is not None else None
+        if resource_usage is None:
+            return ''
+        attributes = resource_usage.measure()
+        span.setdefault('attributes', {}).update(attributes)
+        return format_resource_usage(attributes)
+
+    def start_traced_span(self, incoming_headers, span_name, truncated_display_name=None):
         """
         Create a span and set it as the current span in the thread local memory.
         Retrieves span details from inbound call, otherwise generates new values.
@@ -94,6 +239,8 @@ class Tracer:
         Arguments:
             incoming_headers: Incoming request headers. These could be http, or part of a GRPC message.
             span_name (str): Path of the endpoint of the incoming request.
+            truncated_display_name (str): display name of the span already truncated to
+                `SPAN_DISPLAY_NAME_BYTE_LIMIT` bytes, for callers that cache the display names of span names they reuse
         """
         incoming_headers = self._extract_google_trace_headers_if_present(incoming_headers)
 
@@ -105,16 +252,62 @@ class Tracer:
             B3_FLAGS: incoming_headers.get(B3_FLAGS)
         }
 
+        debug_logging = self._debug_logging_header is not None and \
+            str(incoming_headers.get(self._debug_logging_header, '')).lower() in ('1', 'true')
+        if debug_logging:
+            span_values[B3_FLAGS] = '1'
+
         span_id = span_values[B3_SPAN_ID]
         self._spans[span_id] = {
             "start_timestamp": get_timestamp(),
             "display_name": f'{self.service_name}:{span_name}',
             "child_span_count": 0,
-            "values": span_values
+            "values": span_values,
+            "log_fields": _generate_span_log_fields(self.project_name, span_values[B3_TRACE_ID], span_id)
         }
+        if debug_logging:
+            self._spans[span_id]['debug_logging'] = True
+        if truncated_display_name is not None:
+            self._spans[span_id]['truncated_display_name'] = truncated_display_name
+        if self._span_log_buffering is not None:
+            self._spans[span_id]['log_buffer'] = self._get_span_log_buffer(span_id, span_values)
+        if self._span_resource_usage is not None:
+            self._spans[span_id]['resource_usage'] = SpanResourceUsage(self._span_resource_usage['trace_allocations'])
+        if self._slow_span_sampler is not None and not self.memory.parent_spans:
+            self._slow_span_sampler.watch(span_id, get_ident())
         self.memory.current_span_id = span_id
 
-        self.logger.debug(f'Span started {self.memory.current_span_id}')
+        self.logger.debug('Span started %s', span_id)
+
+    def _get_span_log_buffer(self, span_id, span_values):
+        """Create a log buffer for a new span, or if this is a subspan then reuse the buffer of its parent span."""
+        if self.memory.parent_spans:
+            parent_span = self._spans.get(self.memory.parent_spans[-1])
+            if parent_span is not None and 'log_buffer' in parent_span:
+                return parent_span['log_buffer']
+        sampled = span_values[B3_FLAGS] == '1' or is_sampled(self._span_log_buffering['sample_rate'])
+        return SpanLogBuffer(span_id, self._span_log_buffering['max_records'], sampled=sampled)
+
+    def _resolve_span_log_buffer(self):
+        """
+        When the span that created the current log buffer ends, write the held records if the span was slow, or
+        discard them and log a summary. Records dropped from a full buffer are counted either way.
+        """
+        log_buffer = self.current_span.get('log_buffer')
+        if log_buffer is None or log_buffer.owner_span_id != self.memory.current_span_id:
+            return
+
+        if log_buffer.active:
+            slow_span_seconds = self._span_log_buffering['slow_span_seconds']
+            if slow_span_seconds is not None and log_buffer.elapsed() >= slow_span_seconds:
+                log_buffer.flush(self._log_handler)
+            else:
+                summary = log_buffer.discard()
+                if summary:
+                    self.logger.info('Discarded %s buffered log records %s', sum(summary.values()), dict(summary))
+
+        if log_buffer.dropped_count:
+            self.logger.info('Dropped %s log records from full span log buffer', log_buffer.dropped_count)
 
     def _extract_google_trace_headers_if_present(self, incoming_headers):
         """
@@ -149,19 +342,40 @@ class Tracer:
                 pass
         raise SpanNotStartedError('No current span found.')
 
+    def find_current_span(self):
+        """
+        Return current span data, or `None` if there is no current span. Unlike `current_span` this does not raise,
+        making it cheap to call for every log record.
+        """
+        return self._spans.get(self.memory.current_span_id)
+
+    def set_current_span(self, span_id):
+        """
+        Make a started span the current span of this thread, or task, again. For ending spans of responses which are
+        finished after the request has been handled, possibly in another thread.
+        """
+        self.memory.current_span_id = span_id
+
+    def set_span_attribute(self, key, value):
+        """Set an attribute on the current span, attributes are posted to the Trace API along with the span."""
+        self.current_span.setdefault('attributes', {})[key] = value
+
     def start_traced_subspan(self, span_name):
         """Start a traced subspan, for usage with wrapping an unsupported downstream service."""
         if self.memory.current_span_id is None:
             raise SpanNotStartedError('Span must be started before starting a subspan')
         subspan_values = self.generate_new_traced_subspan_values()
-        self.memory.parent_spans.append(self.memory.current_span_id)
+        # parent spans are copied rather than mutated, as context local memory may be shared with child tasks
+        self.memory.parent_spans = self.memory.parent_spans + [self.memory.current_span_id]
         self.memory.current_span_id = None
         self.start_traced_span(subspan_values, span_name)
 
     def end_traced_subspan(self, exclude_from_posting=False):
         """Close a traced subspan."""
         self.end_traced_span(exclude_from_posting)
-        self.memory.current_span_id = self.memory.parent_spans.pop()
+        parent_spans = self.memory.parent_spans
+        self.memory.current_span_id = parent_spans[-1]
+        self.memory.parent_spans = parent_spans[:-1]
 
     def end_traced_span(self, exclude_from_posting=False):
         """
@@ -170,7 +384,12 @@ class Tracer:
         Arguments:
             exclude_from_posting (bool): exclude this particular trace from being posted
         """
-        self.logger.debug(f'Closing span {self.memory.current_span_id}')
+        self.logger.debug('Closing span %s', self.memory.current_span_id)
+
+        if self._slow_span_sampler is not None:
+            self._report_span_stack_samples()
+        if self._span_resource_usage is not None:
+            self.record_span_resource_usage()
 
         if self._post_spans_to_stackdriver_api and not exclude_from_posting:
             span_values = self.current_span['values']
@@ -185,21 +404,41 @@ class Tracer:
             span_info = {
                 'name': name,
                 'span_id': span_values[B3_SPAN_ID],
-                'display_name': truncate_str(self.current_span['display_name'], limit=SPAN_DISPLAY_NAME_BYTE_LIMIT),
+                'display_name': _span_display_name(self.current_span),
                 'start_time': self.current_span['start_timestamp'],
                 'end_time': end_timestamp,
                 'parent_span_id': span_values[B3_PARENT_SPAN_ID],
                 'same_process_as_parent_span': BoolValue(value=False),
                 'child_span_count': Int32Value(value=self.current_span['child_span_count'])
             }
+            if 'attributes' in self.current_span:
+                span_info['attributes'] = to_span_attributes(self.current_span['attributes'],
+                                                             value_limit=SPAN_ATTRIBUTE_VALUE_BYTE_LIMIT)
             post_to_api_job = Thread(target=post_span, args=(self.stackdriver_trace_client, span_info))
             post_to_api_job.start()
 
+        if self._span_log_buffering is not None:
+            self._resolve_span_log_buffer()
         self._delete_current_span()
 
+    def _report_span_stack_samples(self):
+        """Stop sampling the current span, logging its collapsed stacks and setting span attributes if sampled."""
+        sampler = self._slow_span_sampler
+        stacks = sampler.unwatch(self.memory.current_span_id)
+        if stacks is None:
+            return
+
+        sample_count = sum(stacks.values())
+        top_stack = stacks.most_common(1)[0][0]
+        self.set_span_attribute('profile.sample_count', sample_count)
+        # attribute values are truncated from the end, keep the innermost frames of the stack
+        self.set_span_attribute('profile.top_stack', top_stack[-SPAN_ATTRIBUTE_VALUE_BYTE_LIMIT:])
+        self.logger.warning('Slow span stack samples, %s samples every %s ms:\n%s', sample_count,
+                            sampler.interval_seconds * 1000, format_collapsed_stacks(stacks, sampler.max_stacks))
+
     def _delete_current_span(self):
         """Deletes span details."""
-        self.logger.debug(f'Deleting span {self.memory.current_span_id}')
+        self.logger.debug('Deleting span %s', self.memory.current_span_id)
         del self._spans[self.memory.current_span_id]
         self.memory.current_span_id = None
 
@@ -232,13 +471,74 @@ class Tracer:
         Thread local memory for storing the _current_ span id, needed for if this class is used in a multi-threaded
         environment.
         """
-
-        class SpanMemory(local):
-            def __init__(self):
-                self.current_span_id = None
-                self.parent_spans = []
-
         if self._memory is None:
-            self._memory = SpanMemory()
+            self._memory = _SpanMemory()
 
         return self._memory
+
+
+class _SpanMemory(local):
+    def __init__(self):
+        self.current_span_id = None
+        self.parent_spans = []
+
+
+class _ContextSpanMemory:
+    def __init__(self, name):
+        """Span memory backed by context variables, so each asyncio task has its own current span."""
+        self._current_span_id = ContextVar(f'logtracer_current_span_id_{name}', default=None)
+        self._parent_spans = ContextVar(f'logtracer_parent_spans_{name}', default=None)
+
+    @property
+    def current_span_id(self):
+        return self._current_span_id.get()
+
+    @current_span_id.setter
+    def current_span_id(self, span_id):
+        self._current_span_id.set(span_id)
+
+    @property
+    def parent_spans(self):
+        parent_spans = self._parent_spans.get()
+        return parent_spans if parent_spans is not None else []
+
+    @parent_spans.setter
+    def parent_spans(self, parent_spans):
+        self._parent_spans.set(parent_spans)
+
+
+def _span_display_name(span):
+    """
+    Display name of a span truncated for the Trace API, from the display name truncated when it was started if there
+    is one.
+    """
+    truncated_display_name = span.get('truncated_display_name')
+    if truncated_display_name is None:
+        return truncate_str(span['display_name'], limit=SPAN_DISPLAY_NAME_BYTE_LIMIT)
+    return {
+        'value': truncated_display_name,
+        'truncated_byte_count': len(span['display_name'].encode('utf-8')) - len(truncated_display_name.encode('utf-8'))
+    }
+
+
+def _create_insecure_trace_client(endpoint):
+    """Create a trace client for a Trace API served over an insecure channel, requires google-cloud-trace>=1.0."""
+    from google.cloud.trace_v2.services.trace_service.transports import TraceServiceGrpcTransport
+    return TraceServiceClient(transport=TraceServiceGrpcTransport(channel=grpc.insecure_channel(endpoint)))
+
+
+def _generate_span_log_fields(project_name, trace_id, span_id):
+    """
+    Generate the tracing fields added to log entries written within a span, for each logging format. These are
+    generated once when the span is created rather than for every log entry.
+    """
+    return {
+        'local': {
+            'trace': trace_id,
+            'spanId': span_id
+        },
+        'stackdriver': {
+            'logging.googleapis.com/trace': f'projects/{project_name}/traces/{trace_id}',
+            'logging.googleapis.com/spanId': span_id
+        }
+    }
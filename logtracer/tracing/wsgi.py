@@ -0,0 +1,99 @@
+import logging
+from wsgiref.util import request_uri
+
+from logtracer.tracing.tracer import B3_HEADERS, GOOGLE_LOAD_BALANCER_TRACE_HEADERS
+
+
+class WSGITracingMiddleware:
+
+    def __init__(self, app, tracer, exclude_from_posting=False):
+        """
+        WSGI middleware to trace and log inbound requests, for use with any WSGI framework, eg Flask, Django or Falcon.
+        The span is started before the app is called and ended once the response body has been sent, when the server
+        closes the response.
+
+        Arguments:
+            app: WSGI app to wrap
+            tracer (logtracer.tracing.Tracer): tracer to start and end spans with
+            exclude_from_posting (bool): exclude the spans from being posted to the Trace API
+        """
+        self.app = app
+        self._tracer = tracer
+        self._exclude_from_posting = exclude_from_posting
+        self._environ_headers = tuple(
+            (_environ_key(header), header) for header in B3_HEADERS + [GOOGLE_LOAD_BALANCER_TRACE_HEADERS]
+        )
+
+    def __call__(self, environ, start_response):
+        tracer = self._tracer
+        tracer.start_traced_span(self._extract_headers(environ), environ.get('PATH_INFO') or '/')
+        span_id = tracer.memory.current_span_id
+        if tracer.logger.isEnabledFor(logging.INFO):
+            tracer.logger.info('%s - %s', environ.get('REQUEST_METHOD'), request_uri(environ))
+
+        def traced_start_response(status, headers, exc_info=None):
+            if status[0] in ('4', '5'):
+                tracer.logger.error('%s - %s', status, request_uri(environ))
+            elif tracer.logger.isEnabledFor(logging.INFO):
+                tracer.logger.info('%s - %s', status, request_uri(environ))
+            return start_response(status, headers, exc_info)
+
+        try:
+            response = self.app(environ, traced_start_response)
+        except Exception as e:
+            tracer.logger.exception(e)
+            tracer.end_traced_span(self._exclude_from_posting)
+            raise
+        return _TracedResponse(response, tracer, span_id, self._exclude_from_posting)
+
+    def _extract_headers(self, environ):
+        """Extract the trace headers from the WSGI environ, without building a dict of every header."""
+        headers = {}
+        for key, header in self._environ_headers:
+            value = environ.get(key)
+            if value is not None:
+                headers[header] = value
+
+        debug_logging_header = self._tracer.debug_logging_header
+        if debug_logging_header is not None and debug_logging_header not in headers:
+            value = environ.get(_environ_key(debug_logging_header))
+            if value is not None:
+                headers[debug_logging_header] = value
+        return headers
+
+
+class _TracedResponse:
+
+    def __init__(self, response, tracer, span_id, exclude_from_posting):
+        """
+        Wrap the response iterable returned by the app, ending the span when the server closes it after sending the
+        body. The span is made current again before ending it, as servers may close responses in another thread.
+        """
+        self._response = response
+        self._tracer = tracer
+        self._span_id = span_id
+        self._exclude_from_posting = exclude_from_posting
+        self._closed = False
+
+    def __iter__(self):
+        try:
+            yield from self._response
+        except Exception as e:
+            self._tracer.logger.exception(e)
+            raise
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if hasattr(self._response, 'close'):
+                self._response.close()
+        finally:
+            self._tracer.set_current_span(self._span_id)
+            self._tracer.end_traced_span(self._exclude_from_posting)
+
+
+def _environ_key(header):
+    """Key of a HTTP header in the WSGI environ."""
+    return 'HTTP_' + header.upper().replace('-', '_')
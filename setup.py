@@ -26,8 +26,11 @@ if __name__ == "__main__":
             'google-cloud-trace>=0.19.0',
             'requests>=2.20.0',
             'protobuf>=3.6.0',
-            'grpcio==1.16.1'
+            'grpcio>=1.16.1'
         ],
+        extras_require={
+            'msgpack': ['msgpack>=0.6.0'],
+        },
         test_suite="tests",
         setup_requires=[
             'wheel',
@@ -44,5 +47,6 @@ if __name__ == "__main__":
             'pycodestyle<2.4.0',
             'pytest-cov==2.5.1',
             'flask==1.0.2',
+            'msgpack>=0.6.0',
         ],
     )
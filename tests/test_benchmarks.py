@@ -0,0 +1,29 @@
+import json
+
+import pytest
+
+from benchmarks.__main__ import main, run_benchmark
+from benchmarks.hot_paths import BENCHMARKS
+
+
+@pytest.mark.parametrize('name', sorted(BENCHMARKS))
+def test_benchmark_runs(name):
+    BENCHMARKS[name]()()
+
+
+def test_run_benchmark():
+    loops, timings = run_benchmark(lambda: (lambda: None), repeat=2, min_time=0.001)
+
+    assert loops >= 1
+    assert len(timings) == 2
+
+
+def test_main(tmpdir):
+    output = tmpdir.join('results.json')
+
+    main(['--filter', 'generate_identifier.span', '--repeat', '1', '--min-time', '0.001', '--output', str(output)])
+
+    results = json.loads(output.read())
+    assert list(results['benchmarks']) == ['utils.generate_identifier.span']
+    assert set(results['benchmarks']['utils.generate_identifier.span']) == {'loops', 'repeat', 'min_ns', 'median_ns',
+                                                                            'max_ns'}
@@ -0,0 +1,90 @@
+import grpc
+import pytest
+from google.api_core.exceptions import ResourceExhausted, ServiceUnavailable
+from google.cloud.trace_v2 import TraceServiceClient
+from google.cloud.trace_v2.services.trace_service.transports import TraceServiceGrpcTransport
+
+from benchmarks.fake_trace_service import FakeTraceService
+from logtracer.tracing.tracer import _create_insecure_trace_client
+
+SPAN = {'name': 'projects/test_project/traces/test_trace/spans/test_span', 'span_id': 'test_span'}
+
+
+@pytest.fixture
+def client():
+    clients = []
+
+    def create_client(fake_trace_service):
+        channel = grpc.insecure_channel(fake_trace_service.endpoint)
+        clients.append(channel)
+        return TraceServiceClient(transport=TraceServiceGrpcTransport(channel=channel))
+
+    yield create_client
+    for channel in clients:
+        channel.close()
+
+
+def test_FakeTraceService(client):
+    with FakeTraceService() as fake_trace_service:
+        trace_client = client(fake_trace_service)
+        trace_client.create_span(request=SPAN)
+        trace_client.batch_write_spans(request={'name': 'projects/test_project', 'spans': [SPAN, SPAN]})
+
+    assert fake_trace_service.span_count == 3
+    assert fake_trace_service.call_count == 2
+    assert [span.span_id for span in fake_trace_service.spans] == ['test_span'] * 3
+
+
+def test_FakeTraceService_record_spans_false(client):
+    with FakeTraceService(record_spans=False) as fake_trace_service:
+        client(fake_trace_service).create_span(request=SPAN)
+
+    assert fake_trace_service.span_count == 1
+    assert fake_trace_service.spans == []
+
+
+def test_FakeTraceService_fail_next(client):
+    with FakeTraceService() as fake_trace_service:
+        trace_client = client(fake_trace_service)
+        fake_trace_service.fail_next(2, grpc.StatusCode.UNAVAILABLE)
+        for _ in range(2):
+            with pytest.raises(ServiceUnavailable):
+                trace_client.create_span(request=SPAN, retry=None)
+        trace_client.create_span(request=SPAN, retry=None)
+
+    assert fake_trace_service.call_count == 3
+    assert fake_trace_service.rejected_count == 2
+    assert fake_trace_service.span_count == 1
+
+
+def test_FakeTraceService_max_spans_per_second(client):
+    with FakeTraceService(max_spans_per_second=2) as fake_trace_service:
+        trace_client = client(fake_trace_service)
+        with pytest.raises(ResourceExhausted):
+            trace_client.batch_write_spans(request={'name': 'projects/test_project', 'spans': [SPAN] * 3},
+                                           retry=None)
+        trace_client.batch_write_spans(request={'name': 'projects/test_project', 'spans': [SPAN] * 2}, retry=None)
+
+    assert fake_trace_service.rejected_count == 1
+    assert fake_trace_service.span_count == 2
+
+
+def test_FakeTraceService_reset(client):
+    with FakeTraceService() as fake_trace_service:
+        client(fake_trace_service).create_span(request=SPAN)
+        fake_trace_service.fail_next()
+        fake_trace_service.reset()
+        client(fake_trace_service).create_span(request=SPAN, retry=None)
+
+    assert fake_trace_service.span_count == 1
+    assert fake_trace_service.call_count == 1
+    assert len(fake_trace_service.spans) == 1
+
+
+def test_FakeTraceService_insecure_trace_client():
+    with FakeTraceService() as fake_trace_service:
+        trace_client = _create_insecure_trace_client(fake_trace_service.endpoint)
+        trace_client.create_span(request=SPAN)
+        trace_client.transport.close()
+
+    assert fake_trace_service.span_count == 1
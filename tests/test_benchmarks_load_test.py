@@ -0,0 +1,38 @@
+import os
+from unittest.mock import MagicMock
+
+import pytest
+
+from benchmarks.load_test import drive, percentile, process_usage
+
+
+@pytest.mark.parametrize('fraction,expected', [(0, 1), (0.5, 50), (0.99, 99), (1, 100)])
+def test_percentile(fraction, expected):
+    assert percentile(list(range(1, 101)), fraction) == expected
+
+
+def test_percentile_empty():
+    assert percentile([], 0.5) is None
+
+
+def test_drive():
+    m_send = MagicMock(side_effect=[None, Exception('test_exception'), None, None])
+
+    latencies, errors, elapsed = drive(m_send, rate=100, duration=0.04, concurrency=2)
+
+    assert m_send.call_count == 4
+    assert len(latencies) == 3
+    assert errors == 1
+    assert elapsed >= 0.03
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/stat'), reason='requires /proc')
+def test_process_usage():
+    cpu_seconds, rss_mb, peak_rss_mb = process_usage(os.getpid())
+
+    assert cpu_seconds > 0
+    assert 0 < rss_mb <= peak_rss_mb
+
+
+def test_process_usage_no_process():
+    assert process_usage(-1) == (None, None, None)
@@ -1,46 +1,77 @@
-from unittest.mock import patch
+from unittest.mock import MagicMock
 
 import pytest
 
-from logtracer.helpers.flask.path_exclusion import _is_path_excluded
+from logtracer.helpers.flask.path_exclusion import _RouteExclusionMatcher
 
 
-@patch('logtracer.helpers.flask.path_exclusion.request')
-def test_is_path_excluded_not_excluded(m_request):
-    m_request.path = '/not_excluded'
-    assert not _is_path_excluded(None, None)
+def _url_rule(rule, endpoint):
+    m_url_rule = MagicMock()
+    m_url_rule.rule = rule
+    m_url_rule.endpoint = endpoint
+    return m_url_rule
 
-    m_request.path = '/not_excluded'
-    assert not _is_path_excluded(['/excluded'], None)
 
-    m_request.path = '/not_excluded'
-    assert not _is_path_excluded(None, ['/excluded'])
+def test_RouteExclusionMatcher_not_excluded():
+    assert not _RouteExclusionMatcher(None, None).is_excluded('/not_excluded')
+    assert not _RouteExclusionMatcher(['/excluded'], None).is_excluded('/not_excluded')
+    assert not _RouteExclusionMatcher(None, ['/excluded']).is_excluded('/not_excluded')
+    assert not _RouteExclusionMatcher(['/excluded'], ['/also_excluded']).is_excluded('/not_excluded')
 
-    m_request.path = '/not_excluded'
-    assert not _is_path_excluded(['/excluded'], ['/also_excluded'])
 
+def test_RouteExclusionMatcher_excluded():
+    assert _RouteExclusionMatcher(['/excluded'], None).is_excluded('/excluded')
+    assert _RouteExclusionMatcher(None, ['/exclu']).is_excluded('/excluded')
+    assert _RouteExclusionMatcher(['/excluded'], ['/also_excluded']).is_excluded('/also_excluded_route')
+    assert _RouteExclusionMatcher(['/excluded'], ['/also_excluded']).is_excluded('/excluded')
 
-@patch('logtracer.helpers.flask.path_exclusion.request')
-def test_is_path_excluded_excluded(m_request):
-    m_request.path = '/excluded'
-    assert _is_path_excluded(['/excluded'], None)
 
-    m_request.path = '/excluded'
-    assert _is_path_excluded(None, ['/exclu'])
+def test_RouteExclusionMatcher_partial_routes_escaped():
+    matcher = _RouteExclusionMatcher(None, ['/a.b', '/c(d', '/e'])
 
-    m_request.path = '/also_excluded_route'
-    assert _is_path_excluded(['/excluded'], ['/also_excluded'])
+    assert matcher.is_excluded('/test/a.b/test')
+    assert matcher.is_excluded('/c(d')
+    assert matcher.is_excluded('/test/e')
+    assert not matcher.is_excluded('/axb')
 
-    m_request.path = '/excluded'
-    assert _is_path_excluded(['/excluded'], ['/also_excluded'])
 
+def test_RouteExclusionMatcher_url_rules():
+    matcher = _RouteExclusionMatcher(None, ['/partial/'], ['/users/<user_id>'])
+
+    assert matcher.matches_url_rules
+    assert matcher.is_excluded('/users/1', _url_rule('/users/<user_id>', 'test_users'))
+    assert matcher.is_excluded('/test/1', _url_rule('/partial/<item_id>', 'test_partial'))
+    assert not matcher.is_excluded('/items/1', _url_rule('/items/<item_id>', 'test_items'))
+    assert not matcher.is_excluded('/users/1')
+    assert not _RouteExclusionMatcher(None, None).matches_url_rules
+
+
+def test_RouteExclusionMatcher_url_rules_same_endpoint():
+    matcher = _RouteExclusionMatcher(None, None, ['/users/<user_id>'])
+
+    assert not matcher.is_excluded('/users', _url_rule('/users', 'test_users'))
+    assert matcher.is_excluded('/users/1', _url_rule('/users/<user_id>', 'test_users'))
+    assert not matcher.is_excluded('/users', _url_rule('/users', 'test_users'))
+
+
+def test_RouteExclusionMatcher_url_rules_cached_per_rule():
+    matcher = _RouteExclusionMatcher(None, ['/partial/'], ['/users/<user_id>'])
+
+    assert matcher.is_excluded('/users/1', _url_rule('/users/<user_id>', 'test_users'))
+    assert not matcher.is_excluded('/items/1', _url_rule('/items/<item_id>', 'test_items'))
+
+    assert matcher._excluded_rules == {'/users/<user_id>': True, '/items/<item_id>': False}
+
+
+def test_RouteExclusionMatcher_error():
+    with pytest.raises(ValueError):
+        _RouteExclusionMatcher('test_string', None)
 
-def test_is_path_excluded_error():
     with pytest.raises(ValueError):
-        assert _is_path_excluded('test_string', None)
+        _RouteExclusionMatcher(None, 'test_string')
 
     with pytest.raises(ValueError):
-        assert _is_path_excluded(None, 'test_string')
+        _RouteExclusionMatcher('test_string', 'test_string')
 
     with pytest.raises(ValueError):
-        assert _is_path_excluded('test_string', 'test_string')
+        _RouteExclusionMatcher(None, None, 'test_string')
@@ -1,8 +1,10 @@
-from unittest.mock import MagicMock, patch
+from unittest.mock import ANY, MagicMock, patch, call
 
-from pytest import mark
+from google.protobuf.timestamp_pb2 import Timestamp
+from pytest import mark, raises
 
-from logtracer.helpers.flask.tracing import FlaskTracer
+from logtracer.helpers.flask.tracing import FlaskTracer, _StreamedResponse
+from logtracer.tracing._utils import truncate_str
 
 
 @patch('logtracer.helpers.flask.tracing.request')
@@ -19,7 +21,39 @@ def test_FlaskTracer_start_span_and_log_request_before(m_request):
     execute_before_request()
 
     flask_tracer.start_traced_span.assert_called_with('test_headers', 'test_path')
-    flask_tracer.logger.info.assert_called_with('test_method - test_url')
+    flask_tracer.logger.info.assert_called_with('%s - %s', 'test_method', 'test_url')
+
+
+def test_FlaskTracer_start_span_and_log_request_before_span_name_from_url_rule():
+    m_request = MagicMock(headers='test_headers', method='GET')
+    m_request.url_rule.rule = '/items/<item_id>'
+    m_logger_factory = MagicMock()
+    m_logger_factory.service_name = 'test_service_name'
+    flask_tracer = FlaskTracer(m_logger_factory)
+    flask_tracer.start_traced_span = MagicMock()
+
+    with patch('logtracer.helpers.flask.tracing.request', m_request), \
+            patch('logtracer.helpers.flask.tracing.truncate_str', wraps=truncate_str) as m_truncate_str:
+        execute_before_request = flask_tracer.start_span_and_log_request_before(span_name_from_url_rule=True)
+        execute_before_request()
+        execute_before_request()
+        m_request.method = 'PROPFIND'
+        execute_before_request()
+        m_request.url_rule = None
+        execute_before_request()
+        execute_before_request()
+
+    assert flask_tracer.start_traced_span.call_args_list == [
+        call('test_headers', 'GET /items/<item_id>',
+             truncated_display_name='test_service_name:GET /items/<item_id>'),
+        call('test_headers', 'GET /items/<item_id>',
+             truncated_display_name='test_service_name:GET /items/<item_id>'),
+        call('test_headers', 'OTHER /items/<item_id>',
+             truncated_display_name='test_service_name:OTHER /items/<item_id>'),
+        call('test_headers', 'OTHER <unmatched>'),
+        call('test_headers', 'OTHER <unmatched>')
+    ]
+    assert m_truncate_str.call_count == 2
 
 
 @patch('logtracer.helpers.flask.tracing.request')
@@ -35,7 +69,7 @@ def test_FlaskTracer_start_span_and_log_request_before(m_request, success_status
     execute_after_request = flask_tracer.log_response_after()
     execute_after_request(m_response)
 
-    flask_tracer.logger.info.assert_called_with('test_status - test_url')
+    flask_tracer.logger.info.assert_called_with('%s - %s%s', 'test_status', 'test_url', '')
     assert not flask_tracer.logger.error.called
 
 
@@ -52,38 +86,186 @@ def test_FlaskTracer_log_response_after_error(m_request, error_status_code):
     execute_after_request = flask_tracer.log_response_after()
     execute_after_request(m_response)
 
-    flask_tracer.logger.error.assert_called_with('test_status - test_url')
+    flask_tracer.logger.error.assert_called_with('%s - %s%s', 'test_status', 'test_url', '')
     assert not flask_tracer.logger.info.called
 
 
-@patch('logtracer.helpers.flask.tracing._is_path_excluded')
-def test_FlaskTracer_end_span_on_teardown(m_path_exclude):
-    m_path_exclude.return_value = False
+@patch('logtracer.helpers.flask.tracing.request', MagicMock(path='test_path', url_rule='test_url_rule'))
+@patch('logtracer.helpers.flask.tracing._RouteExclusionMatcher')
+@mark.parametrize('excluded', [False, True])
+def test_FlaskTracer_end_span_on_teardown(m_matcher, excluded):
+    m_matcher.return_value.matches_url_rules = False
+    m_matcher.return_value.is_excluded.return_value = excluded
     m_logger_factory = MagicMock()
     flask_tracer = FlaskTracer(m_logger_factory)
     flask_tracer.end_traced_span = MagicMock()
 
     execute_on_teardown = flask_tracer.end_span_and_post_on_teardown(['excluded_routes'], ['excluded_partial_routes'])
     execute_on_teardown(MagicMock())
+    execute_on_teardown(MagicMock())
 
-    m_path_exclude.assert_called_with(['excluded_routes'], ['excluded_partial_routes'])
-    flask_tracer.end_traced_span.assert_called_with(False)
+    m_matcher.assert_called_once_with(['excluded_routes'], ['excluded_partial_routes'], None)
+    m_matcher.return_value.is_excluded.assert_called_with('test_path', None)
+    flask_tracer.end_traced_span.assert_called_with(excluded)
 
 
-@patch('logtracer.helpers.flask.tracing._is_path_excluded')
-def test_FlaskTracer_end_span_on_teardown_exclude_path(m_path_exclude):
-    m_path_exclude.return_value = True
+@patch('logtracer.helpers.flask.tracing.request', MagicMock(path='test_path', url_rule='test_url_rule'))
+@patch('logtracer.helpers.flask.tracing._RouteExclusionMatcher')
+def test_FlaskTracer_end_span_on_teardown_url_rules(m_matcher):
+    m_matcher.return_value.matches_url_rules = True
     m_logger_factory = MagicMock()
     flask_tracer = FlaskTracer(m_logger_factory)
     flask_tracer.end_traced_span = MagicMock()
 
-    execute_on_teardown = flask_tracer.end_span_and_post_on_teardown(['excluded_routes'], ['excluded_partial_routes'])
+    execute_on_teardown = flask_tracer.end_span_and_post_on_teardown(excluded_url_rules=['/users/<user_id>'])
     execute_on_teardown(MagicMock())
 
-    m_path_exclude.assert_called_with(['excluded_routes'], ['excluded_partial_routes'])
+    m_matcher.assert_called_once_with(None, None, ['/users/<user_id>'])
+    m_matcher.return_value.is_excluded.assert_called_with('test_path', 'test_url_rule')
+
+
+@patch('logtracer.helpers.flask.tracing.request', MagicMock(url='test_url'))
+def test_FlaskTracer_log_response_after_streamed():
+    m_response = MagicMock()
+    m_response.status_code = 200
+    m_response.is_streamed = True
+    m_response.direct_passthrough = False
+    m_response.response = ['test_chunk']
+    m_span = {'start_timestamp': Timestamp()}
+    m_logger_factory = MagicMock()
+    flask_tracer = FlaskTracer(m_logger_factory)
+    flask_tracer.find_current_span = MagicMock(return_value=m_span)
+
+    response = flask_tracer.log_response_after()(m_response)
+
+    assert isinstance(response.response, _StreamedResponse)
+    assert m_span['response_stream'] is response.response
+    assert list(response.response) == ['test_chunk']
+
+
+@patch('logtracer.helpers.flask.tracing.request', MagicMock(url='test_url'))
+def test_FlaskTracer_log_response_after_direct_passthrough():
+    m_response = MagicMock()
+    m_response.status_code = 200
+    m_response.is_streamed = True
+    m_response.direct_passthrough = True
+    m_body = m_response.response
+    m_logger_factory = MagicMock()
+    flask_tracer = FlaskTracer(m_logger_factory)
+    flask_tracer.find_current_span = MagicMock(return_value={'start_timestamp': Timestamp()})
+    flask_tracer.record_span_resource_usage = MagicMock(return_value='')
+
+    response = flask_tracer.log_response_after()(m_response)
+
+    assert response.response is m_body
+    flask_tracer.record_span_resource_usage.assert_called_once()
+    assert not flask_tracer.find_current_span.called
+
+
+@patch('logtracer.helpers.flask.tracing.request', MagicMock(path='test_path'))
+@patch('logtracer.helpers.flask.tracing._RouteExclusionMatcher')
+def test_FlaskTracer_end_span_on_teardown_streamed(m_matcher):
+    m_matcher.return_value.matches_url_rules = False
+    m_matcher.return_value.is_excluded.return_value = True
+    m_response_stream = MagicMock()
+    m_response_stream.closed = False
+    m_logger_factory = MagicMock()
+    flask_tracer = FlaskTracer(m_logger_factory)
+    flask_tracer.find_current_span = MagicMock(return_value={'response_stream': m_response_stream})
+    flask_tracer.end_traced_span = MagicMock()
+
+    flask_tracer.end_span_and_post_on_teardown()(MagicMock())
+
+    m_response_stream.end_span_on_close.assert_called_with(True)
+    assert not flask_tracer.end_traced_span.called
+
+    m_response_stream.closed = True
+    flask_tracer.end_span_and_post_on_teardown()(MagicMock())
+
     flask_tracer.end_traced_span.assert_called_with(True)
 
 
+@mark.parametrize('end_span', [False, True])
+def test_StreamedResponse(end_span):
+    m_tracer, m_response = MagicMock(), MagicMock()
+    m_response.__iter__.return_value = iter([b'test', 'test_\u00e9'])
+    start_timestamp = Timestamp()
+    start_timestamp.GetCurrentTime()
+    streamed_response = _StreamedResponse(m_response, m_tracer, 'test_span_id', start_timestamp, 'test_url')
+
+    assert list(streamed_response) == [b'test', 'test_\u00e9']
+    if end_span:
+        streamed_response.end_span_on_close('test_exclude')
+    streamed_response.close()
+    streamed_response.close()
+
+    assert streamed_response.closed
+    m_response.close.assert_called_once()
+    m_tracer.set_current_span.assert_called_once_with('test_span_id')
+    m_tracer.set_span_attribute.assert_any_call('http.response_bytes', 11)
+    m_tracer.set_span_attribute.assert_any_call('http.time_to_first_byte_ms', ANY)
+    m_tracer.record_span_resource_usage.assert_called_once()
+    assert m_tracer.logger.info.call_args[0][-1] == m_tracer.record_span_resource_usage.return_value
+    if end_span:
+        m_tracer.end_traced_span.assert_called_once_with('test_exclude')
+    else:
+        assert not m_tracer.end_traced_span.called
+
+
+@patch('logtracer.helpers.flask.tracing.request', MagicMock(content_length=5))
+@mark.parametrize('server_timing_header', [False, True])
+def test_FlaskTracer_enable_request_instrumentation(server_timing_header):
+    m_app, m_response = MagicMock(), MagicMock()
+    m_response.content_length = 10
+    m_app.process_response.return_value = m_response
+    m_span = {}
+    m_logger_factory = MagicMock()
+    flask_tracer = FlaskTracer(m_logger_factory)
+    flask_tracer.find_current_span = MagicMock(return_value=m_span)
+    preprocess_request, dispatch_request, process_response = \
+        m_app.preprocess_request, m_app.dispatch_request, m_app.process_response
+
+    flask_tracer.enable_request_instrumentation(m_app, server_timing_header=server_timing_header)
+    m_app.preprocess_request()
+    m_app.dispatch_request()
+    response = m_app.process_response('test_response')
+
+    preprocess_request.assert_called_once()
+    dispatch_request.assert_called_once()
+    process_response.assert_called_with('test_response')
+    assert response == m_response
+    assert [name for name, _ in m_span['server_timing']] == ['before_request', 'view', 'after_request']
+    assert m_span['attributes'] == {
+        'http.request_content_length': 5,
+        'http.response_content_length': 10,
+        'http.before_request_ms': ANY,
+        'http.view_ms': ANY,
+        'http.after_request_ms': ANY
+    }
+    if server_timing_header:
+        m_response.headers.add.assert_called_with('Server-Timing', ANY)
+        assert [timing.split(';')[0] for timing in m_response.headers.add.call_args[0][1].split(', ')] == [
+            'before_request', 'view', 'after_request'
+        ]
+    else:
+        assert not m_response.headers.add.called
+
+
+def test_FlaskTracer_enable_request_instrumentation_after_request_error():
+    m_app = MagicMock()
+    m_app.process_response.side_effect = ValueError
+    m_span = {}
+    m_logger_factory = MagicMock()
+    flask_tracer = FlaskTracer(m_logger_factory)
+    flask_tracer.find_current_span = MagicMock(return_value=m_span)
+
+    flask_tracer.enable_request_instrumentation(m_app)
+    with raises(ValueError):
+        m_app.process_response('test_response')
+
+    assert [name for name, _ in m_span['server_timing']] == ['after_request']
+
+
 def test_FlaskTracer_log_exception():
     m_logger_factory = MagicMock()
     m_exception_handler, m_exception, m_response, m_logger_factory.logger = MagicMock(), MagicMock(), MagicMock(), MagicMock()
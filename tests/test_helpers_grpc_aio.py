@@ -0,0 +1,188 @@
+import asyncio
+from unittest.mock import ANY, MagicMock, patch, call
+
+import grpc
+import pytest
+from grpc import aio
+
+from logtracer.helpers.grpc.aio import _AsyncIncomingInterceptor, _AsyncOutgoingCallLogging, \
+    _aio_grpc_status_from_context, create_client_interceptors
+from logtracer.helpers.grpc.tracing import GRPCTracer
+
+
+def _run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_GRPCTracer_aio_interceptors():
+    m_logger_factory = MagicMock()
+    grpc_tracer = GRPCTracer(m_logger_factory)
+    grpc_tracer.enable_context_local_spans = MagicMock()
+
+    assert isinstance(grpc_tracer.aio_server_interceptor(), aio.ServerInterceptor)
+    client_interceptors = grpc_tracer.aio_client_interceptors()
+    assert [type(interceptor).__bases__[0] for interceptor in client_interceptors] == [
+        aio.UnaryUnaryClientInterceptor, aio.UnaryStreamClientInterceptor, aio.StreamUnaryClientInterceptor,
+        aio.StreamStreamClientInterceptor
+    ]
+    assert grpc_tracer.enable_context_local_spans.call_count == 2
+
+
+def _intercept(interceptor, handler):
+    async def continuation(handler_call_details):
+        return handler
+
+    m_handler_call_details = MagicMock()
+    m_handler_call_details.method = 'test_method'
+    return _run(interceptor.intercept_service(continuation, m_handler_call_details))
+
+
+@patch('logtracer.helpers.grpc.aio._aio_grpc_status_from_context', return_value='.test_grpc_status')
+def test_AsyncIncomingInterceptor_intercept_service(m_grpc_status):
+    m_tracer = MagicMock()
+    m_tracer.redacted_fields = []
+    m_tracer.record_span_resource_usage.return_value = ''
+    interceptor = _AsyncIncomingInterceptor(m_tracer)
+    interceptor._retrieve_span_values_from_metadata = MagicMock(return_value='test_b3_values')
+    m_request, m_servicer_context = MagicMock(), MagicMock()
+    m_request.ListFields.return_value = []
+
+    async def behaviour(request, servicer_context):
+        return 'test_response'
+
+    handler = _intercept(interceptor, grpc.unary_unary_rpc_method_handler(behaviour))
+    response = _run(handler.unary_unary(m_request, m_servicer_context))
+
+    assert response == 'test_response'
+    m_tracer.start_traced_span.assert_called_with('test_b3_values', 'test_method')
+    m_grpc_status.assert_called_with(m_servicer_context)
+    assert m_tracer.logger.info.call_args_list == [
+        call('test_method - received gRPC call '),
+        call('test_method%s - returning gRPC call%s', '.test_grpc_status', '')
+    ]
+    m_tracer.end_traced_span.assert_called_with(exclude_from_posting=False)
+
+
+@patch('logtracer.helpers.grpc.aio._aio_grpc_status_from_context', MagicMock(return_value=''))
+def test_AsyncIncomingInterceptor_intercept_service_exception():
+    class TestException(Exception):
+        pass
+
+    m_tracer = MagicMock()
+    m_tracer.record_span_resource_usage.return_value = ''
+    interceptor = _AsyncIncomingInterceptor(m_tracer)
+    interceptor._retrieve_span_values_from_metadata = MagicMock(return_value={})
+    m_exception = TestException('test exception')
+
+    async def behaviour(request, servicer_context):
+        raise m_exception
+
+    handler = _intercept(interceptor, grpc.unary_unary_rpc_method_handler(behaviour))
+    with pytest.raises(TestException):
+        _run(handler.unary_unary(MagicMock(), MagicMock()))
+
+    m_tracer.logger.error.assert_called_with('test_method - %s%s%s', 'TestException', '', '')
+    m_tracer.logger.exception.assert_called_with(m_exception)
+    m_tracer.end_traced_span.assert_called_with(exclude_from_posting=False)
+
+
+@patch('logtracer.helpers.grpc.aio._aio_grpc_status_from_context', MagicMock(return_value=''))
+def test_AsyncIncomingInterceptor_intercept_service_streams():
+    m_tracer = MagicMock()
+    m_tracer.count_stream_bytes = False
+    m_tracer.record_span_resource_usage.return_value = ''
+    interceptor = _AsyncIncomingInterceptor(m_tracer)
+    interceptor._retrieve_span_values_from_metadata = MagicMock(return_value={})
+
+    async def behaviour(request_iterator, servicer_context):
+        async for request in request_iterator:
+            yield request
+            yield request
+
+    async def requests():
+        for request in ['test_request1', 'test_request2']:
+            yield request
+
+    async def consume(response_iterator):
+        return [response async for response in response_iterator]
+
+    handler = _intercept(interceptor, grpc.stream_stream_rpc_method_handler(behaviour))
+    responses = _run(consume(handler.stream_stream(requests(), MagicMock())))
+
+    assert responses == ['test_request1', 'test_request1', 'test_request2', 'test_request2']
+    m_tracer.logger.info.assert_called_with('test_method%s - returning gRPC call%s%s', '', ANY, '')
+    assert str(m_tracer.logger.info.call_args[0][2]) == ' - 2 requests, 4 responses'
+    m_tracer.set_span_attribute.assert_any_call('grpc.response_count', 4)
+    m_tracer.end_traced_span.assert_called_with(exclude_from_posting=False)
+
+
+def test_AsyncIncomingInterceptor_intercept_service_no_handler():
+    assert _intercept(_AsyncIncomingInterceptor(MagicMock()), None) is None
+
+
+def test_aio_grpc_status_from_context():
+    m_servicer_context = MagicMock()
+    m_servicer_context.code.return_value = 'test_code'
+    m_servicer_context.details.return_value = 'test_details'
+
+    assert _aio_grpc_status_from_context(m_servicer_context) == ' - test_code - test_details'
+
+    m_servicer_context.code.return_value = None
+    assert _aio_grpc_status_from_context(m_servicer_context) == ''
+
+
+@patch('logtracer.helpers.grpc.aio._generate_b3_metadatum', return_value=('b3-values', 'test_b3_values'))
+def test_AsyncOutgoingCallLogging_intercept_call(m_generate_b3_metadatum):
+    m_tracer = MagicMock()
+    outgoing_call_logging = _AsyncOutgoingCallLogging(m_tracer)
+    client_call_details = aio.ClientCallDetails(b'test_method', 1, aio.Metadata(('test_key', 'test_value')), None,
+                                                None)
+    m_call = MagicMock()
+
+    async def continuation(new_client_call_details, request):
+        assert new_client_call_details.metadata == aio.Metadata(('test_key', 'test_value'),
+                                                                ('b3-values', 'test_b3_values'),
+                                                                ('logtracer-timeout', '1'))
+        assert request == 'test_request'
+        return m_call
+
+    call_returned = _run(outgoing_call_logging.intercept_call(continuation, client_call_details, 'test_request'))
+
+    assert call_returned == m_call
+    m_generate_b3_metadatum.assert_called_with(m_tracer)
+    m_tracer.logger.info.assert_called_with('%s - outbound gRPC call', 'test_method')
+    m_call.add_done_callback.assert_called_once()
+
+
+@pytest.mark.parametrize('code,details,log_method', [
+    (grpc.StatusCode.OK, None, 'info'),
+    (grpc.StatusCode.NOT_FOUND, 'test_details', 'error'),
+])
+def test_AsyncOutgoingCallLogging_log_response(code, details, log_method):
+    m_tracer = MagicMock()
+    m_tracer.memory.current_span_id = 'test_other_span_id'
+    outgoing_call_logging = _AsyncOutgoingCallLogging(m_tracer)
+
+    class Call:
+        async def code(self):
+            return code
+
+        async def details(self):
+            return details
+
+    async def log_response():
+        outgoing_call_logging._log_response_callback('test_method', 'test_span_id', 0)(Call())
+        await asyncio.gather(*outgoing_call_logging._log_response_tasks)
+
+    _run(log_response())
+
+    getattr(m_tracer.logger, log_method).assert_called_once()
+    assert outgoing_call_logging._log_response_tasks == set()
+    assert m_tracer.memory.current_span_id == 'test_other_span_id'
+
+
+def test_create_client_interceptors():
+    m_tracer = MagicMock()
+    interceptors = create_client_interceptors(m_tracer)
+
+    assert len({id(interceptor._outgoing_call_logging) for interceptor in interceptors}) == 1
@@ -0,0 +1,71 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from logtracer.helpers.grpc.concurrency import ServerCallStats, CallConcurrency, queue_wait_seconds
+
+
+def test_ServerCallStats_in_flight():
+    stats = ServerCallStats()
+
+    assert stats.call_started('test_method1') == CallConcurrency(1, 1)
+    assert stats.call_started('test_method1') == CallConcurrency(2, 2)
+    assert stats.call_started('test_method2') == CallConcurrency(1, 3)
+    stats.call_finished('test_method1')
+    stats.call_finished('test_method2')
+
+    snapshot = stats.snapshot()
+    assert snapshot['in_flight'] == 1
+    assert snapshot['peak_in_flight'] == 3
+    assert snapshot['methods']['test_method1']['in_flight'] == 1
+    assert snapshot['methods']['test_method1']['peak_in_flight'] == 2
+    assert snapshot['methods']['test_method1']['call_count'] == 2
+    assert snapshot['methods']['test_method2']['in_flight'] == 0
+    assert snapshot['methods']['test_method2']['queue_wait_mean_ms'] is None
+
+
+def test_ServerCallStats_queue_wait():
+    stats = ServerCallStats()
+    stats.call_started('test_method')
+    stats.record_queue_wait('test_method', 0.1)
+    stats.record_queue_wait('test_method', 0.3)
+
+    method_snapshot = stats.snapshot()['methods']['test_method']
+    assert method_snapshot['queue_wait_count'] == 2
+    assert method_snapshot['queue_wait_mean_ms'] == pytest.approx(200)
+    assert method_snapshot['queue_wait_max_ms'] == pytest.approx(300)
+
+
+def test_ServerCallStats_snapshot_reset():
+    stats = ServerCallStats()
+    stats.call_started('test_method')
+    stats.call_started('test_method')
+    stats.record_queue_wait('test_method', 0.1)
+    stats.call_finished('test_method')
+
+    stats.snapshot(reset=True)
+    snapshot = stats.snapshot()
+
+    assert snapshot['peak_in_flight'] == 1
+    assert snapshot['methods']['test_method'] == {
+        'in_flight': 1,
+        'peak_in_flight': 1,
+        'call_count': 0,
+        'queue_wait_count': 0,
+        'queue_wait_mean_ms': None,
+        'queue_wait_max_ms': None
+    }
+
+
+@pytest.mark.parametrize('invocation_metadata,time_remaining,expected', [
+    ([('logtracer-timeout', '2.0')], 1.25, 0.75),
+    ([('logtracer-timeout', '2.0')], 2.5, 0.0),
+    ([('logtracer-timeout', '2.0')], None, None),
+    ([('logtracer-timeout', 'invalid')], 1.0, None),
+    ([('b3-values', '{}')], 1.0, None),
+])
+def test_queue_wait_seconds(invocation_metadata, time_remaining, expected):
+    m_servicer_context = MagicMock()
+    m_servicer_context.time_remaining.return_value = time_remaining
+
+    assert queue_wait_seconds(invocation_metadata, m_servicer_context) == expected
@@ -0,0 +1,47 @@
+import pytest
+
+from logtracer.helpers.grpc.propagation import encode_b3_bin, decode_b3_bin
+
+TEST_TRACE_ID = '0123456789abcdef0123456789abcdef'
+TEST_SPAN_ID = '0123456789abcdef'
+TEST_PARENT_SPAN_ID = 'fedcba9876543210'
+
+
+@pytest.mark.parametrize('span_values', [
+    {
+        'X-B3-TraceId': TEST_TRACE_ID,
+        'X-B3-ParentSpanId': TEST_PARENT_SPAN_ID,
+        'X-B3-SpanId': TEST_SPAN_ID,
+        'X-B3-Sampled': '1',
+        'X-B3-Flags': '1'
+    },
+    {
+        'X-B3-TraceId': TEST_TRACE_ID,
+        'X-B3-SpanId': TEST_SPAN_ID,
+        'X-B3-Sampled': '0'
+    },
+    {
+        'X-B3-TraceId': TEST_TRACE_ID,
+        'X-B3-SpanId': TEST_SPAN_ID
+    },
+])
+def test_b3_bin_round_trip(span_values):
+    value = encode_b3_bin(span_values)
+
+    assert len(value) == 34
+    assert decode_b3_bin(value) == span_values
+
+
+@pytest.mark.parametrize('span_values', [
+    {'X-B3-TraceId': 'test_trace_id', 'X-B3-SpanId': TEST_SPAN_ID},
+    {'X-B3-TraceId': TEST_TRACE_ID[:16], 'X-B3-SpanId': TEST_SPAN_ID},
+    {'X-B3-TraceId': TEST_TRACE_ID, 'X-B3-SpanId': TEST_SPAN_ID, 'X-B3-ParentSpanId': 'abc'},
+    {'X-B3-SpanId': TEST_SPAN_ID},
+])
+def test_encode_b3_bin_unencodable(span_values):
+    assert encode_b3_bin(span_values) is None
+
+
+@pytest.mark.parametrize('value', [b'', b'short', b'\x01' + bytes(33), 'not_bytes'])
+def test_decode_b3_bin_invalid(value):
+    assert decode_b3_bin(value) is None
@@ -1,57 +1,153 @@
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 import pytest
+from google.protobuf import descriptor_pb2, struct_pb2, text_format, wrappers_pb2
 
-from logtracer.helpers.grpc.redact import _rsetattr, _rgetattr, redact_request
+from logtracer.helpers.grpc.redact import compile_redaction_plan, redact_request, RedactedRequest, \
+    _SizeLimitedWriter, _SizeLimitReached, _render_message
 
 
-def test_rsetattr():
-    m_obj = MagicMock()
-    _rsetattr(m_obj, 'test_attr', 'test_val')
-    assert m_obj.test_attr == 'test_val'
+@pytest.fixture
+def request_message():
+    request = descriptor_pb2.FileDescriptorProto(name='test_name', package='test_package')
+    request.dependency.extend(['test_dependency1', 'test_dependency2'])
+    request.options.java_package = 'test_java_package'
+    request.message_type.add(name='test_message1').field.add(name='test_field', number=1)
+    request.message_type.add(name='test_message2')
+    return request
 
-    m_obj = MagicMock()
-    _rsetattr(m_obj, 'test_attr1.test_attr2', 'test_val')
-    assert m_obj.test_attr1.test_attr2 == 'test_val'
 
-    m_obj = MagicMock()
-    _rsetattr(m_obj, 'test_attr1.test_attr2.test_attr3', 'test_val')
-    assert m_obj.test_attr1.test_attr2.test_attr3 == 'test_val'
+def test_compile_redaction_plan():
+    plan = compile_redaction_plan(
+        descriptor_pb2.FileDescriptorProto.DESCRIPTOR,
+        ('package', 'options.java_package', 'message_type.field.name', 'not_a_field', 'name.not_a_field')
+    )
 
+    assert plan.redacted == {'package'}
+    assert set(plan.nested) == {'options', 'message_type'}
+    assert plan.nested['options'].redacted == {'java_package'}
+    assert plan.nested['message_type'].nested['field'].redacted == {'name'}
 
-def test_rgetattr():
-    m_obj = object()
-    with pytest.raises(AttributeError):
-        _rgetattr(m_obj, 'test_attr')
 
-    m_obj = MagicMock()
-    m_obj.test_attr1 = 'test_val'
-    assert _rgetattr(m_obj, 'test_attr1') == 'test_val'
+def test_compile_redaction_plan_native():
+    descriptor = descriptor_pb2.FileDescriptorProto.DESCRIPTOR
 
-    m_obj = MagicMock()
-    m_obj.test_attr1.test_attr2 = 'test_val'
-    assert _rgetattr(m_obj, 'test_attr1.test_attr2') == 'test_val'
+    assert compile_redaction_plan(descriptor, ('package', 'dependency', 'message_type.field.name')).native
+    assert not compile_redaction_plan(descriptor, ('package', 'options')).native
+    assert not compile_redaction_plan(descriptor, ('message_type.field.number',)).native
 
-    m_obj = MagicMock()
-    m_obj.test_attr1.test_attr2.test_attr3 = 'test_val'
-    assert _rgetattr(m_obj, 'test_attr1.test_attr2.test_attr3') == 'test_val'
 
+def test_compile_redaction_plan_cached():
+    fields = ('package',)
+    assert compile_redaction_plan(descriptor_pb2.FileDescriptorProto.DESCRIPTOR, fields) is \
+        compile_redaction_plan(descriptor_pb2.FileDescriptorProto.DESCRIPTOR, fields)
 
-def test_redact_request():
-    m_request = MagicMock()
-    m_request.test_sensitive_field = 'sensitive_val'
-    m_request.test_unsensitive_field = 'unsensitive_val'
-    m_request.test_nested.test_sensitive_field = 'sensitive_val'
-    m_request.test_nested.test_field = 'unsensitive_val'
 
-    redacted = redact_request(m_request, ['test_sensitive_field', 'test_nested.test_sensitive_field'])
+def test_redact_request(request_message):
+    original = str(request_message)
 
-    assert m_request.test_sensitive_field == 'sensitive_val'
-    assert m_request.test_unsensitive_field == 'unsensitive_val'
-    assert m_request.test_nested.test_sensitive_field == 'sensitive_val'
-    assert m_request.test_nested.test_field == 'unsensitive_val'
+    redacted = str(redact_request(request_message, ['package', 'options.java_package', 'message_type.field.name']))
 
-    assert redacted.test_sensitive_field == 'REDACTED'
-    assert redacted.test_unsensitive_field == 'unsensitive_val'
-    assert redacted.test_nested.test_sensitive_field == 'REDACTED'
-    assert redacted.test_nested.test_field == 'unsensitive_val'
+    assert str(request_message) == original
+    assert redacted == original \
+        .replace('package: "test_package"', 'package: "REDACTED"') \
+        .replace('java_package: "test_java_package"', 'java_package: "REDACTED"') \
+        .replace('name: "test_field"', 'name: "REDACTED"')
+
+
+@pytest.mark.parametrize('fields', [
+    ['package', 'options.java_package', 'message_type.field.name'],
+    ['dependency', 'options'],
+    ['message_type.field.number']
+])
+def test_redact_request_native_matches_rendered(request_message, fields):
+    plan = compile_redaction_plan(request_message.DESCRIPTOR, tuple(fields))
+    out = _SizeLimitedWriter()
+    _render_message(request_message, plan, out, 0)
+
+    with patch('logtracer.helpers.grpc.redact._render_message', wraps=_render_message) as m_render:
+        redacted = str(redact_request(request_message, fields))
+
+    assert redacted == out.getvalue()
+    assert m_render.called != plan.native
+
+
+@pytest.mark.parametrize('fields', [[], ['not_a_field'], ['name.not_a_field']])
+def test_redact_request_nothing_to_redact(request_message, fields):
+    assert str(redact_request(request_message, fields)) == str(request_message)
+
+
+def test_redact_request_map_field():
+    request = struct_pb2.Struct()
+    request['test_key'] = 'test_value'
+    request['test_nested'] = {'test_key': 1}
+
+    assert str(redact_request(request, ['fields'])) == 'fields: "REDACTED"\n'
+
+
+@patch('logtracer.helpers.grpc.redact._render_message')
+def test_RedactedRequest_lazy(m_render):
+    m_request, m_plan = MagicMock(), MagicMock()
+    m_plan.native = False
+
+    redacted = RedactedRequest(m_request, m_plan)
+
+    m_render.assert_not_called()
+    str(redacted)
+    m_render.assert_called_once()
+
+
+def test_redact_request_max_size(request_message):
+    redacted = str(redact_request(request_message, ['package'], max_size=30))
+
+    assert redacted == 'name: "test_name"\npackage: "RE... (truncated)'
+
+
+def test_redact_request_max_size_large_string_field():
+    request = descriptor_pb2.FileDescriptorProto(name='test_name' * 100000)
+
+    with patch('logtracer.helpers.grpc.redact.text_format.PrintField', wraps=text_format.PrintField) as m_print_field:
+        redacted = str(redact_request(request, [], max_size=20))
+
+    assert redacted == 'name: "test_nametest... (truncated)'
+    assert len(m_print_field.call_args[0][1]) == 20
+
+
+def test_redact_request_max_size_bytes_field():
+    request = wrappers_pb2.BytesValue(value=b'\xff' * 100000)
+
+    with patch('logtracer.helpers.grpc.redact.text_format.PrintField', wraps=text_format.PrintField) as m_print_field:
+        redacted = str(redact_request(request, [], max_size=20))
+
+    assert redacted == 'value: "\\377\\377\\377... (truncated)'
+    assert m_print_field.call_args[0][1] == b'\xff' * 20
+
+
+def test_SizeLimitedWriter_counts_bytes():
+    out = _SizeLimitedWriter(5)
+    out.write('\u00e9')
+    with pytest.raises(_SizeLimitReached):
+        out.write('\u00e9\u00e9')
+
+    assert out.getvalue() == '\u00e9\u00e9'
+    assert out.remaining == 0
+
+
+def test_redact_request_max_fields(request_message):
+    redacted = str(redact_request(request_message, ['package'], max_fields=2))
+
+    assert redacted == 'name: "test_name"\npackage: "REDACTED"\n... 5 more field values\n'
+
+
+def test_redact_request_max_fields_nested(request_message):
+    request_message.message_type[0].field.add(name='test_field2', number=2)
+
+    redacted = str(redact_request(request_message.message_type[0], ['field.name'], max_fields=2))
+
+    assert redacted == 'name: "test_message1"\nfield {\n  name: "REDACTED"\n  number: 1\n}\n... 1 more field values\n'
+
+
+def test_redact_request_summary(request_message):
+    redacted = str(redact_request(request_message, ['package'], summary=True))
+
+    assert redacted == f'<google.protobuf.FileDescriptorProto: {request_message.ByteSize()} bytes>'
@@ -1,20 +1,41 @@
 import json
 from unittest.mock import MagicMock, patch, call
 
+import grpc
 import pytest
 from grpc._cython.cygrpc import _Metadatum
 
-from logtracer.helpers.grpc.tracing import GRPCTracer, _IncomingInterceptor, _OutgoingInterceptor, B3_VALUES_KEY, \
-    _grpc_status_from_context
+from logtracer.helpers.grpc.concurrency import ServerCallStats
+from logtracer.helpers.grpc.propagation import encode_b3_bin
+from logtracer.helpers.grpc.tracing import GRPCTracer, _IncomingCallLogging, _IncomingInterceptor, \
+    _OutgoingInterceptor, B3_VALUES_KEY, _grpc_status_from_context, _wrap_rpc_behavior, _log_response_callback, \
+    _TracedMethod
 
 
 def test_GRPCTracer_init():
     m_logger_factory = MagicMock()
 
-    grpc_tracer = GRPCTracer(m_logger_factory, redacted_fields='test_redacted_fields')
+    grpc_tracer = GRPCTracer(m_logger_factory, redacted_fields='test_redacted_fields', request_log_max_size=100,
+                             request_log_max_fields=10, request_log_summary=True)
     assert isinstance(grpc_tracer.server_interceptor(), _IncomingInterceptor)
     assert isinstance(grpc_tracer.client_interceptor(), _OutgoingInterceptor)
     assert grpc_tracer.redacted_fields == 'test_redacted_fields'
+    assert grpc_tracer.request_log_max_size == 100
+    assert grpc_tracer.request_log_max_fields == 10
+    assert grpc_tracer.request_log_summary is True
+
+
+def test_IncomingCallLogging_abstract():
+    with pytest.raises(TypeError):
+        _IncomingCallLogging(MagicMock())
+
+
+@patch('logtracer.helpers.grpc.tracing._grpc_status_from_context', return_value='test_status')
+def test_IncomingCallLogging_status_from_context(m_grpc_status):
+    m_servicer_context = MagicMock()
+
+    assert _IncomingInterceptor(MagicMock())._status_from_context(m_servicer_context) == 'test_status'
+    m_grpc_status.assert_called_with(m_servicer_context)
 
 
 def test_IncomingInterceptor_init():
@@ -28,9 +49,10 @@ def test_IncomingInterceptor_init():
 def test_IncomingInterceptor_intercept_service(m_grpc_status, m_redact):
     m_tracer = MagicMock()
     interceptor = _IncomingInterceptor(m_tracer)
-    interceptor._retrieve_span_values_from_incoming_call = MagicMock(return_value='test_b3_values')
+    interceptor._retrieve_span_values_from_metadata = MagicMock(return_value='test_b3_values')
     interceptor._tracer = MagicMock()
     interceptor._tracer.redacted_fields = 'test_fields_to_redact'
+    interceptor._tracer.record_span_resource_usage.return_value = ' - test_resource_usage'
     m_continuation, m_handler_call_details = MagicMock(), MagicMock()
     m_handler_call_details.method = 'test_method'
     m_behaviour = MagicMock()
@@ -42,12 +64,13 @@ def test_IncomingInterceptor_intercept_service(m_grpc_status, m_redact):
     new_behaviour = new_behaviour_func(m_request, m_servicer_context)
 
     interceptor._tracer.start_traced_span.assert_called_with('test_b3_values', m_handler_call_details.method)
-    m_redact.assert_called_with(m_request, 'test_fields_to_redact')
+    m_redact.assert_called_with(m_request, 'test_fields_to_redact', interceptor._tracer.request_log_max_size,
+                                interceptor._tracer.request_log_max_fields, interceptor._tracer.request_log_summary)
     m_grpc_status.assert_called_with(m_servicer_context)
     m_behaviour.assert_called_with(m_request, m_servicer_context)
     expected_logs = [
-        call('test_method - received gRPC call \nrequest: test_redacted_request'),
-        call('test_method.test_grpc_status - returning gRPC call')
+        call('test_method - received gRPC call \nrequest: %s', 'test_redacted_request'),
+        call('test_method%s - returning gRPC call%s', '.test_grpc_status', ' - test_resource_usage')
     ]
     assert interceptor._tracer.logger.info.call_args_list == expected_logs
     interceptor._tracer.end_traced_span.assert_called_with(exclude_from_posting=False)
@@ -62,9 +85,10 @@ def test_IncomingInterceptor_intercept_service_exception(m_grpc_status, m_redact
 
     m_tracer = MagicMock()
     interceptor = _IncomingInterceptor(m_tracer)
-    interceptor._retrieve_span_values_from_incoming_call = MagicMock(return_value='test_b3_values')
+    interceptor._retrieve_span_values_from_metadata = MagicMock(return_value='test_b3_values')
     interceptor._tracer = MagicMock()
     interceptor._tracer.redacted_fields = 'test_fields_to_redact'
+    interceptor._tracer.record_span_resource_usage.return_value = ' - test_resource_usage'
     m_continuation, m_handler_call_details = MagicMock(), MagicMock()
     m_handler_call_details.method = 'test_method'
     m_exception = TestException('test exception')
@@ -78,38 +102,60 @@ def test_IncomingInterceptor_intercept_service_exception(m_grpc_status, m_redact
         new_behaviour = new_behaviour_func(m_request, m_servicer_context)
 
     interceptor._tracer.start_traced_span.assert_called_with('test_b3_values', m_handler_call_details.method)
-    m_redact.assert_called_with(m_request, 'test_fields_to_redact')
+    m_redact.assert_called_with(m_request, 'test_fields_to_redact', interceptor._tracer.request_log_max_size,
+                                interceptor._tracer.request_log_max_fields, interceptor._tracer.request_log_summary)
     m_grpc_status.assert_called_with(m_servicer_context)
     m_behaviour.assert_called_with(m_request, m_servicer_context)
     interceptor._tracer.logger.info.assert_called_with(
-        'test_method - received gRPC call \nrequest: test_redacted_request'
+        'test_method - received gRPC call \nrequest: %s', 'test_redacted_request'
     )
     interceptor._tracer.logger.error.assert_called_with(
-        'test_method - TestException.test_grpc_status'
+        'test_method - %s%s%s', 'TestException', '.test_grpc_status', ' - test_resource_usage'
     )
     interceptor._tracer.logger.exception.assert_called_with(m_exception)
     interceptor._tracer.end_traced_span.assert_called_with(exclude_from_posting=False)
 
 
-def test_IncomingInterceptor_retrieve_span_values_from_incoming_call():
-    m_handler_call_details = MagicMock()
-    m_handler_call_details.invocation_metadata = [
+def test_IncomingInterceptor_retrieve_span_values_from_metadata():
+    invocation_metadata = [
         _Metadatum(key=B3_VALUES_KEY, value=json.dumps({'test_b3_values': 'values'})),
         _Metadatum(key='other_key', value='test_other_value')
     ]
 
-    values = _IncomingInterceptor._retrieve_span_values_from_incoming_call(m_handler_call_details)
+    values = _IncomingInterceptor._retrieve_span_values_from_metadata(invocation_metadata)
 
     assert values == {'test_b3_values': 'values'}
 
 
-def test_IncomingInterceptor_retrieve_span_values_from_incoming_call_no_values():
-    m_handler_call_details = MagicMock()
-    m_handler_call_details.invocation_metadata = [
+def test_IncomingInterceptor_retrieve_span_values_from_metadata_binary():
+    span_values = {'X-B3-TraceId': '0123456789abcdef0123456789abcdef', 'X-B3-SpanId': '0123456789abcdef'}
+    invocation_metadata = [
+        _Metadatum(key=B3_VALUES_KEY, value=json.dumps({'test_b3_values': 'values'})),
+        _Metadatum(key='b3-bin', value=encode_b3_bin(span_values))
+    ]
+
+    values = _IncomingInterceptor._retrieve_span_values_from_metadata(invocation_metadata)
+
+    assert values == span_values
+
+
+def test_IncomingInterceptor_retrieve_span_values_from_metadata_invalid_binary():
+    invocation_metadata = [
+        _Metadatum(key='b3-bin', value=b'invalid'),
+        _Metadatum(key=B3_VALUES_KEY, value=json.dumps({'test_b3_values': 'values'}))
+    ]
+
+    values = _IncomingInterceptor._retrieve_span_values_from_metadata(invocation_metadata)
+
+    assert values == {'test_b3_values': 'values'}
+
+
+def test_IncomingInterceptor_retrieve_span_values_from_metadata_no_values():
+    invocation_metadata = [
         _Metadatum(key='other_key', value='test_other_value')
     ]
 
-    values = _IncomingInterceptor._retrieve_span_values_from_incoming_call(m_handler_call_details)
+    values = _IncomingInterceptor._retrieve_span_values_from_metadata(invocation_metadata)
 
     assert values == {}
 
@@ -119,7 +165,11 @@ def test_OutgoingInterceptor_init():
     assert _OutgoingInterceptor(m_tracer)._tracer == m_tracer
 
 
-def test_OutgoingInterceptor_intercept_unary_unary():
+@pytest.mark.parametrize('intercept_method', [
+    'intercept_unary_unary', 'intercept_unary_stream', 'intercept_stream_unary', 'intercept_stream_stream'
+])
+@patch('logtracer.helpers.grpc.tracing._log_response_callback')
+def test_OutgoingInterceptor_intercept(m_log_response_callback, intercept_method):
     m_tracer = MagicMock()
     interceptor = _OutgoingInterceptor(m_tracer)
     interceptor._generate_metadata_with_b3_values = MagicMock(return_value='test_metadata_with_b3_values')
@@ -130,27 +180,56 @@ def test_OutgoingInterceptor_intercept_unary_unary():
     m_client_call_details.timeout = 'test_timeout'
     m_client_call_details.credentials = 'test_credentials'
 
-    response_future = interceptor.intercept_unary_unary(m_continuation, m_client_call_details, m_request)
+    response_future = getattr(interceptor, intercept_method)(m_continuation, m_client_call_details, m_request)
 
-    expected_logs = [
-        call('test_method - outbound gRPC call'),
-        call('Response received from test_method')
-    ]
-    assert interceptor._tracer.logger.info.call_args_list == expected_logs
+    interceptor._tracer.logger.info.assert_called_once_with('%s - outbound gRPC call', 'test_method')
     modified_client_call_details = m_continuation.call_args[0][0]
     assert modified_client_call_details.method == 'test_method'
     assert modified_client_call_details.timeout == 'test_timeout'
     assert modified_client_call_details.credentials == 'test_credentials'
     assert modified_client_call_details.metadata == 'test_metadata_with_b3_values'
-    assert m_response_future.result.called
+    assert m_continuation.call_args[0][1] == m_request
+    assert not m_response_future.result.called
+    m_response_future.add_done_callback.assert_called_with(m_log_response_callback.return_value)
     assert response_future == m_response_future
 
 
+def test_log_response_callback():
+    m_tracer, m_response = MagicMock(), MagicMock()
+    m_tracer.memory.current_span_id = 'test_other_span_id'
+    m_response.code.return_value = grpc.StatusCode.OK
+
+    def check_span(*_):
+        assert m_tracer.memory.current_span_id == 'test_span_id'
+
+    m_tracer.logger.info.side_effect = check_span
+    log_response = _log_response_callback(m_tracer, 'test_method', 'test_span_id', 0)
+    log_response(m_response)
+
+    assert m_tracer.logger.info.call_args[0][:2] == ('Response received from %s (%.1f ms)', 'test_method')
+    assert m_tracer.memory.current_span_id == 'test_other_span_id'
+
+
+def test_log_response_callback_error():
+    m_tracer, m_response = MagicMock(), MagicMock()
+    m_response.code.return_value = grpc.StatusCode.UNAVAILABLE
+    m_response.details.return_value = 'test_details'
+
+    log_response = _log_response_callback(m_tracer, 'test_method', 'test_span_id', 0)
+    log_response(m_response)
+
+    assert m_tracer.logger.error.call_args[0][:4] == (
+        'Response received from %s - %s - %s (%.1f ms)', 'test_method', grpc.StatusCode.UNAVAILABLE, 'test_details'
+    )
+
+
 def test_OutgoingInterceptor_generate_metadata_with_b3_values():
     m_tracer = MagicMock()
+    m_tracer.binary_propagation = False
     interceptor = _OutgoingInterceptor(m_tracer)
     m_client_call_details = MagicMock()
     m_client_call_details.metadata = ('test_existing_metadatum1', 'test_existing_metadatum2')
+    m_client_call_details.timeout = None
     m_tracer.generate_new_traced_subspan_values.return_value = {'test_b3_subspan_values': 'values'}
 
     new_metadata = interceptor._generate_metadata_with_b3_values(m_client_call_details)
@@ -163,11 +242,31 @@ def test_OutgoingInterceptor_generate_metadata_with_b3_values():
     ]
 
 
+def test_OutgoingInterceptor_generate_metadata_with_b3_bin_values():
+    m_tracer = MagicMock()
+    m_tracer.binary_propagation = True
+    interceptor = _OutgoingInterceptor(m_tracer)
+    m_client_call_details = MagicMock()
+    m_client_call_details.metadata = None
+    m_client_call_details.timeout = None
+    m_tracer.generate_new_traced_subspan_values.return_value = {
+        'X-B3-TraceId': '0123456789abcdef0123456789abcdef',
+        'X-B3-SpanId': '0123456789abcdef'
+    }
+
+    new_metadata = interceptor._generate_metadata_with_b3_values(m_client_call_details)
+
+    assert new_metadata == [
+        _Metadatum(key='b3-bin', value=encode_b3_bin(m_tracer.generate_new_traced_subspan_values.return_value))
+    ]
+
+
 def test_OutgoingInterceptor_generate_metadata_with_b3_values_none_already():
     m_tracer = MagicMock()
     interceptor = _OutgoingInterceptor(m_tracer)
     m_client_call_details = MagicMock()
     m_client_call_details.metadata = None
+    m_client_call_details.timeout = None
     m_tracer.generate_new_traced_subspan_values.return_value = {'test_b3_subspan_values': 'values'}
 
     new_metadata = interceptor._generate_metadata_with_b3_values(m_client_call_details)
@@ -178,6 +277,48 @@ def test_OutgoingInterceptor_generate_metadata_with_b3_values_none_already():
     ]
 
 
+def test_OutgoingInterceptor_generate_metadata_with_timeout():
+    m_tracer = MagicMock()
+    m_tracer.binary_propagation = False
+    interceptor = _OutgoingInterceptor(m_tracer)
+    m_client_call_details = MagicMock()
+    m_client_call_details.metadata = None
+    m_client_call_details.timeout = 1.5
+    m_tracer.generate_new_traced_subspan_values.return_value = {'test_b3_subspan_values': 'values'}
+
+    new_metadata = interceptor._generate_metadata_with_b3_values(m_client_call_details)
+
+    assert new_metadata == [
+        _Metadatum(key='b3-values', value='{"test_b3_subspan_values": "values"}'),
+        _Metadatum(key='logtracer-timeout', value='1.5')
+    ]
+
+
+@patch('logtracer.helpers.grpc.tracing._wrap_rpc_behavior', MagicMock(side_effect=lambda handler, fn: fn))
+@patch('logtracer.helpers.grpc.tracing._grpc_status_from_context', MagicMock(return_value=''))
+def test_IncomingInterceptor_intercept_service_server_concurrency():
+    interceptor = _IncomingInterceptor(MagicMock())
+    interceptor._retrieve_span_values_from_metadata = MagicMock(return_value='test_b3_values')
+    interceptor._tracer.server_call_stats = ServerCallStats()
+    m_handler_call_details = MagicMock()
+    m_handler_call_details.method = 'test_method'
+    m_servicer_context = MagicMock()
+    m_servicer_context.invocation_metadata.return_value = [_Metadatum(key='logtracer-timeout', value='2.0')]
+    m_servicer_context.time_remaining.return_value = 1.5
+
+    tracing_wrapper = interceptor.intercept_service(MagicMock(), m_handler_call_details)
+    tracing_wrapper(MagicMock())(MagicMock(), m_servicer_context)
+
+    assert interceptor._tracer.set_span_attribute.call_args_list == [
+        call('grpc.method_in_flight', 1),
+        call('grpc.server_in_flight', 1),
+        call('grpc.queue_wait_ms', 500.0),
+    ]
+    snapshot = interceptor._tracer.server_call_stats.snapshot()
+    assert snapshot['in_flight'] == 0
+    assert snapshot['methods']['test_method']['queue_wait_max_ms'] == 500.0
+
+
 def test_grpc_status_from_context():
     m_servicer_context = MagicMock()
     m_servicer_context._state.code = 'test_code'
@@ -194,3 +335,200 @@ def test_grpc_status_from_context_no_code():
 
     assert code_str == ''
 
+
+
+@patch('logtracer.helpers.grpc.tracing._wrap_rpc_behavior', MagicMock(side_effect=lambda handler, fn: fn))
+@patch('logtracer.helpers.grpc.tracing.redact_request')
+@patch('logtracer.helpers.grpc.tracing._grpc_status_from_context')
+def test_IncomingInterceptor_intercept_service_info_disabled(m_grpc_status, m_redact):
+    interceptor = _IncomingInterceptor(MagicMock())
+    interceptor._retrieve_span_values_from_metadata = MagicMock(return_value='test_b3_values')
+    interceptor._tracer.logger.isEnabledFor.return_value = False
+    m_behaviour = MagicMock()
+
+    tracing_wrapper = interceptor.intercept_service(MagicMock(), MagicMock())
+    tracing_wrapper(m_behaviour)(MagicMock(), MagicMock())
+
+    assert not m_redact.called
+    assert not m_grpc_status.called
+    assert not interceptor._tracer.logger.info.called
+    interceptor._tracer.end_traced_span.assert_called_with(exclude_from_posting=False)
+
+
+def _streaming_interceptor():
+    interceptor = _IncomingInterceptor(MagicMock())
+    interceptor._retrieve_span_values_from_metadata = MagicMock(return_value='test_b3_values')
+    interceptor._tracer.count_stream_bytes = True
+    interceptor._tracer.memory.current_span_id = 'test_span_id'
+    interceptor._tracer.server_call_stats = None
+    return interceptor
+
+
+def _message(size):
+    message = MagicMock()
+    message.ByteSize.return_value = size
+    return message
+
+
+@patch('logtracer.helpers.grpc.tracing._wrap_rpc_behavior', MagicMock(side_effect=lambda handler, fn: fn))
+@patch('logtracer.helpers.grpc.tracing._grpc_status_from_context', MagicMock(return_value=''))
+def test_IncomingInterceptor_intercept_service_response_stream():
+    interceptor = _streaming_interceptor()
+    responses = [_message(10), _message(20)]
+    m_behaviour = MagicMock(return_value=iter(responses))
+
+    tracing_wrapper = interceptor.intercept_service(MagicMock(), MagicMock())
+    response_iterator = tracing_wrapper(m_behaviour, False, True)(_message(5), MagicMock())
+
+    assert not interceptor._tracer.end_traced_span.called
+    assert list(response_iterator) == responses
+    interceptor._tracer.end_traced_span.assert_called_once_with(exclude_from_posting=False)
+    assert interceptor._tracer.set_span_attribute.call_args_list == [
+        call('grpc.request_count', 1),
+        call('grpc.response_count', 2),
+        call('grpc.request_bytes', 5),
+        call('grpc.response_bytes', 30),
+    ]
+
+
+@patch('logtracer.helpers.grpc.tracing._wrap_rpc_behavior', MagicMock(side_effect=lambda handler, fn: fn))
+@patch('logtracer.helpers.grpc.tracing._grpc_status_from_context', MagicMock(return_value=''))
+def test_IncomingInterceptor_intercept_service_request_stream():
+    interceptor = _streaming_interceptor()
+    interceptor._tracer.count_stream_bytes = False
+
+    def m_behaviour(request_iterator, _):
+        return [request for request in request_iterator][0]
+
+    requests = [_message(10), _message(20)]
+    tracing_wrapper = interceptor.intercept_service(MagicMock(), MagicMock())
+    response = tracing_wrapper(m_behaviour, True, False)(iter(requests), MagicMock())
+
+    assert response == requests[0]
+    interceptor._tracer.end_traced_span.assert_called_once_with(exclude_from_posting=False)
+    assert interceptor._tracer.set_span_attribute.call_args_list == [
+        call('grpc.request_count', 2),
+        call('grpc.response_count', 1),
+    ]
+    assert not requests[0].ByteSize.called
+
+
+@patch('logtracer.helpers.grpc.tracing._wrap_rpc_behavior', MagicMock(side_effect=lambda handler, fn: fn))
+@patch('logtracer.helpers.grpc.tracing._grpc_status_from_context', MagicMock(return_value=''))
+def test_IncomingInterceptor_intercept_service_response_stream_exception():
+    class TestException(Exception):
+        pass
+
+    def m_behaviour(request_iterator, _):
+        yield _message(1)
+        raise TestException('test exception')
+
+    interceptor = _streaming_interceptor()
+    tracing_wrapper = interceptor.intercept_service(MagicMock(), MagicMock())
+    response_iterator = tracing_wrapper(m_behaviour, True, True)(iter([]), MagicMock())
+
+    next(response_iterator)
+    with pytest.raises(TestException):
+        next(response_iterator)
+
+    interceptor._tracer.logger.exception.assert_called_once()
+    interceptor._tracer.end_traced_span.assert_called_once_with(exclude_from_posting=False)
+
+
+@patch('logtracer.helpers.grpc.tracing._wrap_rpc_behavior', MagicMock(side_effect=lambda handler, fn: fn))
+@patch('logtracer.helpers.grpc.tracing._grpc_status_from_context', MagicMock(return_value=''))
+def test_IncomingInterceptor_intercept_service_response_stream_not_iterated():
+    interceptor = _streaming_interceptor()
+    m_servicer_context = MagicMock()
+    m_servicer_context.add_callback.return_value = True
+    m_behaviour = MagicMock(return_value=iter([_message(10)]))
+
+    tracing_wrapper = interceptor.intercept_service(MagicMock(), MagicMock())
+    response_iterator = tracing_wrapper(m_behaviour, False, True)(_message(5), m_servicer_context)
+    del response_iterator
+    assert not interceptor._tracer.end_traced_span.called
+
+    # the RPC terminates, eg as the client cancelled it
+    on_termination = m_servicer_context.add_callback.call_args[0][0]
+    on_termination()
+    on_termination()
+    interceptor._tracer.end_traced_span.assert_called_once_with(exclude_from_posting=False)
+
+
+@patch('logtracer.helpers.grpc.tracing._wrap_rpc_behavior', MagicMock(side_effect=lambda handler, fn: fn))
+@patch('logtracer.helpers.grpc.tracing._grpc_status_from_context', MagicMock(return_value=''))
+def test_IncomingInterceptor_intercept_service_response_stream_then_terminated():
+    interceptor = _streaming_interceptor()
+    m_servicer_context = MagicMock()
+    m_behaviour = MagicMock(return_value=iter([_message(10)]))
+
+    tracing_wrapper = interceptor.intercept_service(MagicMock(), MagicMock())
+    response_iterator = tracing_wrapper(m_behaviour, False, True)(_message(5), m_servicer_context)
+    list(response_iterator)
+    m_servicer_context.add_callback.call_args[0][0]()
+
+    interceptor._tracer.end_traced_span.assert_called_once_with(exclude_from_posting=False)
+
+
+@patch('logtracer.helpers.grpc.tracing._wrap_rpc_behavior', MagicMock(side_effect=lambda handler, fn: fn))
+@patch('logtracer.helpers.grpc.tracing._grpc_status_from_context', MagicMock(return_value=''))
+def test_IncomingInterceptor_intercept_service_response_stream_already_terminated():
+    interceptor = _streaming_interceptor()
+    m_servicer_context = MagicMock()
+    m_servicer_context.add_callback.return_value = False
+
+    tracing_wrapper = interceptor.intercept_service(MagicMock(), MagicMock())
+    tracing_wrapper(MagicMock(return_value=iter([])), False, True)(_message(5), m_servicer_context)
+
+    interceptor._tracer.end_traced_span.assert_called_once_with(exclude_from_posting=False)
+
+
+@pytest.mark.parametrize('request_streaming,response_streaming,behavior_name,factory_name', [
+    (False, False, 'unary_unary', 'unary_unary_rpc_method_handler'),
+    (False, True, 'unary_stream', 'unary_stream_rpc_method_handler'),
+    (True, False, 'stream_unary', 'stream_unary_rpc_method_handler'),
+    (True, True, 'stream_stream', 'stream_stream_rpc_method_handler'),
+])
+def test_wrap_rpc_behavior(request_streaming, response_streaming, behavior_name, factory_name):
+    m_handler, m_fn = MagicMock(), MagicMock()
+    m_handler.request_streaming = request_streaming
+    m_handler.response_streaming = response_streaming
+
+    with patch(f'logtracer.helpers.grpc.tracing.grpc.{factory_name}') as m_factory:
+        new_handler = _wrap_rpc_behavior(m_handler, m_fn)
+
+    m_fn.assert_called_with(getattr(m_handler, behavior_name), request_streaming, response_streaming)
+    m_factory.assert_called_with(m_fn.return_value, request_deserializer=m_handler.request_deserializer,
+                                 response_serializer=m_handler.response_serializer)
+    assert new_handler == m_factory.return_value
+
+
+def test_wrap_rpc_behavior_no_handler():
+    assert _wrap_rpc_behavior(None, MagicMock()) is None
+
+
+@patch('logtracer.helpers.grpc.tracing._wrap_rpc_behavior')
+def test_IncomingInterceptor_intercept_service_cached_handler(m_wrap_rpc_behavior):
+    m_wrap_rpc_behavior.side_effect = lambda handler, fn: MagicMock()
+    interceptor = _IncomingInterceptor(MagicMock())
+    m_handler, m_other_handler = MagicMock(), MagicMock()
+    m_handler_call_details = MagicMock()
+    m_handler_call_details.method = 'test_method'
+
+    wrapped_handler = interceptor.intercept_service(MagicMock(return_value=m_handler), m_handler_call_details)
+
+    assert interceptor.intercept_service(MagicMock(return_value=m_handler), m_handler_call_details) is wrapped_handler
+    assert m_wrap_rpc_behavior.call_count == 1
+    assert interceptor.intercept_service(MagicMock(return_value=m_other_handler), m_handler_call_details) is not \
+        wrapped_handler
+    assert m_wrap_rpc_behavior.call_count == 2
+
+
+def test_TracedMethod():
+    traced_method = _TracedMethod('/test.Service/Test%Method')
+
+    assert traced_method.received_message == '/test.Service/Test%Method - received gRPC call '
+    assert traced_method.received_request_message % 'test_request' == \
+        '/test.Service/Test%Method - received gRPC call \nrequest: test_request'
+    assert traced_method.returning_message % (' - test_status', '') == \
+        '/test.Service/Test%Method - test_status - returning gRPC call'
@@ -9,5 +9,5 @@ def test_MixedTracer(m_flask_tracer_init, m_grpc_tracer_init):
     m_logger_factory = MagicMock()
     MixedTracer(m_logger_factory, post_spans_to_stackdriver_api=False)
 
-    m_grpc_tracer_init.assert_called_with(m_logger_factory, False)
+    m_grpc_tracer_init.assert_called_with(m_logger_factory, False, binary_propagation=False, trace_api_endpoint=None)
     assert not m_flask_tracer_init.called
@@ -1,11 +1,12 @@
+import logging
+import sys
 from datetime import datetime
 from unittest.mock import patch, MagicMock
 
 import pytest
 
-from logtracer.exceptions import SpanNotStartedError
 from logtracer.jsonlog import JsonFormatter, _generate_log_record, _add_span_values, _format_message_for_exception, \
-    JSONLoggerFactory, Formatters
+    JSONLoggerFactory, Formatters, _exception_fingerprint, _TracebackCache, TracedLogger
 
 MODULE_PATH = 'logtracer.jsonlog.'
 
@@ -20,14 +21,13 @@ def test_JsonFormatter_add_fields(m_add_span_values, m_generate_log_record, m_fo
     m_generate_log_record.return_value = {'test_generate': 'record'}
     mock_log_record = {'test': 'record'}
     mock_record = MockRecord()
-    json_formatter = JsonFormatter('test_stackdriver_bool', 'test_project_name')
+    json_formatter = JsonFormatter('test_stackdriver_bool', 'test_project_name', traceback_cache='test_cache')
     json_formatter.tracer = 'test_tracer'
     json_formatter.add_fields(mock_log_record, mock_record, {})
 
-    m_format_msg_exc.assert_called_with(mock_record)
+    m_format_msg_exc.assert_called_with(mock_record, 'test_cache')
     m_generate_log_record.assert_called_with(mock_record, stackdriver='test_stackdriver_bool')
-    m_add_span_values.assert_called_with('test_tracer', {'test_generate': 'record'}, 'test_stackdriver_bool',
-                                         'test_project_name')
+    m_add_span_values.assert_called_with('test_tracer', {'test_generate': 'record'}, 'test_stackdriver_bool', None)
     assert mock_log_record == {'test': 'record', 'test_generate': 'record'}
 
 
@@ -95,48 +95,60 @@ def test_generate_log_record_stackdriver():
     assert mock_log_record == expected_mock_log_record
 
 
+def test_generate_log_record_exception():
+    mock_record = MagicMock()
+    mock_record.exc_info = 'test_exc_info'
+    mock_record.exc_fingerprint = 'test_fingerprint'
+    mock_record.levelname = 'EXCEPTION'
+
+    mock_log_record = _generate_log_record(mock_record, stackdriver=False)
+
+    assert mock_log_record['exceptionFingerprint'] == 'test_fingerprint'
+    assert mock_log_record['severity'] == 'ERROR'
+
+
+test_span_log_fields = {
+    'local': {'trace': 'test_trace_id', 'spanId': 'test_span_id'},
+    'stackdriver': {
+        'logging.googleapis.com/trace': 'projects/test_project_name/traces/test_trace_id',
+        'logging.googleapis.com/spanId': 'test_span_id'
+    }
+}
+
+
 def test_add_span_values_local():
     m_tracer = MagicMock()
-    m_tracer.current_span = {
-        'values': {
-            'X-B3-TraceId': 'test_trace_id',
-            'X-B3-ParentSpanId': 'test_parent_span_id',
-            'X-B3-SpanId': 'test_span_id',
-            'X-B3-Sampled': 'test_sampled',
-            'X-B3-Flags': 'test_b3_flags'
-        }}
+    m_tracer.find_current_span.return_value = {'log_fields': test_span_log_fields}
     m_record = {}
-    _add_span_values(m_tracer, m_record, stackdriver=False, project_name='test_project_name')
+    _add_span_values(m_tracer, m_record, stackdriver=False)
 
     assert m_record == {'spanId': 'test_span_id', 'trace': 'test_trace_id'}
 
 
 def test_add_span_values_stackdriver():
     m_tracer = MagicMock()
-    m_tracer.current_span = {
-        'values': {
-            'X-B3-TraceId': 'test_trace_id',
-            'X-B3-ParentSpanId': 'test_parent_span_id',
-            'X-B3-SpanId': 'test_span_id',
-            'X-B3-Sampled': 'test_sampled',
-            'X-B3-Flags': 'test_b3_flags'
-        }}
+    m_tracer.find_current_span.return_value = {'log_fields': test_span_log_fields}
     m_record = {}
-    _add_span_values(m_tracer, m_record, stackdriver=True, project_name='test_project_name')
+    _add_span_values(m_tracer, m_record, stackdriver=True)
 
     assert m_record == {'logging.googleapis.com/spanId': 'test_span_id',
                         'logging.googleapis.com/trace': 'projects/test_project_name/traces/test_trace_id'}
 
 
-def test_add_span_values_none():
-    class MockTracer:
-        @property
-        def current_span(self):
-            raise SpanNotStartedError()
+def test_add_span_values_buffered_record():
+    m_tracer = MagicMock()
+    m_record = {}
+    _add_span_values(m_tracer, m_record, stackdriver=False, span_log_fields=test_span_log_fields)
+
+    assert not m_tracer.find_current_span.called
+    assert m_record == {'spanId': 'test_span_id', 'trace': 'test_trace_id'}
 
-    m_tracer = MockTracer()
+
+def test_add_span_values_none():
+    m_tracer = MagicMock()
+    m_tracer.find_current_span.return_value = None
     m_record = {}
-    _add_span_values(m_tracer, m_record, stackdriver=True, project_name='test_project_name')
+    _add_span_values(m_tracer, m_record, stackdriver=True)
 
     assert m_record == {}
 
@@ -159,6 +171,73 @@ test_formatted_tb"""
     assert m_record.message == expected_message
 
 
+def _raise_and_capture(message):
+    try:
+        raise ValueError(message)
+    except ValueError:
+        return sys.exc_info()
+
+
+def test_exception_fingerprint():
+    first = _raise_and_capture('first')
+    second = _raise_and_capture('second')
+
+    assert _exception_fingerprint(first[0], first[2]) == _exception_fingerprint(second[0], second[2])
+    assert _exception_fingerprint(first[0], first[2]) != _exception_fingerprint(KeyError, first[2])
+    assert len(_exception_fingerprint(first[0], first[2])) == 16
+
+
+def test_format_message_for_exception_with_cache():
+    m_record = MagicMock()
+    m_record.exc_info = _raise_and_capture('test_exception')
+    traceback_cache = _TracebackCache()
+
+    _format_message_for_exception(m_record, traceback_cache)
+
+    assert m_record.message.startswith('Exception: ValueError(test_exception)\nTraceback:\n  File')
+    assert m_record.exc_fingerprint in traceback_cache._tracebacks
+
+
+@patch(MODULE_PATH + 'traceback')
+def test_TracebackCache_reuses_rendered_traceback(m_traceback):
+    m_traceback.format_tb.return_value = ['test_formatted_tb']
+    traceback_cache = _TracebackCache()
+
+    assert traceback_cache.get_rendered_traceback('test_fingerprint', 'test_tb') == 'test_formatted_tb'
+    assert traceback_cache.get_rendered_traceback('test_fingerprint', 'test_tb') == 'test_formatted_tb'
+    assert m_traceback.format_tb.call_count == 1
+
+
+@patch(MODULE_PATH + 'traceback')
+def test_TracebackCache_evicts_least_recently_used(m_traceback):
+    m_traceback.format_tb.return_value = ['test_formatted_tb']
+    traceback_cache = _TracebackCache(max_size=2)
+
+    traceback_cache.get_rendered_traceback('test_fingerprint_1', 'test_tb')
+    traceback_cache.get_rendered_traceback('test_fingerprint_2', 'test_tb')
+    traceback_cache.get_rendered_traceback('test_fingerprint_1', 'test_tb')
+    traceback_cache.get_rendered_traceback('test_fingerprint_3', 'test_tb')
+
+    assert list(traceback_cache._tracebacks) == ['test_fingerprint_1', 'test_fingerprint_3']
+
+
+@patch(MODULE_PATH + 'time')
+@patch(MODULE_PATH + 'traceback')
+def test_TracebackCache_repeat_window(m_traceback, m_time):
+    m_traceback.format_tb.return_value = ['test_formatted_tb']
+    traceback_cache = _TracebackCache(repeat_window=10)
+
+    m_time.monotonic.return_value = 100
+    assert traceback_cache.get_rendered_traceback('test_fingerprint', 'test_tb') == 'test_formatted_tb'
+
+    m_time.monotonic.return_value = 105
+    assert traceback_cache.get_rendered_traceback('test_fingerprint', 'test_tb') == \
+        'Repeated, see earlier log entry with exception fingerprint test_fingerprint'
+
+    m_time.monotonic.return_value = 120
+    assert traceback_cache.get_rendered_traceback('test_fingerprint', 'test_tb') == 'test_formatted_tb'
+
+
 def test_JsonLoggerFactory_stackdriver():
     json_logger_factory = JSONLoggerFactory('test_project_name', 'test_service_name', Formatters.stackdriver,
                                             logger_per_module=False)
@@ -189,3 +268,31 @@ def test_JsonLoggerFactory_logger_per_module():
 def test_JsonLoggerFactory_string_formatter_fail():
     with pytest.raises(ValueError):
         JSONLoggerFactory('test_project_name', 'test_service_name', 'local')
+
+
+def test_TracedLogger_isEnabledFor():
+    json_logger_factory = JSONLoggerFactory('test_project_name', 'test_service_name', Formatters.local)
+    logger = json_logger_factory.get_logger(level='INFO')
+    assert isinstance(logger, TracedLogger)
+    assert not logger.isEnabledFor(logging.DEBUG)
+
+    json_logger_factory.tracer = MagicMock()
+    json_logger_factory.tracer.is_debug_logging_span.return_value = True
+    assert logger.isEnabledFor(logging.DEBUG)
+
+    json_logger_factory.tracer.is_debug_logging_span.return_value = False
+    assert not logger.isEnabledFor(logging.DEBUG)
+    assert logger.isEnabledFor(logging.INFO)
+
+
+def test_JsonLoggerFactory_get_logger_existing_logger():
+    existing_logger = logging.getLogger('test_existing_service_name')
+    json_logger_factory = JSONLoggerFactory('test_project_name', 'test_existing_service_name', Formatters.local,
+                                            logger_per_module=True)
+
+    logger = json_logger_factory.get_logger()
+
+    assert logger is existing_logger
+    assert type(logger) is logging.Logger
+    assert isinstance(json_logger_factory.get_logger('test_new_module'), TracedLogger)
+    assert type(logging.getLogger('test_existing_service_name.test_other_module')) is logging.Logger
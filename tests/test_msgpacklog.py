@@ -0,0 +1,100 @@
+import io
+import json
+import logging
+from datetime import datetime
+from unittest.mock import MagicMock
+
+from logtracer.jsonlog import JSONLoggerFactory, Formatters
+from logtracer.msgpacklog import MsgpackFormatter, MsgpackStreamHandler, iter_msgpack_records, to_json_log_record, \
+    convert_msgpack_stream
+
+test_msgpack_log_record = {
+    'severity': 'INFO',
+    'message': 'test_name - test_message',
+    'time': 1532963448.341651,
+    'sourceLocation': {'file': 'test_pathname', 'line': 1, 'function': 'test_function'},
+    'trace': 'test_trace_id',
+    'spanId': 'test_span_id'
+}
+# the time is formatted in local time
+test_msgpack_log_record_time = datetime.fromtimestamp(test_msgpack_log_record['time']).isoformat()
+
+
+def _write_records(records):
+    stream = io.BytesIO()
+    handler = MsgpackStreamHandler(stream)
+    handler.setFormatter(MsgpackFormatter('test_project_name'))
+    for record in records:
+        handler.emit(record)
+    stream.seek(0)
+    return stream
+
+
+def test_MsgpackFormatter_round_trip():
+    record = logging.LogRecord('test_name', logging.INFO, 'test_pathname', 1, 'test %s', ('message',), None,
+                               func='test_function')
+    stream = _write_records([record, record])
+
+    decoded = list(iter_msgpack_records(stream))
+
+    assert len(decoded) == 2
+    assert decoded[0] == {
+        'severity': 'INFO',
+        'message': 'test_name - test message',
+        'time': record.created,
+        'sourceLocation': {'file': 'test_pathname', 'line': 1, 'function': 'test_function'}
+    }
+
+
+def test_MsgpackFormatter_span_values():
+    record = logging.LogRecord('test_name', logging.INFO, 'test_pathname', 1, 'test_message', (), None)
+    formatter = MsgpackFormatter('test_project_name')
+    formatter.tracer = MagicMock()
+    formatter.tracer.find_current_span.return_value = {
+        'log_fields': {'local': {'trace': 'test_trace_id', 'spanId': 'test_span_id'}}
+    }
+    stream = io.BytesIO(formatter.format(record))
+
+    decoded, = iter_msgpack_records(stream)
+
+    assert decoded['trace'] == 'test_trace_id'
+    assert decoded['spanId'] == 'test_span_id'
+
+
+def test_to_json_log_record_local():
+    json_log_record = to_json_log_record(test_msgpack_log_record, Formatters.local)
+
+    assert json_log_record['time'] == test_msgpack_log_record_time
+    assert json_log_record['trace'] == 'test_trace_id'
+    assert json_log_record['sourceLocation'] == test_msgpack_log_record['sourceLocation']
+
+
+def test_to_json_log_record_stackdriver():
+    json_log_record = to_json_log_record(test_msgpack_log_record, Formatters.stackdriver, 'test_project_name')
+
+    assert json_log_record == {
+        'severity': 'INFO',
+        'message': 'test_name - test_message',
+        'time': test_msgpack_log_record_time,
+        'logging.googleapis.com/sourceLocation': {'file': 'test_pathname', 'line': 1, 'function': 'test_function'},
+        'logging.googleapis.com/trace': 'projects/test_project_name/traces/test_trace_id',
+        'logging.googleapis.com/spanId': 'test_span_id'
+    }
+
+
+def test_convert_msgpack_stream():
+    record = logging.LogRecord('test_name', logging.INFO, 'test_pathname', 1, 'test_message', (), None)
+    in_stream = _write_records([record])
+    out_stream = io.StringIO()
+
+    convert_msgpack_stream(in_stream, out_stream, Formatters.local)
+
+    assert json.loads(out_stream.getvalue())['message'] == 'test_name - test_message'
+
+
+def test_JsonLoggerFactory_msgpack():
+    json_logger_factory = JSONLoggerFactory('test_project_name', 'test_service_name', Formatters.msgpack)
+
+    logger = json_logger_factory.get_logger()
+    assert isinstance(logger.root.handlers[0], MsgpackStreamHandler)
+    assert isinstance(logger.root.handlers[0].formatter, MsgpackFormatter)
@@ -0,0 +1,153 @@
+import asyncio
+from unittest.mock import MagicMock, ANY, call
+
+import pytest
+
+from logtracer.tracing import ASGITracingMiddleware
+
+SCOPE = {
+    'type': 'http',
+    'method': 'GET',
+    'scheme': 'http',
+    'path': '/test_path',
+    'query_string': b'test=1',
+    'headers': [
+        (b'host', b'localhost'),
+        (b'x-b3-traceid', b'test_trace_id'),
+        (b'x-b3-spanid', b'test_span_id'),
+        (b'x-cloud-trace-context', b'test_trace_context'),
+        (b'x-debug', b'true'),
+        (b'other', b'test_other')
+    ]
+}
+
+
+def _tracer():
+    m_tracer = MagicMock()
+    m_tracer.debug_logging_header = None
+    m_tracer.memory.current_span_id = 'test_span_id'
+    return m_tracer
+
+
+def _call(middleware, scope=SCOPE):
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request'}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(middleware(scope, receive, send))
+    return sent
+
+
+def _app(status, bodies):
+    async def app(scope, receive, send):
+        await send({'type': 'http.response.start', 'status': status, 'headers': []})
+        for body in bodies[:-1]:
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': bodies[-1]})
+
+    return app
+
+
+def test_ASGITracingMiddleware():
+    m_tracer = _tracer()
+    middleware = ASGITracingMiddleware(_app(200, [b'test_body1', b'test_body2']), m_tracer)
+
+    sent = _call(middleware)
+
+    m_tracer.enable_context_local_spans.assert_called_once()
+    assert [message.get('body') for message in sent] == [None, b'test_body1', b'test_body2']
+    m_tracer.start_traced_span.assert_called_with({
+        'X-B3-TraceId': 'test_trace_id',
+        'X-B3-SpanId': 'test_span_id',
+        'X-Cloud-Trace-Context': 'test_trace_context'
+    }, '/test_path')
+    assert m_tracer.logger.info.call_args_list == [
+        call('%s - %s', 'GET', 'http://localhost/test_path?test=1'),
+        call('%s - %s (%.1f ms)', 200, 'http://localhost/test_path?test=1', ANY)
+    ]
+    m_tracer.end_traced_span.assert_called_once_with(False)
+
+
+def test_ASGITracingMiddleware_ends_span_on_final_body():
+    m_tracer = _tracer()
+
+    async def app(scope, receive, send):
+        await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b'test_body', 'more_body': True})
+        assert not m_tracer.end_traced_span.called
+        await send({'type': 'http.response.body', 'body': b''})
+        m_tracer.end_traced_span.assert_called_once_with(True)
+        m_tracer.memory.current_span_id = None
+
+    _call(ASGITracingMiddleware(app, m_tracer, exclude_from_posting=True))
+
+    m_tracer.end_traced_span.assert_called_once_with(True)
+
+
+def test_ASGITracingMiddleware_final_body_sent_from_another_task():
+    m_tracer = _tracer()
+
+    async def app(scope, receive, send):
+        await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+        m_tracer.memory.current_span_id = None
+        await asyncio.create_task(send({'type': 'http.response.body', 'body': b'test_body'}))
+
+    _call(ASGITracingMiddleware(app, m_tracer))
+
+    end_calls = [name for name, _, _ in m_tracer.mock_calls if name in ('set_current_span', 'logger.info')]
+    assert end_calls[-2:] == ['set_current_span', 'logger.info']
+    m_tracer.set_current_span.assert_called_once_with('test_span_id')
+    m_tracer.end_traced_span.assert_called_once_with(False)
+
+
+def test_ASGITracingMiddleware_debug_logging_header():
+    m_tracer = _tracer()
+    m_tracer.debug_logging_header = 'X-Debug'
+
+    _call(ASGITracingMiddleware(_app(200, [b'']), m_tracer))
+
+    assert m_tracer.start_traced_span.call_args[0][0]['X-Debug'] == 'true'
+
+
+def test_ASGITracingMiddleware_error_status():
+    m_tracer = _tracer()
+
+    _call(ASGITracingMiddleware(_app(500, [b'']), m_tracer))
+
+    m_tracer.logger.error.assert_called_with('%s - %s (%.1f ms)', 500, 'http://localhost/test_path?test=1', ANY)
+    m_tracer.end_traced_span.assert_called_once_with(False)
+
+
+def test_ASGITracingMiddleware_app_exception():
+    class TestException(Exception):
+        pass
+
+    async def app(scope, receive, send):
+        raise m_exception
+
+    m_tracer = _tracer()
+    m_exception = TestException()
+
+    with pytest.raises(TestException):
+        _call(ASGITracingMiddleware(app, m_tracer))
+
+    m_tracer.logger.exception.assert_called_with(m_exception)
+    m_tracer.logger.error.assert_called_with('%s - %s (%.1f ms)', None, 'http://localhost/test_path?test=1', ANY)
+    m_tracer.end_traced_span.assert_called_once_with(False)
+
+
+def test_ASGITracingMiddleware_not_http():
+    m_tracer = _tracer()
+    m_app = MagicMock()
+
+    async def app(scope, receive, send):
+        m_app(scope)
+
+    _call(ASGITracingMiddleware(app, m_tracer), {'type': 'lifespan'})
+
+    m_app.assert_called_with({'type': 'lifespan'})
+    assert not m_tracer.start_traced_span.called
@@ -0,0 +1,103 @@
+import logging
+from unittest.mock import MagicMock, patch
+
+from logtracer.tracing.log_buffer import SpanLogBuffer, SpanLogBufferFilter, is_sampled
+
+MODULE_PATH = 'logtracer.tracing.log_buffer.'
+
+
+def _record(level, msg='test %s', args=('message',)):
+    return logging.LogRecord('test_name', level, 'test_pathname', 1, msg, args, None)
+
+
+def test_SpanLogBuffer_append():
+    log_buffer = SpanLogBuffer('test_span_id', max_records=2)
+    record = _record(logging.INFO)
+
+    log_buffer.append(record, 'test_log_fields')
+
+    assert list(log_buffer.records) == [record]
+    assert record.msg == 'test message'
+    assert record.args is None
+    assert record.span_log_fields == 'test_log_fields'
+
+
+def test_SpanLogBuffer_append_full():
+    log_buffer = SpanLogBuffer('test_span_id', max_records=2)
+    records = [_record(logging.INFO) for _ in range(3)]
+
+    for record in records:
+        log_buffer.append(record, 'test_log_fields')
+
+    assert list(log_buffer.records) == records[1:]
+    assert log_buffer.dropped_count == 1
+
+
+def test_SpanLogBuffer_flush():
+    log_buffer = SpanLogBuffer('test_span_id')
+    record = _record(logging.INFO)
+    log_buffer.append(record, 'test_log_fields')
+    m_handler = MagicMock()
+
+    log_buffer.flush(m_handler)
+
+    m_handler.handle.assert_called_once_with(record)
+    assert not log_buffer.records
+    assert not log_buffer.active
+
+
+def test_SpanLogBuffer_discard():
+    log_buffer = SpanLogBuffer('test_span_id')
+    log_buffer.append(_record(logging.INFO), 'test_log_fields')
+    log_buffer.append(_record(logging.INFO), 'test_log_fields')
+    log_buffer.append(_record(logging.DEBUG), 'test_log_fields')
+
+    summary = log_buffer.discard()
+
+    assert summary == {'INFO': 2, 'DEBUG': 1}
+    assert not log_buffer.records
+    assert not log_buffer.active
+
+
+def test_SpanLogBuffer_sampled():
+    assert not SpanLogBuffer('test_span_id', sampled=True).active
+
+
+def test_SpanLogBufferFilter_no_span():
+    m_tracer = MagicMock()
+    m_tracer.find_current_span.return_value = None
+    log_filter = SpanLogBufferFilter(m_tracer, MagicMock(), logging.ERROR)
+
+    assert log_filter.filter(_record(logging.INFO))
+
+
+def test_SpanLogBufferFilter_buffers_record():
+    log_buffer = SpanLogBuffer('test_span_id')
+    m_tracer = MagicMock()
+    m_tracer.find_current_span.return_value = {'log_buffer': log_buffer, 'log_fields': 'test_log_fields'}
+    log_filter = SpanLogBufferFilter(m_tracer, MagicMock(), logging.ERROR)
+    record = _record(logging.INFO)
+
+    assert not log_filter.filter(record)
+    assert list(log_buffer.records) == [record]
+
+
+def test_SpanLogBufferFilter_flush_level():
+    log_buffer = SpanLogBuffer('test_span_id')
+    buffered_record = _record(logging.INFO)
+    log_buffer.append(buffered_record, 'test_log_fields')
+    m_tracer, m_handler = MagicMock(), MagicMock()
+    m_tracer.find_current_span.return_value = {'log_buffer': log_buffer, 'log_fields': 'test_log_fields'}
+    log_filter = SpanLogBufferFilter(m_tracer, m_handler, logging.ERROR)
+
+    assert log_filter.filter(_record(logging.ERROR))
+    m_handler.handle.assert_called_once_with(buffered_record)
+    assert log_filter.filter(_record(logging.INFO))
+
+
+@patch(MODULE_PATH + 'random')
+def test_is_sampled(m_random):
+    m_random.random.return_value = 0.3
+    assert is_sampled(0.5)
+    assert not is_sampled(0.2)
+    assert not is_sampled(0)
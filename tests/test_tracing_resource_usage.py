@@ -0,0 +1,78 @@
+import gc
+import tracemalloc
+from threading import Thread
+from unittest.mock import patch
+
+from logtracer.tracing.resource_usage import SpanResourceUsage, _GCPauseMonitor, format_resource_usage
+
+MODULE_PATH = 'logtracer.tracing.resource_usage.'
+
+
+def test_GCPauseMonitor():
+    monitor = _GCPauseMonitor()
+    with patch(MODULE_PATH + 'time.perf_counter_ns', side_effect=[100, 350, 1000, 1100]):
+        monitor._callback('start', {})
+        monitor._callback('stop', {})
+        monitor._callback('start', {})
+        monitor._callback('stop', {})
+
+    assert monitor.totals == (350, 2)
+
+
+def test_GCPauseMonitor_install():
+    monitor = _GCPauseMonitor()
+    try:
+        monitor.install()
+        monitor.install()
+        assert gc.callbacks.count(monitor._callback) == 1
+
+        gc.collect()
+        assert monitor.totals[1] >= 1
+    finally:
+        gc.callbacks.remove(monitor._callback)
+
+
+@patch(MODULE_PATH + 'gc_pause_monitor')
+def test_SpanResourceUsage_measure(m_gc_pause_monitor):
+    m_gc_pause_monitor.totals = (1000000, 1)
+    with patch(MODULE_PATH + 'time.thread_time_ns', return_value=2000000):
+        resource_usage = SpanResourceUsage()
+
+    m_gc_pause_monitor.totals = (3500000, 3)
+    with patch(MODULE_PATH + 'time.thread_time_ns', return_value=4500000):
+        attributes = resource_usage.measure()
+
+    assert attributes == {'resource.gc_pause_ms': 2.5, 'resource.gc_collections': 2, 'resource.cpu_ms': 2.5}
+
+
+def test_SpanResourceUsage_measure_other_thread():
+    resource_usage = SpanResourceUsage()
+    measured = []
+    thread = Thread(target=lambda: measured.append(resource_usage.measure()))
+    thread.start()
+    thread.join()
+
+    assert 'resource.cpu_ms' not in measured[0]
+
+
+def test_SpanResourceUsage_measure_allocations():
+    assert SpanResourceUsage(trace_allocations=True).traced_memory is None
+
+    tracemalloc.start()
+    try:
+        resource_usage = SpanResourceUsage(trace_allocations=True)
+        allocated = [bytearray(100000)]
+        attributes = resource_usage.measure()
+    finally:
+        tracemalloc.stop()
+
+    assert attributes['resource.allocated_bytes'] >= 100000
+    assert allocated
+
+
+def test_format_resource_usage():
+    assert format_resource_usage({'resource.gc_pause_ms': 0.25, 'resource.gc_collections': 1}) == \
+        ' - gc 0.2 ms (1 collections)'
+    assert format_resource_usage({'resource.cpu_ms': 12.345, 'resource.gc_pause_ms': 0, 'resource.gc_collections': 0,
+                                  'resource.allocated_bytes': 2048}) == \
+        ' - cpu 12.3 ms, gc 0.0 ms (0 collections), allocated 2048 bytes'
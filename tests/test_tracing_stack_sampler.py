@@ -0,0 +1,77 @@
+import sys
+from collections import Counter
+from threading import get_ident
+from unittest.mock import MagicMock, patch
+
+from logtracer.tracing.stack_sampler import SlowSpanSampler, collapse_stack, format_collapsed_stacks
+
+MODULE_PATH = 'logtracer.tracing.stack_sampler.'
+
+
+def _frame(module, function, f_back=None):
+    return MagicMock(f_globals={'__name__': module}, f_code=MagicMock(co_name=function), f_back=f_back)
+
+
+@patch(MODULE_PATH + 'Thread')
+def test_SlowSpanSampler_watch(m_thread):
+    sampler = SlowSpanSampler(2)
+
+    with patch(MODULE_PATH + 'time.monotonic', return_value=10):
+        sampler.watch('test_span_id', 'test_thread_id')
+        sampler.watch('test_other_span_id', 'test_thread_id')
+
+    watched_span = sampler._watched['test_span_id']
+    assert (watched_span.thread_id, watched_span.due) == ('test_thread_id', 12)
+    m_thread.return_value.start.assert_called_once()
+    assert sampler._wakeup.is_set()
+
+
+@patch(MODULE_PATH + 'Thread', MagicMock())
+def test_SlowSpanSampler_sample():
+    sampler = SlowSpanSampler(2, interval_seconds=0.5)
+    assert sampler.sample(now=0) is None
+
+    with patch(MODULE_PATH + 'time.monotonic', return_value=0):
+        sampler.watch('test_span_id', get_ident())
+    assert sampler.sample(now=1) == 1
+    assert sampler.unwatch('test_span_id') is None
+
+    with patch(MODULE_PATH + 'time.monotonic', return_value=0):
+        sampler.watch('test_span_id', get_ident())
+    assert sampler.sample(now=2) == 0.5
+    assert sampler._watched['test_span_id'].due == 2.5
+    assert sampler.sample(now=2.5) == 0.5
+
+    stacks = sampler.unwatch('test_span_id')
+    assert sum(stacks.values()) == 2
+    sampled_frames = f'{__name__}:test_SlowSpanSampler_sample;logtracer.tracing.stack_sampler:sample'
+    assert all(stack.endswith(sampled_frames) for stack in stacks)
+    assert sampler.unwatch('test_span_id') is None
+
+
+@patch(MODULE_PATH + 'sys._current_frames', MagicMock(return_value={}))
+@patch(MODULE_PATH + 'Thread', MagicMock())
+def test_SlowSpanSampler_sample_thread_ended():
+    sampler = SlowSpanSampler(0)
+    sampler.watch('test_span_id', 'test_thread_id')
+
+    assert sampler.sample() == sampler.interval_seconds
+    assert sampler.unwatch('test_span_id') is None
+
+
+def test_collapse_stack():
+    frame = _frame('test_module', 'inner', _frame('test_module', 'middle', _frame('test_main', 'outer')))
+
+    assert collapse_stack(frame) == 'test_main:outer;test_module:middle;test_module:inner'
+    assert collapse_stack(frame, max_depth=2) == 'test_module:middle;test_module:inner'
+
+
+def test_collapse_stack_real_frame():
+    assert collapse_stack(sys._getframe()).endswith(f'{__name__}:test_collapse_stack_real_frame')
+
+
+def test_format_collapsed_stacks():
+    stacks = Counter({'a:f': 1, 'a:f;a:g': 3, 'a:h': 2})
+
+    assert format_collapsed_stacks(stacks) == 'a:f;a:g 3\na:h 2\na:f 1'
+    assert format_collapsed_stacks(stacks, max_stacks=1) == 'a:f;a:g 3'
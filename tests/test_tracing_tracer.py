@@ -1,7 +1,10 @@
+import asyncio
+import logging
 import time
+from collections import Counter
 from random import randint
 from threading import Thread
-from unittest.mock import MagicMock, patch
+from unittest.mock import MagicMock, call, patch
 
 import pytest
 from google.auth.exceptions import DefaultCredentialsError
@@ -11,7 +14,9 @@ from pytest import fixture
 from logtracer.exceptions import StackDriverAuthError, SpanNotStartedError
 from logtracer.requests_wrapper import RequestsWrapper
 from logtracer.tracing._utils import post_span
-from logtracer.tracing.tracer import Tracer
+from logtracer.tracing.log_buffer import SpanLogBuffer, SpanLogBufferFilter
+from logtracer.tracing.stack_sampler import SlowSpanSampler
+from logtracer.tracing.tracer import Tracer, _generate_span_log_fields
 
 TEST_32_CHAR_TRACE_ID = "00000000000000000000000000000000"
 TEST_16_CHAR_SPAN_ID = "0000000000000000"
@@ -69,15 +74,30 @@ def test_tracer_verify_gcp_credentials_false():
 def test_tracer_verify_gcp_credentials_true_success():
     m_tracer = MagicMock()
     m_tracer._post_spans_to_stackdriver_api = True
+    m_tracer._trace_api_endpoint = None
     Tracer._verify_gcp_credentials(m_tracer)
 
     assert m_tracer.stackdriver_trace_client == 'test_trace_service_client'
 
 
+@patch(MODULE_PATH + '_create_insecure_trace_client', return_value='test_insecure_trace_client')
+@patch(MODULE_PATH + 'TraceServiceClient')
+def test_tracer_verify_gcp_credentials_trace_api_endpoint(m_trace_service_client, m_create_insecure_trace_client):
+    m_tracer = MagicMock()
+    m_tracer._post_spans_to_stackdriver_api = True
+    m_tracer._trace_api_endpoint = 'localhost:1234'
+    Tracer._verify_gcp_credentials(m_tracer)
+
+    m_create_insecure_trace_client.assert_called_with('localhost:1234')
+    assert m_tracer.stackdriver_trace_client == 'test_insecure_trace_client'
+    assert not m_trace_service_client.called
+
+
 @patch(MODULE_PATH + 'TraceServiceClient', MagicMock(side_effect=DefaultCredentialsError))
 def test_tracer_verify_gcp_credentials_true_fail():
     m_tracer = MagicMock()
     m_tracer._post_spans_to_stackdriver_api = True
+    m_tracer._trace_api_endpoint = None
     with pytest.raises(StackDriverAuthError):
         Tracer._verify_gcp_credentials(m_tracer)
 
@@ -107,7 +127,8 @@ def test_tracer_start_traced_span_with_headers(tracer):
             "start_timestamp": 'test_timestamp',
             "display_name": 'test_service_name:test_span_name',
             "child_span_count": 0,
-            "values": test_span_headers
+            "values": test_span_headers,
+            "log_fields": _generate_span_log_fields('test_project_name', 'test_trace_id', 'test_span_id')
         }
     }
     assert tracer._spans == expected_spans
@@ -138,7 +159,8 @@ def test_tracer_start_traced_span_with_gcp_loadbalancer_headers(tracer):
                 'X-B3-Flags': None,
                 'X-B3-ParentSpanId': None,
                 'X-B3-Sampled': None
-            }
+            },
+            "log_fields": _generate_span_log_fields('test_project_name', TEST_32_CHAR_TRACE_ID, TEST_16_CHAR_SPAN_ID)
         }
     }
     assert tracer._spans == expected_spans
@@ -165,7 +187,9 @@ def test_tracer_start_traced_span_without_headers(tracer):
                 'X-B3-Sampled': None,
                 'X-B3-SpanId': 'test_generated_id_16',
                 'X-B3-TraceId': 'test_generated_id_32'
-            }
+            },
+            "log_fields": _generate_span_log_fields('test_project_name', 'test_generated_id_32',
+                                                    'test_generated_id_16')
         }
     }
     assert tracer._spans == expected_spans
@@ -183,6 +207,45 @@ def test_tracer_current_span(tracer):
     assert current == 'test_span'
 
 
+def test_tracer_find_current_span(tracer):
+    tracer.memory.current_span_id = 'test_span_id'
+    tracer._spans = {
+        'test_span_id': 'test_span'
+    }
+
+    assert tracer.find_current_span() == 'test_span'
+
+
+def test_tracer_find_current_span_none(tracer):
+    tracer.memory.current_span_id = None
+    tracer._spans = {
+        'non_matching_span': 'test_span'
+    }
+
+    assert tracer.find_current_span() is None
+
+
+def test_tracer_set_current_span(tracer):
+    tracer._spans = {'test_span_id': 'test_span'}
+
+    tracer.set_current_span('test_span_id')
+
+    assert tracer.memory.current_span_id == 'test_span_id'
+    assert tracer.find_current_span() == 'test_span'
+
+
+def test_generate_span_log_fields():
+    log_fields = _generate_span_log_fields('test_project_name', 'test_trace_id', 'test_span_id')
+
+    assert log_fields == {
+        'local': {'trace': 'test_trace_id', 'spanId': 'test_span_id'},
+        'stackdriver': {
+            'logging.googleapis.com/trace': 'projects/test_project_name/traces/test_trace_id',
+            'logging.googleapis.com/spanId': 'test_span_id'
+        }
+    }
+
+
 def test_tracer_current_span_fail(tracer):
     tracer.memory.current_span_id = 'test_span_id'
     tracer._spans = {
@@ -244,8 +307,7 @@ def test_tracer_end_traced_span_do_post(m_thread, tracer):
 
     tracer.end_traced_span(exclude_from_posting=False)
 
-    tracer.logger.debug.assert_called_with(
-        "Closing span test_span_id")
+    tracer.logger.debug.assert_called_with('Closing span %s', 'test_span_id')
     tracer.stackdriver_trace_client.span_path.assert_called_with('test_project_name', 'test_trace_id', 'test_span_id')
 
     expected_span_info = {
@@ -262,6 +324,22 @@ def test_tracer_end_traced_span_do_post(m_thread, tracer):
     assert tracer._delete_current_span.called
 
 
+@patch(CLASS_PATH + 'current_span', dict(test_span_info, truncated_display_name='test_display'))
+@patch(MODULE_PATH + 'get_timestamp', MagicMock(return_value='test_timestamp'))
+@patch(MODULE_PATH + 'truncate_str')
+@patch(MODULE_PATH + 'Thread')
+def test_tracer_end_traced_span_truncated_display_name(m_thread, m_truncate_str, tracer):
+    tracer.memory.current_span_id = 'test_span_id'
+    tracer._post_spans_to_stackdriver_api = True
+    tracer.stackdriver_trace_client = MagicMock()
+    tracer._delete_current_span = MagicMock()
+
+    tracer.end_traced_span(exclude_from_posting=False)
+
+    assert m_thread.call_args[1]['args'][1]['display_name'] == {'value': 'test_display', 'truncated_byte_count': 5}
+    assert not m_truncate_str.called
+
+
 @patch(CLASS_PATH + 'current_span', test_span_info)
 @patch(MODULE_PATH + 'get_timestamp', MagicMock(return_value='test_timestamp'))
 @patch(MODULE_PATH + 'truncate_str', MagicMock(return_value='test_truncated_str'))
@@ -274,19 +352,42 @@ def test_tracer_end_traced_span_dont_post(m_thread, tracer):
 
     tracer.end_traced_span(exclude_from_posting=False)
 
-    tracer.logger.debug.assert_called_with("Closing span test_span_id")
+    tracer.logger.debug.assert_called_with('Closing span %s', 'test_span_id')
     assert not tracer.stackdriver_trace_client.called
     assert not m_thread.called
     assert tracer._delete_current_span.called
 
 
+@patch(CLASS_PATH + 'current_span', dict(test_span_info, attributes={'test_attribute': 1}))
+@patch(MODULE_PATH + 'get_timestamp', MagicMock(return_value='test_timestamp'))
+@patch(MODULE_PATH + 'Thread')
+def test_tracer_end_traced_span_post_attributes(m_thread, tracer):
+    tracer._post_spans_to_stackdriver_api = True
+    tracer.stackdriver_trace_client = MagicMock()
+    tracer._delete_current_span = MagicMock()
+
+    tracer.end_traced_span(exclude_from_posting=False)
+
+    span_info = m_thread.call_args[1]['args'][1]
+    assert span_info['attributes'] == {'attribute_map': {'test_attribute': {'int_value': 1}}}
+
+
+def test_tracer_set_span_attribute(tracer):
+    tracer.memory.current_span_id = 'test_span_id'
+    tracer._spans = {'test_span_id': {}}
+
+    tracer.set_span_attribute('test_key', 'test_value')
+
+    assert tracer._spans['test_span_id']['attributes'] == {'test_key': 'test_value'}
+
+
 def test_tracer_delete_current_span(tracer):
     tracer.memory.current_span_id = 'test_current_span_id'
     tracer._spans = {'test_current_span_id': 'test_span'}
 
     tracer._delete_current_span()
 
-    tracer.logger.debug.assert_called_with('Deleting span test_current_span_id')
+    tracer.logger.debug.assert_called_with('Deleting span %s', 'test_current_span_id')
     assert tracer._spans == {}
     assert tracer.memory.current_span_id is None
 
@@ -336,6 +437,56 @@ def test_tracer_memory():
     assert tracer.memory.current_span_id is None
 
 
+@patch(CLASS_PATH + '_add_tracer_to_logger_formatter', MagicMock())
+@patch(CLASS_PATH + '_verify_gcp_credentials', MagicMock())
+def test_tracer_context_local_memory():
+    m_json_logger_factory = MagicMock(name='json_logger_factory')
+    m_json_logger_factory.project_name = 'test_project_name'
+    m_json_logger_factory.service_name = 'test_service_name'
+    tracer = Tracer(m_json_logger_factory)
+    tracer.enable_context_local_spans()
+
+    assert tracer.memory.current_span_id is None
+    assert tracer.memory.parent_spans == []
+
+    async def test_task_memory(span_id):
+        assert tracer.memory.current_span_id is None
+        tracer.memory.current_span_id = span_id
+        tracer.memory.parent_spans = tracer.memory.parent_spans + [f'{span_id}_parent']
+        await asyncio.sleep(0.01)
+        return tracer.memory.current_span_id, tracer.memory.parent_spans
+
+    async def run_tasks():
+        return await asyncio.gather(*[test_task_memory(f'test{i}') for i in range(5)])
+
+    results = asyncio.run(run_tasks())
+
+    assert results == [(f'test{i}', [f'test{i}_parent']) for i in range(5)]
+    assert tracer.memory.current_span_id is None
+
+
+@patch(CLASS_PATH + '_add_tracer_to_logger_formatter', MagicMock())
+@patch(CLASS_PATH + '_verify_gcp_credentials', MagicMock())
+def test_tracer_enable_context_local_spans_idempotent():
+    m_json_logger_factory = MagicMock(name='json_logger_factory')
+    tracer = Tracer(m_json_logger_factory)
+    tracer.enable_context_local_spans()
+    memory = tracer.memory
+
+    async def enable_in_span():
+        tracer.start_traced_span({}, 'test_span_name')
+        tracer.enable_context_local_spans()
+        span_id = tracer.memory.current_span_id
+        tracer.end_traced_span()
+        return span_id
+
+    span_id = asyncio.run(enable_in_span())
+
+    assert tracer.memory is memory
+    assert span_id is not None
+    assert tracer._spans == {}
+
+
 @pytest.mark.parametrize('google_headers,expected_headers', [
     ({"X-Cloud-Trace-Context": f"{TEST_32_CHAR_TRACE_ID}/{TEST_16_CHAR_SPAN_ID};options"},
      {
@@ -360,3 +511,247 @@ def test_tracer_memory():
 def test_tracer_extract_google_trace_headers_if_present(tracer, google_headers, expected_headers):
     processed_headers = tracer._extract_google_trace_headers_if_present(google_headers)
     assert processed_headers == expected_headers
+
+
+def test_tracer_enable_span_log_buffering(tracer):
+    tracer._log_handler = MagicMock()
+
+    tracer.enable_span_log_buffering(max_records=10, flush_level='WARNING', slow_span_seconds=2, sample_rate=0.1)
+
+    log_filter = tracer._log_handler.addFilter.call_args[0][0]
+    assert isinstance(log_filter, SpanLogBufferFilter)
+    assert log_filter.flush_level == logging.WARNING
+    assert tracer._span_log_buffering == {'max_records': 10, 'slow_span_seconds': 2, 'sample_rate': 0.1}
+
+
+@pytest.mark.parametrize('flush_level', [logging.ERROR, 'ERROR'])
+def test_tracer_enable_span_log_buffering_flush_level(tracer, flush_level):
+    tracer._log_handler = MagicMock()
+    tracer._log_handler.filters = []
+
+    tracer.enable_span_log_buffering(flush_level=flush_level)
+    log_filter = tracer._log_handler.addFilter.call_args[0][0]
+    assert log_filter.flush_level == logging.ERROR
+
+    tracer._log_handler.filters = [log_filter]
+    tracer.enable_span_log_buffering(flush_level=logging.WARNING)
+    assert log_filter.flush_level == logging.WARNING
+
+
+def test_tracer_enable_span_log_buffering_unknown_flush_level(tracer):
+    tracer._log_handler = MagicMock()
+
+    with pytest.raises(ValueError):
+        tracer.enable_span_log_buffering(flush_level='NOT_A_LEVEL')
+
+
+@patch(MODULE_PATH + 'generate_identifier', lambda n: f'test_generated_id_{n}')
+@patch(MODULE_PATH + 'get_timestamp', MagicMock(return_value='test_timestamp'))
+def test_tracer_start_traced_span_log_buffer(tracer):
+    tracer._span_log_buffering = {'max_records': 10, 'slow_span_seconds': None, 'sample_rate': 0}
+    tracer.memory.parent_spans = []
+
+    tracer.start_traced_span(test_span_headers, 'test_span_name')
+    log_buffer = tracer._spans['test_span_id']['log_buffer']
+    assert isinstance(log_buffer, SpanLogBuffer)
+    assert log_buffer.owner_span_id == 'test_span_id'
+    assert log_buffer.active
+
+    tracer.memory.parent_spans = ['test_span_id']
+    tracer.start_traced_span({}, 'test_subspan_name')
+    assert tracer._spans['test_generated_id_16']['log_buffer'] is log_buffer
+
+
+def test_tracer_resolve_span_log_buffer_discard(tracer):
+    log_buffer = SpanLogBuffer('test_span_id')
+    log_buffer.append(logging.LogRecord('test', logging.INFO, '', 1, 'test', (), None), 'test_log_fields')
+    tracer.memory.current_span_id = 'test_span_id'
+    tracer._spans = {'test_span_id': {'log_buffer': log_buffer}}
+    tracer._span_log_buffering = {'max_records': 10, 'slow_span_seconds': 60, 'sample_rate': 0}
+    tracer._log_handler = MagicMock()
+
+    tracer._resolve_span_log_buffer()
+
+    assert not tracer._log_handler.handle.called
+    tracer.logger.info.assert_called_with('Discarded %s buffered log records %s', 1, {'INFO': 1})
+
+
+def test_tracer_resolve_span_log_buffer_discard_dropped(tracer):
+    log_buffer = SpanLogBuffer('test_span_id', max_records=1)
+    for _ in range(3):
+        log_buffer.append(logging.LogRecord('test', logging.INFO, '', 1, 'test', (), None), 'test_log_fields')
+    tracer.memory.current_span_id = 'test_span_id'
+    tracer._spans = {'test_span_id': {'log_buffer': log_buffer}}
+    tracer._span_log_buffering = {'max_records': 1, 'slow_span_seconds': None, 'sample_rate': 0}
+    tracer._log_handler = MagicMock()
+
+    tracer._resolve_span_log_buffer()
+
+    assert tracer.logger.info.call_args_list == [
+        call('Discarded %s buffered log records %s', 1, {'INFO': 1}),
+        call('Dropped %s log records from full span log buffer', 2)
+    ]
+
+
+def test_tracer_resolve_span_log_buffer_slow(tracer):
+    log_buffer = SpanLogBuffer('test_span_id')
+    record = logging.LogRecord('test', logging.INFO, '', 1, 'test', (), None)
+    log_buffer.append(record, 'test_log_fields')
+    tracer.memory.current_span_id = 'test_span_id'
+    tracer._spans = {'test_span_id': {'log_buffer': log_buffer}}
+    tracer._span_log_buffering = {'max_records': 10, 'slow_span_seconds': 0, 'sample_rate': 0}
+    tracer._log_handler = MagicMock()
+
+    tracer._resolve_span_log_buffer()
+
+    tracer._log_handler.handle.assert_called_with(record)
+
+
+def test_tracer_resolve_span_log_buffer_subspan(tracer):
+    log_buffer = SpanLogBuffer('test_parent_span_id')
+    log_buffer.append(logging.LogRecord('test', logging.INFO, '', 1, 'test', (), None), 'test_log_fields')
+    tracer.memory.current_span_id = 'test_span_id'
+    tracer._spans = {'test_span_id': {'log_buffer': log_buffer}}
+    tracer._span_log_buffering = {'max_records': 10, 'slow_span_seconds': None, 'sample_rate': 0}
+
+    tracer._resolve_span_log_buffer()
+
+    assert log_buffer.active
+    assert len(log_buffer.records) == 1
+
+
+@pytest.mark.parametrize('header_value,expected_debug_logging', [('1', True), ('true', True), ('0', False)])
+@patch(MODULE_PATH + 'get_timestamp', MagicMock(return_value='test_timestamp'))
+def test_tracer_start_traced_span_debug_logging(tracer, header_value, expected_debug_logging):
+    tracer.enable_trace_debug_logging('X-Debug-Logging')
+
+    tracer.start_traced_span(dict(test_span_headers, **{'X-Debug-Logging': header_value}), 'test_span_name')
+
+    span = tracer._spans['test_span_id']
+    assert span.get('debug_logging', False) == expected_debug_logging
+    assert (span['values']['X-B3-Flags'] == '1') == expected_debug_logging
+
+
+def test_tracer_debug_logging_header(tracer):
+    assert tracer.debug_logging_header is None
+
+    tracer.enable_trace_debug_logging('X-Debug-Logging')
+
+    assert tracer.debug_logging_header == 'X-Debug-Logging'
+    with pytest.raises(AttributeError):
+        tracer.debug_logging_header = 'X-Other'
+
+
+def test_tracer_is_debug_logging_span(tracer):
+    tracer.memory.current_span_id = 'test_span_id'
+    tracer._spans = {'test_span_id': {'debug_logging': True}}
+    assert not tracer.is_debug_logging_span()
+
+    tracer.enable_trace_debug_logging()
+    assert tracer.is_debug_logging_span()
+
+    tracer._spans = {'test_span_id': {}}
+    assert not tracer.is_debug_logging_span()
+
+
+def test_tracer_enable_slow_span_sampling(tracer):
+    tracer.enable_slow_span_sampling(2, interval_seconds=0.1, max_stack_depth=10, max_stacks=5)
+
+    sampler = tracer._slow_span_sampler
+    assert isinstance(sampler, SlowSpanSampler)
+    assert (sampler.slow_span_seconds, sampler.interval_seconds, sampler.max_stack_depth, sampler.max_stacks) == \
+        (2, 0.1, 10, 5)
+
+
+@patch(MODULE_PATH + 'generate_identifier', lambda n: f'test_generated_id_{n}')
+@patch(MODULE_PATH + 'get_timestamp', MagicMock(return_value='test_timestamp'))
+@patch(MODULE_PATH + 'get_ident', MagicMock(return_value='test_thread_id'))
+def test_tracer_start_traced_span_slow_span_sampling(tracer):
+    tracer._slow_span_sampler = MagicMock()
+    tracer.memory.parent_spans = []
+
+    tracer.start_traced_span(test_span_headers, 'test_span_name')
+    tracer._slow_span_sampler.watch.assert_called_once_with('test_span_id', 'test_thread_id')
+
+    tracer.memory.parent_spans = ['test_span_id']
+    tracer.start_traced_span({}, 'test_subspan_name')
+    tracer._slow_span_sampler.watch.assert_called_once()
+
+
+def test_tracer_report_span_stack_samples(tracer):
+    tracer.memory.current_span_id = 'test_span_id'
+    tracer._spans = {'test_span_id': {}}
+    tracer._slow_span_sampler = SlowSpanSampler(1, interval_seconds=0.01)
+    tracer._slow_span_sampler._watched['test_span_id'] = MagicMock(stacks=Counter({'a:f;a:g': 3, 'a:f': 1}))
+
+    tracer._report_span_stack_samples()
+
+    assert tracer._spans['test_span_id']['attributes'] == {'profile.sample_count': 4, 'profile.top_stack': 'a:f;a:g'}
+    tracer.logger.warning.assert_called_with('Slow span stack samples, %s samples every %s ms:\n%s', 4, 10.0,
+                                             'a:f;a:g 3\na:f 1')
+    assert 'test_span_id' not in tracer._slow_span_sampler._watched
+
+
+def test_tracer_report_span_stack_samples_not_sampled(tracer):
+    tracer.memory.current_span_id = 'test_span_id'
+    tracer._spans = {'test_span_id': {}}
+    tracer._slow_span_sampler = SlowSpanSampler(1)
+    tracer._slow_span_sampler._watched['test_span_id'] = MagicMock(stacks=Counter())
+
+    tracer._report_span_stack_samples()
+
+    assert 'attributes' not in tracer._spans['test_span_id']
+    assert not tracer.logger.warning.called
+
+
+@patch(MODULE_PATH + 'tracemalloc')
+@patch(MODULE_PATH + 'gc_pause_monitor')
+def test_tracer_enable_span_resource_usage(m_gc_pause_monitor, m_tracemalloc, tracer):
+    m_tracemalloc.is_tracing.return_value = False
+
+    tracer.enable_span_resource_usage()
+    m_gc_pause_monitor.install.assert_called_once()
+    assert not m_tracemalloc.start.called
+    assert tracer._span_resource_usage == {'trace_allocations': False}
+
+    tracer.enable_span_resource_usage(trace_allocations=True)
+    m_tracemalloc.start.assert_called_once()
+    assert tracer._span_resource_usage == {'trace_allocations': True}
+
+
+@patch(MODULE_PATH + 'get_timestamp', MagicMock(return_value='test_timestamp'))
+@patch(MODULE_PATH + 'SpanResourceUsage')
+def test_tracer_start_traced_span_resource_usage(m_span_resource_usage, tracer):
+    tracer._span_resource_usage = {'trace_allocations': True}
+
+    tracer.start_traced_span(test_span_headers, 'test_span_name')
+
+    m_span_resource_usage.assert_called_with(True)
+    assert tracer._spans['test_span_id']['resource_usage'] == m_span_resource_usage.return_value
+
+
+def test_tracer_record_span_resource_usage(tracer):
+    m_resource_usage = MagicMock()
+    m_resource_usage.measure.return_value = {'resource.gc_pause_ms': 0.5, 'resource.gc_collections': 1}
+    tracer.memory.current_span_id = 'test_span_id'
+    tracer._spans = {'test_span_id': {'resource_usage': m_resource_usage, 'attributes': {'test_key': 'test_value'}}}
+
+    assert tracer.record_span_resource_usage() == ' - gc 0.5 ms (1 collections)'
+    assert tracer._spans['test_span_id'] == {'attributes': {
+        'test_key': 'test_value', 'resource.gc_pause_ms': 0.5, 'resource.gc_collections': 1
+    }}
+    assert tracer.record_span_resource_usage() == ''
+
+    tracer.memory.current_span_id = None
+    assert tracer.record_span_resource_usage() == ''
+
+
+def test_tracer_end_traced_span_resource_usage(tracer):
+    tracer.memory.current_span_id = 'test_span_id'
+    tracer._spans = {'test_span_id': {}}
+    tracer._span_resource_usage = {'trace_allocations': False}
+    tracer.record_span_resource_usage = MagicMock()
+
+    tracer.end_traced_span()
+
+    tracer.record_span_resource_usage.assert_called_once()
@@ -2,7 +2,7 @@ from unittest.mock import MagicMock, patch
 
 from google.protobuf.timestamp_pb2 import Timestamp
 
-from logtracer.tracing._utils import post_span, get_timestamp, to_seconds_and_nanos, truncate_str
+from logtracer.tracing._utils import post_span, get_timestamp, to_seconds_and_nanos, truncate_str, to_span_attributes
 
 MODULE_PATH = 'logtracer.tracing._utils.'
 
@@ -13,6 +13,16 @@ def test_post_span():
     m_trace_client.create_span.assert_called_with(info="test_span_info")
 
 
+def test_post_span_request():
+    class TraceClient:
+        def create_span(self, request=None, *, retry=None):
+            self.request = request
+
+    trace_client = TraceClient()
+    post_span(trace_client, {"info": "test_span_info"})
+    assert trace_client.request == {"info": "test_span_info"}
+
+
 @patch(MODULE_PATH + 'to_seconds_and_nanos')
 @patch(MODULE_PATH + 'time')
 def test_get_timestamp(m_time, m_to_secs_and_nanos):
@@ -40,3 +50,16 @@ def test_truncate_str():
     longstr = 'kindoflongstring'
     trunc_obj = truncate_str(longstr, limit=10)
     assert trunc_obj == {'value': 'kindoflong', 'truncated_byte_count': 6}
+
+
+def test_to_span_attributes():
+    attributes = to_span_attributes({'int': 1, 'bool': True, 'str': 'kindoflongstring', 'float': 1.5}, value_limit=10)
+
+    assert attributes == {
+        'attribute_map': {
+            'int': {'int_value': 1},
+            'bool': {'bool_value': True},
+            'str': {'string_value': {'value': 'kindoflong', 'truncated_byte_count': 6}},
+            'float': {'string_value': {'value': '1.5', 'truncated_byte_count': 0}},
+        }
+    }
@@ -0,0 +1,134 @@
+from unittest.mock import MagicMock, call
+
+import pytest
+
+from logtracer.tracing import WSGITracingMiddleware
+
+ENVIRON = {
+    'REQUEST_METHOD': 'GET',
+    'PATH_INFO': '/test_path',
+    'SERVER_NAME': 'localhost',
+    'SERVER_PORT': '80',
+    'wsgi.url_scheme': 'http',
+    'HTTP_X_B3_TRACEID': 'test_trace_id',
+    'HTTP_X_B3_SPANID': 'test_span_id',
+    'HTTP_X_CLOUD_TRACE_CONTEXT': 'test_trace_context',
+    'HTTP_X_DEBUG': 'true',
+    'HTTP_OTHER': 'test_other'
+}
+
+
+def _tracer():
+    m_tracer = MagicMock()
+    m_tracer.debug_logging_header = None
+    m_tracer.memory.current_span_id = 'test_span_id'
+    return m_tracer
+
+
+def _app(status, body):
+    def app(environ, start_response):
+        start_response(status, [('Content-Type', 'text/plain')])
+        return body
+
+    return app
+
+
+def test_WSGITracingMiddleware():
+    m_tracer = _tracer()
+    m_start_response = MagicMock()
+    middleware = WSGITracingMiddleware(_app('200 OK', [b'test_body']), m_tracer)
+
+    response = middleware(ENVIRON, m_start_response)
+
+    m_tracer.start_traced_span.assert_called_with({
+        'X-B3-TraceId': 'test_trace_id',
+        'X-B3-SpanId': 'test_span_id',
+        'X-Cloud-Trace-Context': 'test_trace_context'
+    }, '/test_path')
+    m_start_response.assert_called_with('200 OK', [('Content-Type', 'text/plain')], None)
+    assert m_tracer.logger.info.call_args_list == [
+        call('%s - %s', 'GET', 'http://localhost/test_path'),
+        call('%s - %s', '200 OK', 'http://localhost/test_path')
+    ]
+    assert not m_tracer.end_traced_span.called
+
+    assert list(response) == [b'test_body']
+    assert not m_tracer.end_traced_span.called
+    response.close()
+    response.close()
+
+    m_tracer.set_current_span.assert_called_with('test_span_id')
+    m_tracer.end_traced_span.assert_called_once_with(False)
+
+
+def test_WSGITracingMiddleware_debug_logging_header():
+    m_tracer = _tracer()
+    m_tracer.debug_logging_header = 'X-Debug'
+    middleware = WSGITracingMiddleware(_app('200 OK', []), m_tracer)
+
+    middleware(ENVIRON, MagicMock())
+
+    assert m_tracer.start_traced_span.call_args[0][0]['X-Debug'] == 'true'
+
+
+def test_WSGITracingMiddleware_error_status():
+    m_tracer = _tracer()
+    middleware = WSGITracingMiddleware(_app('500 INTERNAL SERVER ERROR', []), m_tracer, exclude_from_posting=True)
+
+    middleware(ENVIRON, MagicMock()).close()
+
+    m_tracer.logger.error.assert_called_with('%s - %s', '500 INTERNAL SERVER ERROR', 'http://localhost/test_path')
+    m_tracer.end_traced_span.assert_called_once_with(True)
+
+
+def test_WSGITracingMiddleware_closes_response():
+    m_tracer = _tracer()
+    m_body = MagicMock()
+    m_body.__iter__.return_value = iter([b'test_body'])
+    middleware = WSGITracingMiddleware(_app('200 OK', m_body), m_tracer)
+
+    response = middleware(ENVIRON, MagicMock())
+    assert list(response) == [b'test_body']
+    response.close()
+
+    m_body.close.assert_called_once()
+    m_tracer.end_traced_span.assert_called_once_with(False)
+
+
+def test_WSGITracingMiddleware_app_exception():
+    class TestException(Exception):
+        pass
+
+    def app(environ, start_response):
+        raise m_exception
+
+    m_tracer = _tracer()
+    m_exception = TestException()
+    middleware = WSGITracingMiddleware(app, m_tracer)
+
+    with pytest.raises(TestException):
+        middleware(ENVIRON, MagicMock())
+
+    m_tracer.logger.exception.assert_called_with(m_exception)
+    m_tracer.end_traced_span.assert_called_once_with(False)
+
+
+def test_WSGITracingMiddleware_body_exception():
+    class TestException(Exception):
+        pass
+
+    def body():
+        yield b'test_body'
+        raise m_exception
+
+    m_tracer = _tracer()
+    m_exception = TestException()
+    middleware = WSGITracingMiddleware(_app('200 OK', body()), m_tracer)
+
+    response = middleware(ENVIRON, MagicMock())
+    with pytest.raises(TestException):
+        list(response)
+    response.close()
+
+    m_tracer.logger.exception.assert_called_with(m_exception)
+    m_tracer.end_traced_span.assert_called_once_with(False)